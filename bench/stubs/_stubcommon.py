@@ -0,0 +1,27 @@
+"""
+仿真器替身的公共部分：读取输出模板、按环境变量注入延迟、由输入内容派生确定性的扰动
+
+  PIM_STUB_LATENCY              所有替身每次调用的附加延迟 (秒)
+  PIM_STUB_LATENCY_<TOOL>       单个替身的延迟，TOOL 为 MAPPER / ACCELERGY / RAMULATOR / BOOKSIM
+"""
+import os
+import time
+import hashlib
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "fixtures")
+
+def fixture(name):
+    with open(os.path.join(FIXTURES_DIR, name), 'r') as f: return f.read()
+
+def delay(tool):
+    value = os.environ.get(f"PIM_STUB_LATENCY_{tool.upper()}", os.environ.get("PIM_STUB_LATENCY", "0"))
+    try:
+        seconds = float(value)
+    except ValueError:
+        seconds = 0.0
+    if seconds > 0: time.sleep(seconds)
+
+def jitter(data, lo, hi, salt=""):
+    """data (bytes) 的哈希映射到 [lo, hi)：同一输入总是得到同一结果"""
+    h = int(hashlib.sha1(salt.encode() + data).hexdigest()[:8], 16) / float(1 << 32)
+    return lo + (hi - lo) * h
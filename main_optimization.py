@@ -1,6 +1,9 @@
 import os
 import sys
+import json
+import math
 import time
+import argparse
 import numpy as np
 import warnings
 
@@ -14,23 +17,41 @@ if os.path.exists(TIMELOOP_LIB_PATH):
     if TIMELOOP_LIB_PATH not in current_ld_path:
         os.environ["LD_LIBRARY_PATH"] = TIMELOOP_LIB_PATH + ":" + current_ld_path
 
-from skopt import Optimizer
-from skopt.space import Integer
-from sklearn.gaussian_process import GaussianProcessRegressor
-from sklearn.gaussian_process.kernels import Matern, WhiteKernel
-
 from modules.arch_gen import ArchGenerator
 from modules.wrapper_timeloop import TimeloopWrapper
 from modules.wrapper_ramulator import RamulatorWrapper
 from modules.trace_gen import TraceGenerator
-from modules.visualizer import C_GREEN, C_RED, C_YELLOW, C_BLUE, C_PURPLE, C_CYAN, C_END, AsyncSpinner
+from modules.visualizer import C_GREEN, C_RED, C_YELLOW, C_BLUE, C_PURPLE, C_CYAN, C_END, AsyncSpinner, log_line
 from modules.data_logger import DataLogger
 from modules.evaluation_engine import CoDesignEvaluator
-from modules.workload_manager import WorkloadManager
+from modules.layer_subset import hw_features
+from modules.workload_manager import WorkloadManager, DEFAULT_INPUT_SIZE, parse_spec
 from modules.software_optimizer import SoftwareOptimizer
+from modules.optimizer_turbo import MultiTuRBO
+from modules.surrogate import FastReestimator, StageCostModel
+from modules.job_broker import DirectoryJobBroker, EvaluationWorker
+from modules import tracing
+from modules.tracing import span
+from modules.metrics import REGISTRY, MetricsServer
 
 MAX_ITERATIONS = 15  
 TURBO_BATCH_SIZE = 20 
+TURBO_NUM_REGIONS = 3    # TuRBO-m 的信赖域个数
+TURBO_PROPOSALS = 3      # 每轮提出的候选硬件点 (可并行评估)
+BUDGET_MAX_ITERATIONS = 100000  # 时间预算模式下的迭代上限 (实际由预算决定)
+COST_EI_TOLERANCE = 0.1  # 代价感知 EI：改进相差不超过 10% 视为相近，优先更便宜的候选
+# 默认工作负载 (model, input_size, weight)；目标为各模型 EDP 的加权和
+DEFAULT_WORKLOADS = [("resnet18", DEFAULT_INPUT_SIZE, 1.0)]
+
+# 运行指标 (--metrics-port 时通过 HTTP 暴露)
+M_EVALS = REGISTRY.counter("pimdse_evaluations_total", "Completed hardware-point evaluations", ["status"])
+M_EVAL_SECONDS = REGISTRY.histogram("pimdse_evaluation_seconds", "Wall time per hardware-point evaluation")
+M_STAGE_SECONDS = REGISTRY.histogram("pimdse_stage_seconds", "Wall time per simulated layer and stage", ["stage"])
+M_EVALS_PER_HOUR = REGISTRY.gauge("pimdse_evaluations_per_hour", "Evaluation throughput since the engine started")
+M_INCUMBENT_EDP = REGISTRY.gauge("pimdse_incumbent_edp", "Best EDP found so far")
+M_TR_LENGTH = REGISTRY.gauge("pimdse_trust_region_length", "Current TuRBO trust-region side length", ["region"])
+M_QUEUE = REGISTRY.gauge("pimdse_queue_jobs", "Distributed job queue depth", ["state"])
+M_WORKERS = REGISTRY.gauge("pimdse_live_workers", "Workers with a fresh heartbeat")
 
 CONFIG = {
     'AREA_LIMIT_MM2': 48.0,      
@@ -42,202 +63,570 @@ CONFIG = {
     'TECHNOLOGY': "28nm",
     'MAC_CLASS': 'intmac',
     'WORD_BITS': 16,
-    'DRAM_WIDTH': 64
+    'DRAM_WIDTH': 64,
+    # 单层仿真的临时目录根 (None: PIM_SCRATCH_ROOT 环境变量 / /dev/shm / 系统临时目录)
+    'SCRATCH_ROOT': None,
+    # 从临时目录复制回 output/iter_N/<layer>/ 的输出文件 (文件名通配符)
+    'SCRATCH_PERSIST': ['timeloop-input.yaml', 'timeloop-mapper.stats.txt', 'timeloop-mapper.map.txt',
+                        '*.ERT.yaml', '*.ART.yaml', '*.stats', 'booksim.log'],
+    # Accelergy ERT / ART 缓存 (按架构文件 + 组件库内容哈希)，关闭后每次 mapper 调用都重新运行 Accelergy
+    'ERT_CACHE': True,
+    'ERT_CACHE_DIR': "output/ert_cache",
+    # 单层并行调度：可用核心数 (None: PIM_CORES 环境变量 / CPU 亲和性) 与单个 mapper 的线程上限
+    'SCHED_CORES': None,
+    'MAPPER_MAX_THREADS': 8,
+    # Ramulator 按通道分片并行仿真 (见 modules/wrapper_ramulator.SHARDING_DEFAULTS)
+    'RAM_SHARDING': {'enabled': True, 'min_requests': 50000, 'validate_lines': 2000, 'tolerance': 0.02},
+    # 仿真器子进程策略 (按仿真器名覆盖 modules/sim_runner.DEFAULT_LIMITS，'default' 作用于全部)
+    #   timeout_s: 墙钟超时，超时杀掉整个进程组 | mem_mb: RLIMIT_AS | cpu_s: RLIMIT_CPU
+    #   retries / backoff_s: 瞬时性失败 (oom / signal / launch) 的重试次数与初始退避
+    'SIM_LIMITS': {
+        'timeloop-mapper': {'timeout_s': 120, 'mem_mb': None, 'cpu_s': None},
+        'ramulator': {'timeout_s': 30},
+        'booksim': {'timeout_s': 15},
+    },
+    # 分支定界剪枝的剩余层能耗下界：0 (默认) 只用算力周期的解析下界，剪枝是严格的；
+    # > 0 时改用该层历史最小能耗 x BOUND_SLACK (来自其它硬件点，不是严格下界)，剪枝更激进但是近似的，
+    # 这类剪枝结果不交给代理模型
+    'BOUND_SLACK': 0.0,
+    # 代表层子集评估 (--layer-subset 启用，见 modules/layer_subset.py)：
+    #   fraction / min_layers: 代表层占比与下限 | min_history: 开始外推前每层所需的完整评估次数
+    #   top_k: 外推 EDP 的乐观下限 (exp(-z x 标准差)) 优于第 top_k 好的完整评估时补齐全部层
+    #   audit_every: 每 N 个只外推的候选抽查一个完整评估，用于校准误差
+    'LAYER_SUBSET': {'enabled': False, 'fraction': 0.3, 'min_layers': 2, 'min_history': 8, 'top_k': 5, 'z': 2.0,
+                     'audit_every': 10},
 }
 
-class FastReestimator:
-    def __init__(self):
-        kernel = Matern(length_scale=1.0, length_scale_bounds=(1e-2, 1e5), nu=2.5) + \
-                 WhiteKernel(noise_level=1e-5, noise_level_bounds=(1e-9, 1e-1))
-        self.model = GaussianProcessRegressor(kernel=kernel, n_restarts_optimizer=5, normalize_y=True)
-        self.X_history = []
-        self.y_history = []
-        self.is_fitted = False
-
-    def update(self, hw_params, performance_metric):
-        self.X_history.append(hw_params)
-        self.y_history.append(performance_metric) 
-        if len(self.X_history) >= 3:
-            try:
-                self.model.fit(np.array(self.X_history), np.array(self.y_history))
-                self.is_fitted = True
-            except: pass
-
-    def predict(self, hw_params):
-        if not self.is_fitted: return np.random.rand() 
-        pred, std = self.model.predict(np.array([hw_params]), return_std=True)
-        return pred[0] + 1.96 * std[0] 
+# 硬件搜索空间 [mesh_x, mesh_y, pe, sram_log2]
+HW_BOUNDS = [(1, 4), (1, 4), (4, 32), (18, 25)]
+HW_NAMES = ['mesh_x', 'mesh_y', 'pe', 'sram_log2']
+INIT_CENTER = [2, 2, 16, 21]
+
+def hw_space():
+    from skopt.space import Integer
+    return [Integer(*b, name=n) for b, n in zip(HW_BOUNDS, HW_NAMES)]
+
+def build_search(space, seed=None):
+    """
+    代理模型 + TuRBO-m 信赖域 (engine 与 modules.search_bench 共用，基准测的就是 engine 的搜索)
+    失败容忍度按 TuRBO 论文取 ceil(max(4, dim) / q)
+    """
+    surrogate = FastReestimator()
+    turbo = MultiTuRBO(
+        space, surrogate,
+        n_regions=TURBO_NUM_REGIONS, n_candidates=TURBO_BATCH_SIZE,
+        init_centers=[INIT_CENTER], seed=seed,
+        fail_tol=int(np.ceil(max(4, len(space)) / TURBO_PROPOSALS))
+    )
+    return surrogate, turbo
+
+def search_target(edp):
+    """代理模型的回归目标 (越大越好)"""
+    return -np.log10(edp + 1e-9)
+
+def tell_search(surrogate, turbo, hw_params, edp, region, is_bound=False, estimate=False, heuristic=False):
+    """
+    把一次评估结果告知代理模型与对应信赖域，返回回归目标值
+    is_bound: edp 是分支定界的下界；estimate: edp 是代表层子集外推值 (代理模型按普通样本使用)。
+    heuristic: 下界来自启发式能耗估计 (BOUND_SLACK > 0)，既不是精确值也不是可靠的界，不告知代理模型。
+    这些都不是精确值，信赖域只计为未改进，不会成为区域最优
+    """
+    target_val = search_target(edp)
+    if not heuristic: surrogate.update(hw_params, target_val, is_bound=is_bound)
+    # TuRBOState 以最小化为目标
+    turbo.tell(hw_params, -target_val, region, is_bound=is_bound or estimate)
+    return target_val
+
+def arch_params(hw_params):
+    """硬件参数 [mesh_x, mesh_y, pe, sram_log2] -> 架构模板参数 (ArchGenerator.generate_config / generate_batch)"""
+    sram_sz = 2 ** hw_params[3]
+    return {
+        'MESH_X': hw_params[0], 
+        'MESH_Y': hw_params[1], 
+        'NUM_NODES': hw_params[0] * hw_params[1], 
+        'PE_DIM_X': hw_params[2], 
+        'PE_DIM_Y': hw_params[2], 
+        'SRAM_DEPTH': sram_sz // 64, 
+        'SRAM_WIDTH': 64,
+        'GLOBAL_CYCLE_SECONDS': CONFIG['GLOBAL_CYCLE_SECONDS'],
+        'TECHNOLOGY': CONFIG['TECHNOLOGY'],
+        'MAC_CLASS': CONFIG['MAC_CLASS'],
+        'WORD_BITS': CONFIG['WORD_BITS'],
+        'DRAM_WIDTH': CONFIG['DRAM_WIDTH']
+    }
 
 class DecoupledCoDesignEngine:
-    def __init__(self):
-        self.logger = DataLogger(CONFIG)
+    def __init__(self, resume_dir=None, broker_dir=None, time_budget=None, workloads=None, trace=False, metrics_port=None):
+        if workloads is None and resume_dir is not None:
+            workloads = self._load_run_workloads(resume_dir)
+        self.workload_specs = workloads or DEFAULT_WORKLOADS
+        self.logger = DataLogger({**CONFIG, 'WORKLOADS': [
+            {'model': m, 'input_size': list(s), 'weight': w} for m, s, w in self.workload_specs]}, resume_dir=resume_dir)
+        # 阶段追踪：事件写入 run 目录下的 trace/，结束时导出 Chrome trace 与汇总表
+        if trace:
+            tracing.enable(os.path.join(self.logger.get_results_dir(), "trace"))
         self.cwd = os.getcwd()
+        # 时间预算模式：以墙钟时间 (秒) 而非迭代次数作为终止条件
+        self.time_budget = time_budget
+        self.start_time = time.time()
+        self.max_iter = MAX_ITERATIONS if time_budget is None else BUDGET_MAX_ITERATIONS
+        self.max_iter_disp = str(MAX_ITERATIONS) if time_budget is None else "∞"
+        self.eval_times = []
+        # 有效评估点 (iter, edp, area)，用于产物保留策略
+        self.artifact_points = []
+        # 完整评估的 EDP (代表层子集模式的 top-k 门限)
+        self.full_edps = []
+        # 分布式模式：评估任务交给共享队列上的 worker 进程
+        self.broker = DirectoryJobBroker(broker_dir) if broker_dir else None
         self._init_modules()
         self._init_space()
         
         self.best_result = {'hw': None, 'sw': None, 'edp': float('inf')}
-        self.surrogate = FastReestimator()
-        self.tr_length = 4.0 
-        self.fail_count = 0
-        self.succ_count = 0
+        # TuRBO-m: 多个独立信赖域
+        self.surrogate, self.turbo = build_search(self.space)
+        self.cost_model = StageCostModel()
+        if self.time_budget is not None:
+            self.turbo.cost_fn = self.cost_model.predict_total
+            self.turbo.cost_tolerance = COST_EI_TOLERANCE
+
+        self._init_metrics(metrics_port)
 
         # [修改] 增加 Tot(C) 列
         self.HEADER = "{:<4}|{:<5}|{:<5}|{:<6}|{:<5}| {:<7}|{:<7}| {:<7}|{:<7}| {:<7}|{:<7}| {:<7}| {:<8}"
         self.DIVIDER = "-" * 145
 
+    @staticmethod
+    def _load_run_workloads(run_dir):
+        """续跑时沿用原实验的工作负载设置"""
+        try:
+            with open(os.path.join(run_dir, "experiment_metadata.json"), 'r') as f:
+                meta = json.load(f)
+            return [(w['model'], tuple(w['input_size']), w['weight']) for w in meta['WORKLOADS']]
+        except (OSError, ValueError, KeyError):
+            return None
+
     def _init_modules(self):
         print(f"{C_BLUE}>>> Initializing Modules...{C_END}")
         self.wm = WorkloadManager(config_dir="configs/prob/generated")
-        self.prob_paths = self.wm.generate_full_model("resnet18")
+        self._init_workloads()
         self.arch_gen = ArchGenerator(template_path="templates/arch.yaml.jinja2", output_dir="output/generated_arch")
         self.sw_opt = SoftwareOptimizer(config_dir="output/generated_configs")
         self.evaluator = CoDesignEvaluator(self.arch_gen, TimeloopWrapper(), RamulatorWrapper(), TraceGenerator("output/dram.trace"), CONFIG)
 
+    def _init_metrics(self, port):
+        M_EVALS_PER_HOUR.set_function(lambda: len(self.eval_times) * 3600.0 / max(1e-9, time.time() - self.start_time))
+        self._update_search_metrics()
+        self.metrics_server = None
+        if port is not None:
+            self.metrics_server = MetricsServer(port).start()
+            print(f"{C_CYAN}  [Metrics] serving {self.metrics_server.url}{C_END}")
+
+    def _update_search_metrics(self):
+        if math.isfinite(self.best_result['edp']): M_INCUMBENT_EDP.set(self.best_result['edp'])
+        M_TR_LENGTH.clear()
+        for k, length in enumerate(self.turbo.lengths()):
+            M_TR_LENGTH.set(length, region=str(k))
+
+    def _init_workloads(self):
+        """
+        生成全部工作负载并合并为唯一形状集合：self.prob_paths 为需要评估的形状文件，
+        self.workloads 记录每个模型的权重与逐层形状文件 (重复形状在不同模型间共享评估结果)
+        """
+        self.wm.generate_batch([(m, s) for m, s, _ in self.workload_specs])
+        self.workloads = {}
+        for model_name, input_size, weight in self.workload_specs:
+            layers = self.wm.shape_files(model_name, input_size)
+            if not layers:
+                raise RuntimeError(f"Workload {model_name} {input_size} produced no layers")
+            self.workloads[self.wm.workload_name(model_name, input_size)] = {'weight': weight, 'layers': layers}
+        self.prob_paths = list(dict.fromkeys(p for wl in self.workloads.values() for p in wl['layers']))
+        n_layers = sum(len(wl['layers']) for wl in self.workloads.values())
+        print(f"{C_CYAN}  [Workload] {len(self.workloads)} workload(s), {n_layers} layers -> {len(self.prob_paths)} unique shapes{C_END}")
+
     def _init_space(self):
-        self.bounds = [(1, 4), (1, 4), (4, 32), (18, 25)]
-        self.space = [Integer(*b, name=n) for b, n in zip(self.bounds, ['mesh_x', 'mesh_y', 'pe', 'sram_log2'])]
+        self.bounds = HW_BOUNDS
+        self.space = hw_space()
+
+    def _topk_edp(self):
+        """代表层子集模式：第 top_k 好的完整评估 EDP (不足 top_k 个时为 inf，全部补齐)；未启用时为 None"""
+        subset = CONFIG['LAYER_SUBSET']
+        if not subset.get('enabled'): return None
+        k = subset.get('top_k', 5)
+        return sorted(self.full_edps)[k - 1] if len(self.full_edps) >= k else float('inf')
 
     def _print_step(self, iter_id, step_id, step_name):
-        sys.stdout.write(f"\r{C_BLUE}  Iter {iter_id}/{MAX_ITERATIONS} | Step {step_id}/3 : {step_name:<35}{C_END}\033[K")
-        sys.stdout.flush()
+        log_line(f"{C_BLUE}  Iter {iter_id}/{self.max_iter_disp} | Step {step_id}/3 : {step_name:<35}{C_END}")
 
     def _print_header(self):
         print(f"\n{self.DIVIDER}")
         print(self.HEADER.format("It", "Mesh", "PE", "SRAM", "Area", "Log(W)", "Log(C)", "Mem(W)", "Mem(C)", "NoC(W)", "NoC(C)", "Tot(C)", "Status"))
         print(f"{self.DIVIDER}")
 
-    def _get_trust_region_space(self, center):
-        new_space = []
-        names = ['mesh_x', 'mesh_y', 'pe', 'sram_log2']
-        for i, (low, high) in enumerate(self.bounds):
-            L = int(self.tr_length)
-            c = center[i]
-            local_low = max(low, c - L)
-            local_high = min(high, c + L)
-            if local_low > local_high: local_high = local_low
-            new_space.append(Integer(local_low, local_high, name=names[i]))
-        return new_space
+    def _propose_batch(self, iter_id):
+        """
+        Step 3: 由 TuRBO-m 提出一批候选点，编号从 iter_id 开始
+        返回 [(iter_id, hw_params, region_idx), ...]
+        """
+        n_points = min(TURBO_PROPOSALS, self.max_iter - iter_id + 1)
+        tr_disp = ",".join(f"{l:.2f}" for l in self.turbo.lengths())
+        msg_step3 = f"  {C_BLUE}Iter {iter_id}/{self.max_iter_disp} | Step 3/3 : HW Opt (TuRBO-m TR=[{tr_disp}]){C_END}"
+        with AsyncSpinner(msg_step3), span("propose", cat="search", n=n_points):
+            proposals = self.turbo.ask(n_points)
+        proposals = self._fit_to_budget(proposals)
 
-    def run(self):
-        print(f"\n{C_GREEN}=== Algorithm 1: Decoupled Iteration Co-Design Started ==={C_END}")
-        current_hw_params = [2, 2, 16, 21] 
-        self._print_header()
+        batch = []
+        for k, (hw, region) in enumerate(proposals):
+            # 先记下待评估的点，崩溃后可按同一个点续跑并复用已完成的层
+            self.logger.append_journal({'type': 'proposal', 'iter': iter_id + k, 'hw': hw, 'region': region})
+            batch.append((iter_id + k, hw, region))
+        return batch
 
-        for i in range(MAX_ITERATIONS):
-            iter_id = i + 1
-            
-            # --- Step 1 ---
-            msg_step1 = f"  {C_BLUE}Iter {iter_id}/{MAX_ITERATIONS} | Step 1/3 : Software Optimization{C_END}"
-            with AsyncSpinner(msg_step1):
-                stats_dir = os.path.join(self.cwd, f"output/iter_{iter_id}")
-                if not os.path.exists(stats_dir): os.makedirs(stats_dir)
-                
-                sram_sz = 2 ** current_hw_params[3]
-                
-                arch_file = self.arch_gen.generate_config({
-                    'MESH_X': current_hw_params[0], 
-                    'MESH_Y': current_hw_params[1], 
-                    'NUM_NODES': current_hw_params[0] * current_hw_params[1], 
-                    'PE_DIM_X': current_hw_params[2], 
-                    'PE_DIM_Y': current_hw_params[2], 
-                    'SRAM_DEPTH': sram_sz // 64, 
-                    'SRAM_WIDTH': 64,
-                    'GLOBAL_CYCLE_SECONDS': CONFIG['GLOBAL_CYCLE_SECONDS'],
-                    'TECHNOLOGY': CONFIG['TECHNOLOGY'],
-                    'MAC_CLASS': CONFIG['MAC_CLASS'],
-                    'WORD_BITS': CONFIG['WORD_BITS'],
-                    'DRAM_WIDTH': CONFIG['DRAM_WIDTH']
-                }, filename=f"arch_iter_{iter_id}.yaml")
-                
-                hw_cfg = {
-                    'num_nodes': current_hw_params[0] * current_hw_params[1], 
-                    'pe': current_hw_params[2], 
-                    'sram_log2': current_hw_params[3], 
-                    'arch_file': arch_file
-                }
-                current_sw_schedule = self.sw_opt.optimize(hw_cfg, self.prob_paths, iter_id)
-            
-            # --- Step 2 ---
-            edp, cycles, energy, area, details = self.evaluator.evaluate_system(
-                hw_cfg, current_sw_schedule, stats_dir, "configs/arch/components", 
-                iter_context={'iter': iter_id, 'max_iter': MAX_ITERATIONS}
-            )
+    def _fit_to_budget(self, proposals):
+        """时间预算模式：只保留预测耗时仍能在剩余预算内完成的候选"""
+        if self.time_budget is None or not proposals: return proposals
+        remaining = self.time_budget - (time.time() - self.start_time)
+        if remaining <= 0: return []
+        if not self.eval_times: return proposals
+
+        costs = self.cost_model.predict_total([hw for hw, _ in proposals])
+        kept, used = [], 0.0
+        for (hw, region), cost in zip(proposals, costs):
+            # 分布式模式下同批候选并行执行，按最长者计；本地串行按累加计
+            used = max(used, cost) if self.broker else used + cost
+            if used > remaining: break
+            kept.append((hw, region))
+        return kept
+
+    def _report_progress(self, iter_id):
+        """打印已用时间与预计完成时间"""
+        if not self.eval_times: return
+        elapsed = time.time() - self.start_time
+        avg = float(np.mean(self.eval_times))
+        if self.time_budget is None:
+            remaining = max(0, self.max_iter - iter_id + 1) * avg
+            more_disp = f"{max(0, self.max_iter - iter_id + 1)} evals left"
+        else:
+            remaining = max(0.0, self.time_budget - elapsed)
+            budget_disp = f"budget {self.time_budget / 3600.0:.2f}h"
+            # 缓存命中 / 复用的评估耗时可能为 0，此时无法估算剩余次数
+            more_disp = f"~{int(remaining // avg)} more evals, {budget_disp}" if avg > 0 else budget_disp
+        finish = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time() + remaining))
+        elapsed_disp = time.strftime('%H:%M:%S', time.gmtime(elapsed))
+        log_line(f"{C_CYAN}  [Time] elapsed {elapsed_disp} | avg {avg:.1f}s/eval | projected finish {finish} ({more_disp}){C_END}")
+
+    def _search_state(self):
+        return {
+            'turbo': self.turbo.state_dict(),
+            'best_result': self.best_result,
+            # 累计运行时间 (含之前各次续跑)，续跑时时间预算与吞吐量从这里接着算
+            'elapsed_s': time.time() - self.start_time
+        }
+
+    def _restore_from_journal(self):
+        """
+        根据评估日志重建代理模型与 TuRBO-m 状态
+        返回 (下一个迭代号, 已提出但尚未评估的候选批次)
+        """
+        records = self.logger.load_journal()
+        evals = [r for r in records if r.get('type') == 'evaluation']
+        last_iter = evals[-1]['iter'] if evals else 0
+        pending = [(r['iter'], r['hw'], r['region']) for r in records
+                   if r.get('type') == 'proposal' and r['iter'] > last_iter]
+        if not evals:
+            return 1, pending
+
+        known = [r for r in evals if not r['details'].get('bound_heuristic', False)]
+        self.surrogate.load_history([r['hw'] for r in known], [r['target'] for r in known],
+                                    [r['details'].get('is_bound', False) for r in known])
+        self.eval_times = [r.get('eval_time_s', 0.0) for r in evals]
+        self.artifact_points = [(r['iter'], r['edp'], r['area']) for r in evals
+                                if r['status'] in ("OK", "NewBest") and not r['details'].get('is_bound', False)]
+        self.full_edps = [r['edp'] for r in evals if r['status'] in ("OK", "NewBest") and not r['details'].get('is_bound', False)]
+        # 代表层子集模型的历史：所有层都已运行的完整评估
+        for r in evals:
+            self._observe_subset(r['hw'], r['edp'], r['status'], r['details'])
+        full = [r for r in evals if not r['details'].get('is_bound', False) and r['status'] != "Estimated"]
+        self.cost_model.load_history([r['hw'] for r in full], [r['details'].get('stage_times', {}) for r in full],
+                                     [r.get('eval_time_s', 0.0) for r in full])
+        state = evals[-1]['state']
+        self.turbo.load_state_dict(state['turbo'], evaluated=[r['hw'] for r in evals])
+        self.best_result = state['best_result']
+        # 旧版本日志没有 elapsed_s，以评估耗时之和近似
+        self.start_time -= state.get('elapsed_s', sum(self.eval_times))
+
+        print(f"{C_YELLOW}>>> Resumed {len(evals)} evaluations from {self.logger.get_results_dir()} "
+              f"(Best EDP: {self.best_result['edp']:.2e}, {len(pending)} pending){C_END}")
+        return last_iter + 1, pending
+
+    def _prepare_candidate(self, iter_id, current_hw_params):
+        """Step 1: 生成架构文件并做软件优化，返回 (hw_cfg, sw_schedule, stats_dir)"""
+        msg_step1 = f"  {C_BLUE}Iter {iter_id}/{self.max_iter_disp} | Step 1/3 : Software Optimization{C_END}"
+        with AsyncSpinner(msg_step1), span("prepare_candidate", cat="search", iter=iter_id):
+            stats_dir = os.path.join(self.cwd, f"output/iter_{iter_id}")
+            if not os.path.exists(stats_dir): os.makedirs(stats_dir)
             
-            # --- Result Logic ---
-            status_str, color = "OK", C_END
-            is_success = False
+            # 按内容命名 (arch_<hash>.yaml)：重复出现的硬件点复用同一文件，内容未变时不重写
+            arch_file = self.arch_gen.generate_batch([arch_params(current_hw_params)])[0]
             
-            if area > CONFIG['AREA_LIMIT_MM2']:
-                status_str, color = "AreaVio", C_RED
-            elif edp > 1e25: 
-                status_str, color = "Failed", C_RED
-            elif edp < self.best_result['edp']:
-                status_str, color = "NewBest", C_GREEN
-                self.best_result = {'hw': current_hw_params, 'sw': current_sw_schedule, 'edp': edp}
-                is_success = True 
-
-            if is_success:
-                self.succ_count += 1
-                self.fail_count = 0
-                if self.succ_count >= 2: 
-                    self.tr_length = min(self.tr_length * 2.0, 8.0)
-                    self.succ_count = 0
+            hw_cfg = {
+                'num_nodes': current_hw_params[0] * current_hw_params[1], 
+                'pe': current_hw_params[2], 
+                'sram_log2': current_hw_params[3], 
+                'arch_file': arch_file
+            }
+            current_sw_schedule = self.sw_opt.optimize(hw_cfg, self.prob_paths, iter_id)
+            current_sw_schedule['workloads'] = self.workloads
+        return hw_cfg, current_sw_schedule, stats_dir
+
+    def _observe_subset(self, hw, edp, status_str, details):
+        """
+        完整评估 (全部层都已运行) 计入代表层子集模型的历史；曾做过子集外推的还用真实 EDP 校准误差
+        本地评估时 evaluate_system 已自行记录，这里用于续跑恢复与分布式模式 (worker 的结果只回到调度端)
+        """
+        layers = details.get('layers') or {}
+        if status_str not in ("OK", "NewBest") or details.get('is_bound', False) or \
+                len(layers) != details.get('layers_total'):
+            return
+        subset = self.evaluator.layer_subset
+        if details.get('subset'): subset.calibrate(details['subset']['edp_est'], edp)
+        subset.observe(hw_features({'num_nodes': hw[0] * hw[1], 'pe': hw[2], 'sram_log2': hw[3]}), layers)
+
+    def _record_result(self, iter_id, current_hw_params, region, current_sw_schedule, result, eval_time):
+        """结果判定、打印表格行、更新代理模型、代价模型与信赖域并写入评估日志"""
+        edp, cycles, energy, area, details = result
+        sram_sz = 2 ** current_hw_params[3]
+        is_bound = details.get('is_bound', False)
+
+        # --- Result Logic ---
+        status_str, color = "OK", C_END
+        
+        if area > CONFIG['AREA_LIMIT_MM2']:
+            status_str, color = "AreaVio", C_RED
+        elif edp > 1e25: 
+            status_str, color = "Failed", C_RED
+        elif is_bound:
+            # 分支定界提前放弃：edp 只是下界，且已证明劣于当前最优
+            status_str, color = "Pruned", C_YELLOW
+        elif details.get('is_estimate'):
+            # 代表层子集外推：乐观下限也进不了 top-k，不补齐其余层
+            status_str, color = "Estimated", C_YELLOW
+        elif edp < self.best_result['edp']:
+            status_str, color = "NewBest", C_GREEN
+            self.best_result = {'hw': current_hw_params, 'sw': current_sw_schedule, 'edp': edp}
+
+        # 计算详细功率 (W)
+        sram_disp = f"{sram_sz//1024}K" if sram_sz < 1024*1024 else f"{sram_sz//1024//1024}M"
+        mesh_disp = f"{current_hw_params[0]}x{current_hw_params[1]}"
+        pe_disp = f"{current_hw_params[2]}x{current_hw_params[2]}"
+        
+        def calc_w(eng, cyc):
+            if cyc <= 0: return 0.0
+            return (eng * 1e-12) / (cyc * CONFIG['GLOBAL_CYCLE_SECONDS'])
+
+        p_log = calc_w(details.get('logic_E', 0), details.get('logic_C', 0))
+        p_mem = calc_w(details.get('dram_E', 0),  details.get('dram_C', 0))
+        p_noc = calc_w(details.get('noc_E', 0),   details.get('noc_C', 0))
+        
+        row_str = self.HEADER.format(
+            iter_id, mesh_disp, pe_disp, sram_disp, 
+            f"{area:.1f}", 
+            f"{p_log:.2f}", f"{details.get('logic_C', 0):.1e}", 
+            f"{p_mem:.2f}", f"{details.get('dram_C', 0):.1e}",
+            f"{p_noc:.2f}", f"{details.get('noc_C', 0):.1e}",
+            f"{details.get('total_C', 0):.1e}", # [新增] 显示 Total Cycles
+            status_str
+        )
+        log_line(f"{color}{row_str}{C_END}")
+        if status_str == "Failed" and details.get('failure'):
+            fail = details['failure']
+            log_line(f"{C_RED}       {fail.get('layer')}: {fail.get('simulator')} {fail.get('kind')} "
+                     f"(attempts={fail.get('attempts', 1)}){C_END}")
+        if status_str == "Estimated":
+            lo, hi = details['subset']['edp_interval']
+            log_line(f"{C_YELLOW}       {len(details['subset']['layers'])}/{details.get('layers_total')} layers, "
+                     f"EDP {edp:.2e} [{lo:.2e}, {hi:.2e}]{C_END}")
+        if status_str == "NewBest" and len(details.get('workload_edp', {})) > 1:
+            per_model = " | ".join(f"{name}: {val:.2e}" for name, val in details['workload_edp'].items())
+            log_line(f"{C_CYAN}       EDP per workload: {per_model}{C_END}")
+
+        target_val = tell_search(self.surrogate, self.turbo, current_hw_params, edp, region, is_bound=is_bound,
+                                 estimate=status_str == "Estimated", heuristic=details.get('bound_heuristic', False))
+        self.eval_times.append(eval_time)
+        M_EVALS.inc(status=status_str)
+        M_EVAL_SECONDS.observe(eval_time)
+        for layer in details.get('layers', {}).values():
+            if layer.get('cached'): continue
+            for stage, sec in layer.get('stage_times', {}).items():
+                M_STAGE_SECONDS.observe(sec, stage=stage)
+        self._update_search_metrics()
+        # 被剪枝 / 只跑代表层的评估不代表该硬件点的完整评估代价
+        if not is_bound and status_str != "Estimated":
+            self.cost_model.update(current_hw_params, details.get('stage_times', {}), eval_time)
+        if status_str in ("OK", "NewBest") and not is_bound:
+            self.full_edps.append(edp)
+        if self.broker: self._observe_subset(current_hw_params, edp, status_str, details)
+
+        record = {
+            'type': 'evaluation', 'iter': iter_id, 'hw': current_hw_params, 'region': region,
+            'edp': edp, 'cycles': cycles, 'energy': energy, 'area': area,
+            'details': details, 'status': status_str, 'target': target_val,
+            'eval_time_s': eval_time, 'state': self._search_state()
+        }
+        self.logger.append_journal(record)
+        self.logger.store_evaluation(record)
+        self._archive_iteration(iter_id, current_hw_params, current_sw_schedule, status_str, edp, area, is_bound)
+        self.logger.save_checkpoint({'iter': iter_id, 'hw': current_hw_params, 'state': self._search_state(),
+                                     'X_history': self.surrogate.X_history, 'y_history': self.surrogate.y_history})
+
+    def _archive_iteration(self, iter_id, hw_params, current_sw_schedule, status_str, edp, area, is_bound):
+        """仿真产物收入去重存储并删除 output/iter_N；有效点参与 Pareto 保留策略"""
+        stats_dir = os.path.join(self.cwd, f"output/iter_{iter_id}")
+        # 架构文件已在 Step 1 生成，这里命中渲染缓存，只取其路径
+        inputs = [self.arch_gen.generate_batch([arch_params(hw_params)])[0]]
+        if current_sw_schedule:
+            inputs += [current_sw_schedule['mapper_path'], current_sw_schedule['constraints_path']]
+        self.logger.archive_artifacts(iter_id, inputs, stats_dir=stats_dir)
+        if status_str in ("OK", "NewBest") and not is_bound:
+            self.artifact_points.append((iter_id, edp, area))
+
+    def _run_batch_distributed(self, batch):
+        """Step 1 在本地完成，Step 2 整批提交给 broker，由各节点 worker 并行评估"""
+        run_tag = os.path.basename(os.path.normpath(self.logger.get_results_dir()))
+        jobs = []
+        for cand_iter, current_hw_params, region in batch:
+            hw_cfg, current_sw_schedule, stats_dir = self._prepare_candidate(cand_iter, current_hw_params)
+            payload = self.evaluator.build_job(
+                hw_cfg, current_sw_schedule, stats_dir, "configs/arch/components",
+                iter_context={'iter': cand_iter, 'max_iter': self.max_iter_disp},
+                incumbent_edp=self.best_result['edp'], topk_edp=self._topk_edp())
+            job_id = self.broker.submit(f"{run_tag}_iter_{cand_iter:04d}", payload)
+            jobs.append((job_id, cand_iter, current_hw_params, region, current_sw_schedule))
+
+        job_ids = [j[0] for j in jobs]
+        msg = f"  {C_BLUE}Iter {batch[0][0]}-{batch[-1][0]}/{self.max_iter_disp} | Step 2/3 : Distributed Evaluation{C_END}"
+        with AsyncSpinner(msg) as spinner:
+            def on_poll(done):
+                pending, running = self.broker.queue_depth()
+                M_QUEUE.set(pending, state="pending")
+                M_QUEUE.set(running, state="running")
+                M_WORKERS.set(len(self.broker.live_workers()))
+                spinner.update_message(f"{msg} {C_CYAN}[done {len(done)}/{len(job_ids)} | queued {pending} | "
+                                       f"running {running} | workers {len(self.broker.live_workers())}]{C_END}")
+            with span("distributed_wait", cat="search", jobs=len(job_ids)):
+                results = self.broker.collect(job_ids, on_poll=on_poll)
+
+        for job_id, cand_iter, current_hw_params, region, current_sw_schedule in jobs:
+            res = results[job_id]
+            if res.get('ok'):
+                result = (res['edp'], res['cycles'], res['energy'], res['area'], res['details'])
             else:
-                self.succ_count = 0
-                self.fail_count += 1
-                if self.fail_count >= 2: 
-                    self.tr_length = max(self.tr_length / 2.0, 1.0)
-                    self.fail_count = 0
-
-            # 计算详细功率 (W)
-            sram_disp = f"{sram_sz//1024}K" if sram_sz < 1024*1024 else f"{sram_sz//1024//1024}M"
-            mesh_disp = f"{current_hw_params[0]}x{current_hw_params[1]}"
-            pe_disp = f"{current_hw_params[2]}x{current_hw_params[2]}"
-            
-            def calc_w(eng, cyc):
-                if cyc <= 0: return 0.0
-                return (eng * 1e-12) / (cyc * CONFIG['GLOBAL_CYCLE_SECONDS'])
+                log_line(f"{C_RED}[Worker Failed]{C_END} iter {cand_iter}: {res.get('error')}")
+                result = (self.evaluator.PENALTY_VAL, 0, 0, 0, {})
+            self._record_result(cand_iter, current_hw_params, region, current_sw_schedule, result, res.get('elapsed_s', 0.0))
 
-            p_log = calc_w(details.get('logic_E', 0), details.get('logic_C', 0))
-            p_mem = calc_w(details.get('dram_E', 0),  details.get('dram_C', 0))
-            p_noc = calc_w(details.get('noc_E', 0),   details.get('noc_C', 0))
-            
-            row_str = self.HEADER.format(
-                iter_id, mesh_disp, pe_disp, sram_disp, 
-                f"{area:.1f}", 
-                f"{p_log:.2f}", f"{details.get('logic_C', 0):.1e}", 
-                f"{p_mem:.2f}", f"{details.get('dram_C', 0):.1e}",
-                f"{p_noc:.2f}", f"{details.get('noc_C', 0):.1e}",
-                f"{details.get('total_C', 0):.1e}", # [新增] 显示 Total Cycles
-                status_str
-            )
-            print(f"\r{color}{row_str}{C_END}\033[K") 
-
-            target_val = -np.log10(edp + 1e-9)
-            self.surrogate.update(current_hw_params, target_val)
-            
-            # --- Step 3 ---
-            msg_step3 = f"  {C_BLUE}Iter {iter_id}/{MAX_ITERATIONS} | Step 3/3 : HW Opt (TuRBO TR={self.tr_length:.1f}){C_END}"
-            with AsyncSpinner(msg_step3):
-                tr_space = self._get_trust_region_space(current_hw_params)
-                opt = Optimizer(tr_space, base_estimator="GP", acq_func="EI", n_initial_points=5)
-                best_internal_hw = current_hw_params
-                best_internal_score = -float('inf')
-                
-                for _ in range(TURBO_BATCH_SIZE):
-                    try:
-                        next_point = opt.ask()
-                        score = self.surrogate.predict(next_point)
-                        if score > best_internal_score:
-                            best_internal_score = score
-                            best_internal_hw = next_point
-                        opt.tell(next_point, -score)
-                    except: break
-            
-            current_hw_params = best_internal_hw
+    def run(self):
+        print(f"\n{C_GREEN}=== Algorithm 1: Decoupled Iteration Co-Design Started ==={C_END}")
+        iter_id, batch = self._restore_from_journal()
+        self._update_search_metrics()
+        self._print_header()
+
+        while iter_id <= self.max_iter:
+            # --- Step 3 (上一轮) : TuRBO-m 批量提案 ---
+            if not batch:
+                batch = self._propose_batch(iter_id)
+                if not batch: break
+
+            if self.broker:
+                self._run_batch_distributed(batch)
+                iter_id = batch[-1][0] + 1
+                batch = []
+                self.logger.flush_store()
+                self.logger.apply_retention(self.artifact_points)
+                self._report_progress(iter_id)
+                continue
 
+            for cand_iter, current_hw_params, region in batch:
+                t_start = time.time()
+                # --- Step 1 ---
+                hw_cfg, current_sw_schedule, stats_dir = self._prepare_candidate(cand_iter, current_hw_params)
+
+                # --- Step 2 ---
+                with span("evaluate_system", cat="search", iter=cand_iter):
+                    result = self.evaluator.evaluate_system(
+                        hw_cfg, current_sw_schedule, stats_dir, "configs/arch/components", 
+                        iter_context={'iter': cand_iter, 'max_iter': self.max_iter_disp},
+                        incumbent_edp=self.best_result['edp'], topk_edp=self._topk_edp()
+                    )
+                with span("record_result", cat="search", iter=cand_iter):
+                    self._record_result(cand_iter, current_hw_params, region, current_sw_schedule, result, time.time() - t_start)
+                iter_id = cand_iter + 1
+            batch = []
+            self.logger.flush_store()
+            self.logger.apply_retention(self.artifact_points)
+            self._report_progress(iter_id)
+
+        self.logger.flush_store()
+        self.logger.apply_retention(self.artifact_points, collect=True)
         print(f"{self.DIVIDER}\n{C_GREEN}=== Optimization Finished ==={C_END}")
         print(f"Best Config: {self.best_result['hw']} (EDP: {self.best_result['edp']:.2e})")
+        if tracing.enabled():
+            # 也可能由 PIM_TRACE_DIR 启用，事件目录不一定在 run 目录下
+            trace_dir = tracing.trace_dir()
+            print(f"\n{C_CYAN}>>> Stage profile (Chrome trace: {tracing.export_chrome(trace_dir)}){C_END}")
+            print(tracing.format_summary(tracing.summarize(trace_dir)))
+
+def parse_duration(text):
+    """'3600' / '90m' / '4h' / '1.5d' -> 秒"""
+    units = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+    text = text.strip().lower()
+    if text and text[-1] in units:
+        return float(text[:-1]) * units[text[-1]]
+    return float(text)
+
+def parse_workload(text):
+    """'model[:H[xW]][:N][=weight]' -> (model, input_size, weight)，例如 mobilenet_v2:160=0.5"""
+    spec, _, weight = text.partition("=")
+    model_name, input_size = parse_spec(spec)
+    return model_name, input_size, float(weight) if weight else 1.0
+
+def run_worker(queue_dir, max_jobs=None, idle_exit=None):
+    """Worker 模式：只构建评估器，从共享队列中领取任务并回传结果"""
+    arch_gen = ArchGenerator(template_path="templates/arch.yaml.jinja2", output_dir="output/generated_arch")
+    evaluator = CoDesignEvaluator(arch_gen, TimeloopWrapper(), RamulatorWrapper(), TraceGenerator("output/dram.trace"), CONFIG)
+    worker = EvaluationWorker(DirectoryJobBroker(queue_dir), evaluator.evaluate_job)
+    print(f"{C_GREEN}>>> Worker {worker.worker_id} serving jobs from {queue_dir}{C_END}")
+    done = worker.serve(max_jobs=max_jobs, idle_exit=idle_exit)
+    print(f"{C_GREEN}>>> Worker {worker.worker_id} finished {done} jobs{C_END}")
 
 if __name__ == "__main__":
-    DecoupledCoDesignEngine().run()
+    parser = argparse.ArgumentParser(description="Decoupled HW/SW Co-Design for 3D PIM")
+    parser.add_argument("--resume", metavar="RUN_DIR", default=None,
+                        help="continue an interrupted run from its results/run_* directory")
+    parser.add_argument("--broker", metavar="QUEUE_DIR", default=None,
+                        help="dispatch evaluations to workers through a shared job-queue directory")
+    parser.add_argument("--worker", metavar="QUEUE_DIR", default=None,
+                        help="run as an evaluation worker serving jobs from QUEUE_DIR")
+    parser.add_argument("--time-budget", metavar="DURATION", type=parse_duration, default=None,
+                        help="stop on wall-clock budget (e.g. 3600, 90m, 4h) instead of MAX_ITERATIONS; "
+                             "enables cost-aware expected improvement")
+    parser.add_argument("--workload", metavar="SPEC", action="append", type=parse_workload, default=None,
+                        help="workload to co-optimize, model[:H[xW]][:N][=weight]; repeat for several models "
+                             "(objective: weighted sum of per-model EDP, default resnet18)")
+    parser.add_argument("--trace", action="store_true",
+                        help="record stage spans to RUN_DIR/trace and export a Chrome/Perfetto trace at the end "
+                             "(workers: set PIM_TRACE_DIR)")
+    parser.add_argument("--metrics-port", type=int, default=None,
+                        help="serve Prometheus metrics on http://127.0.0.1:PORT/metrics")
+    parser.add_argument("--layer-subset", action="store_true",
+                        help="evaluate only representative layers and extrapolate the network; candidates that may "
+                             "enter the top-k get the full evaluation (see CONFIG['LAYER_SUBSET'])")
+    parser.add_argument("--max-jobs", type=int, default=None, help="worker: exit after this many jobs")
+    parser.add_argument("--idle-exit", type=float, default=None, help="worker: exit after this many idle seconds")
+    args = parser.parse_args()
+    if args.layer_subset: CONFIG['LAYER_SUBSET']['enabled'] = True
+
+    if args.worker:
+        run_worker(args.worker, max_jobs=args.max_jobs, idle_exit=args.idle_exit)
+    else:
+        DecoupledCoDesignEngine(resume_dir=args.resume, broker_dir=args.broker, time_budget=args.time_budget,
+                                workloads=args.workload, trace=args.trace, metrics_port=args.metrics_port).run()
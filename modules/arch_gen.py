@@ -1,7 +1,10 @@
 import os
+import json
+import hashlib
 import jinja2
 import yaml
 import logging
+from collections import OrderedDict
 
 # 注册 YAML 标签
 def dummy_constructor(loader, node):
@@ -16,11 +19,34 @@ def dummy_constructor(loader, node):
 for tag in ['!Container', '!Component', '!Hierarchical', '!Parallel', '!Pipelined', '!Nothing']:
     yaml.SafeLoader.add_constructor(tag, dummy_constructor)
 
+DEFAULTS = {
+    # [修改] 设置为 28nm
+    'TECHNOLOGY': '28nm', 
+    'GLOBAL_CYCLE_SECONDS': '1e-9',
+    'NUM_NODES': 1,
+    'DRAM_WIDTH': 64,
+    'WORD_BITS': 16,
+    'SRAM_WIDTH': 64,
+    'SRAM_DEPTH': 32768, 
+    'PE_DIM_X': 4,       
+    'PE_DIM_Y': 4,       
+    'MAC_CLASS': 'intmac'
+}
+
 class ArchGenerator:
+    # 渲染缓存条目上限 (每条为一份架构 YAML 文本及其解析结果，约数 KB)
+    CACHE_SIZE = 4096
+
     def __init__(self, template_path, output_dir):
         self.template_path = template_path
         self.output_dir = output_dir
         self.logger = logging.getLogger("ArchGen")
+        # 参数哈希 -> (YAML 文本, 解析后的 spec)：同一组参数只渲染、校验一次
+        self.cache = OrderedDict()
+        self.cache_hits = 0
+        self.cache_misses = 0
+        # 本进程写出的文件 -> 内容哈希，内容相同时不必再读盘比较
+        self.written = {}
         
         if not os.path.exists(output_dir):
             os.makedirs(output_dir)
@@ -29,39 +55,79 @@ class ArchGenerator:
         template_file = os.path.basename(template_path)
         self.env = jinja2.Environment(loader=jinja2.FileSystemLoader(template_dir))
         self.template = self.env.get_template(template_file)
+        # 模板内容参与缓存键，模板修改后旧条目自然失效
+        with open(template_path, 'rb') as f: self.template_digest = hashlib.sha1(f.read()).hexdigest()
+
+    def _key(self, render_context):
+        blob = json.dumps(render_context, sort_keys=True, default=str)
+        return hashlib.sha1((self.template_digest + blob).encode()).hexdigest()
+
+    def _render(self, params):
+        """返回 (缓存键, YAML 文本, spec)；命中缓存时跳过 Jinja2 渲染与 YAML 校验"""
+        render_context = {**DEFAULTS, **params}
+        key = self._key(render_context)
+        entry = self.cache.get(key)
+        if entry is not None:
+            self.cache.move_to_end(key)
+            self.cache_hits += 1
+            return key, entry[0], entry[1]
+        self.cache_misses += 1
 
-    def generate_config(self, params, filename="arch.yaml"):
         try:
-            defaults = {
-                # [修改] 设置为 28nm
-                'TECHNOLOGY': '28nm', 
-                'GLOBAL_CYCLE_SECONDS': '1e-9',
-                'NUM_NODES': 1,
-                'DRAM_WIDTH': 64,
-                'WORD_BITS': 16,
-                'SRAM_WIDTH': 64,
-                'SRAM_DEPTH': 32768, 
-                'PE_DIM_X': 4,       
-                'PE_DIM_Y': 4,       
-                'MAC_CLASS': 'intmac'
-            }
-            render_context = {**defaults, **params}
             yaml_content = self.template.render(render_context)
-            
         except Exception as e:
             self.logger.error(f"Jinja2 Rendering failed: {e}")
             raise e
 
         # 简单的 YAML 验证
         try:
-            yaml.safe_load(yaml_content)
+            spec = yaml.safe_load(yaml_content)
         except yaml.YAMLError as e:
             self.logger.error("Generated content is not valid YAML!")
             print(f"[ERROR CONTENT] {yaml_content[:200]}...") 
             raise e
 
-        output_path = os.path.join(self.output_dir, filename)
-        with open(output_path, 'w') as f:
+        self.cache[key] = (yaml_content, spec)
+        if len(self.cache) > self.CACHE_SIZE: self.cache.popitem(last=False)
+        return key, yaml_content, spec
+
+    def _write_if_changed(self, output_path, yaml_content, key):
+        """内容与磁盘上已有文件相同时不写 (保留 mtime)；否则先写临时文件再原子替换"""
+        if self.written.get(output_path) == key and os.path.exists(output_path): return False
+        try:
+            with open(output_path, 'r') as f:
+                if f.read() == yaml_content:
+                    self.written[output_path] = key
+                    return False
+        except OSError: pass
+        tmp_path = f"{output_path}.tmp{os.getpid()}"
+        with open(tmp_path, 'w') as f:
             f.write(yaml_content)
-            
+        os.replace(tmp_path, output_path)
+        self.written[output_path] = key
+        return True
+
+    def generate_config(self, params, filename="arch.yaml"):
+        key, yaml_content, _ = self._render(params)
+        output_path = os.path.join(self.output_dir, filename)
+        self._write_if_changed(output_path, yaml_content, key)
         return output_path
+
+    def generate_batch(self, params_list, filenames=None, as_spec=False):
+        """
+        批量生成架构：
+          as_spec=True  -> 返回解析后的 spec 列表，不写文件 (候选筛选用；spec 为缓存共享对象，勿修改)
+          否则          -> 返回文件路径列表；filenames 缺省时按内容命名 arch_<hash>.yaml，
+                           相同参数重复出现只渲染一次、内容未变的文件不重写
+        """
+        results = []
+        for i, params in enumerate(params_list):
+            key, yaml_content, spec = self._render(params)
+            if as_spec:
+                results.append(spec)
+                continue
+            filename = filenames[i] if filenames else f"arch_{key[:16]}.yaml"
+            output_path = os.path.join(self.output_dir, filename)
+            self._write_if_changed(output_path, yaml_content, key)
+            results.append(output_path)
+        return results
@@ -0,0 +1,234 @@
+"""
+按内容寻址的产物存储：相同内容的文件只保存一份压缩 blob，每次迭代只留一个 manifest
+
+  root/blobs/<sha[:2]>/<sha>.gz     压缩后的文件内容
+  root/manifests/<key>.json         {相对路径: {sha256, size}}，key 形如 run_x/iter_12
+
+保留策略 (retain)：只有指定的点 (最优 / Pareto 前沿) 保留完整产物，其余点的 manifest
+裁剪到少量关键文件 (单层结果、Timeloop 统计)；gc 删除不再被引用的 blob
+retain 只读写本次新裁剪的 manifest (已裁剪状态记在内存索引中)；gc 需要扫描全部 manifest 与 blob，
+应按较低频率调用 (DataLogger 每 GC_EVERY 次保留调用一次) 或用 CLI 的 gc 子命令
+"""
+import os
+import sys
+import gzip
+import json
+import time
+import shutil
+import fnmatch
+import hashlib
+import argparse
+
+# 非保留点仍然保存的文件 (按文件名匹配)
+ESSENTIAL_PATTERNS = ["layer_result.json", "*.stats.txt"]
+
+def pareto_front(points):
+    """points: [(key, edp, area)]，两个目标都最小化；返回非支配点的 key 列表"""
+    front = []
+    for key, edp, area in sorted(points, key=lambda p: (p[1], p[2])):
+        if not front or area < front[-1][2]:
+            front.append((key, edp, area))
+    return [p[0] for p in front]
+
+class ArtifactStore:
+    def __init__(self, root="output/artifacts", compress_level=6):
+        self.root = root
+        self.compress_level = compress_level
+        self.blobs_dir = os.path.join(root, "blobs")
+        self.manifests_dir = os.path.join(root, "manifests")
+        os.makedirs(self.blobs_dir, exist_ok=True)
+        os.makedirs(self.manifests_dir, exist_ok=True)
+        # {key: 是否已裁剪}，首次 retain 时从磁盘建立，此后随 _write_manifest 更新
+        self._pruned = None
+
+    def _blob_path(self, digest):
+        return os.path.join(self.blobs_dir, digest[:2], f"{digest}.gz")
+
+    def _manifest_path(self, key):
+        return os.path.join(self.manifests_dir, f"{key}.json")
+
+    # ------------------------------------------------------------
+    # 写入
+    # ------------------------------------------------------------
+    def put_file(self, path):
+        """存入单个文件，返回 (sha256, 原始大小, 是否新增 blob)"""
+        with open(path, 'rb') as f: data = f.read()
+        digest = hashlib.sha256(data).hexdigest()
+        blob = self._blob_path(digest)
+        if os.path.exists(blob):
+            # 刷新 mtime，避免并发 gc 在 manifest 写出前把它当作孤儿删除
+            os.utime(blob, None)
+            return digest, len(data), False
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        tmp_path = f"{blob}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(gzip.compress(data, compresslevel=self.compress_level))
+        os.replace(tmp_path, blob)
+        return digest, len(data), True
+
+    def ingest(self, src_dir, key, extra_files=(), remove=False):
+        """
+        把 src_dir 下的所有文件 (以及 extra_files，存为 inputs/<文件名>) 收入存储并写出 manifest
+        remove=True 时随后删除 src_dir，释放磁盘与 inode
+        返回 {'files', 'new_blobs', 'bytes'}
+        """
+        entries = {}
+        stats = {'files': 0, 'new_blobs': 0, 'bytes': 0}
+        sources = []
+        if os.path.isdir(src_dir):
+            for root, _, names in os.walk(src_dir):
+                for name in names:
+                    path = os.path.join(root, name)
+                    sources.append((os.path.relpath(path, src_dir), path))
+        sources += [(os.path.join("inputs", os.path.basename(p)), p) for p in extra_files if os.path.isfile(p)]
+
+        for rel, path in sources:
+            if os.path.islink(path) or rel.endswith(".tmp"): continue
+            try:
+                digest, size, new = self.put_file(path)
+            except OSError:
+                continue
+            entries[rel] = {'sha256': digest, 'size': size}
+            stats['files'] += 1
+            stats['new_blobs'] += int(new)
+            stats['bytes'] += size
+
+        self._write_manifest(key, {'key': key, 'pruned': False, 'files': entries})
+        if remove and os.path.isdir(src_dir):
+            shutil.rmtree(src_dir, ignore_errors=True)
+        return stats
+
+    def _write_manifest(self, key, manifest):
+        path = self._manifest_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        if self._pruned is not None: self._pruned[manifest['key']] = bool(manifest.get('pruned'))
+
+    def _pruned_index(self):
+        if self._pruned is None:
+            self._pruned = {key: bool((self.manifest(key) or {}).get('pruned')) for key in self.keys()}
+        return self._pruned
+
+    # ------------------------------------------------------------
+    # 读取
+    # ------------------------------------------------------------
+    def keys(self, prefix=""):
+        keys = []
+        for root, _, names in os.walk(self.manifests_dir):
+            for name in names:
+                if not name.endswith(".json"): continue
+                key = os.path.relpath(os.path.join(root, name), self.manifests_dir)[:-5].replace(os.sep, "/")
+                if key.startswith(prefix): keys.append(key)
+        return sorted(keys)
+
+    def manifest(self, key):
+        path = self._manifest_path(key)
+        if not os.path.exists(path): return None
+        with open(path, 'r') as f: return json.load(f)
+
+    def read(self, key, rel_path):
+        entry = (self.manifest(key) or {}).get('files', {}).get(rel_path)
+        if entry is None: return None
+        with gzip.open(self._blob_path(entry['sha256']), 'rb') as f: return f.read()
+
+    def materialize(self, key, dest_dir, pattern=None):
+        """把某次迭代的产物还原到 dest_dir (可按文件名模式过滤)，返回写出的文件列表"""
+        manifest = self.manifest(key)
+        if manifest is None:
+            raise KeyError(f"No artifacts recorded for {key}")
+        written = []
+        for rel, entry in manifest['files'].items():
+            if pattern and not fnmatch.fnmatch(os.path.basename(rel), pattern): continue
+            dst = os.path.join(dest_dir, rel)
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            with gzip.open(self._blob_path(entry['sha256']), 'rb') as src, open(dst, 'wb') as out:
+                shutil.copyfileobj(src, out)
+            written.append(dst)
+        return written
+
+    # ------------------------------------------------------------
+    # 保留策略
+    # ------------------------------------------------------------
+    def retain(self, keep_keys, prefix="", essential=ESSENTIAL_PATTERNS, collect=True):
+        """
+        prefix 下不在 keep_keys 中的 manifest 只保留 essential 文件；之前被裁剪过的点不会恢复
+        collect=True 时随后运行 gc 并返回释放的字节数，否则返回 0
+        """
+        keep_keys = set(keep_keys)
+        index = self._pruned_index()
+        for key in [k for k, pruned in index.items() if not pruned and k.startswith(prefix) and k not in keep_keys]:
+            manifest = self.manifest(key)
+            if manifest is None or manifest.get('pruned'): continue
+            manifest['files'] = {rel: e for rel, e in manifest['files'].items()
+                                 if any(fnmatch.fnmatch(os.path.basename(rel), p) for p in essential)}
+            manifest['pruned'] = True
+            self._write_manifest(key, manifest)
+        return self.gc() if collect else 0
+
+    def gc(self, grace_s=600.0):
+        """
+        删除所有 manifest 都不再引用的 blob，返回释放的 (压缩后) 字节数
+        grace_s 内写入 / 命中过的 blob 不删 (其 manifest 可能正在由其它进程写出)
+        """
+        now = time.time()
+        referenced = set()
+        for key in self.keys():
+            manifest = self.manifest(key) or {}
+            referenced.update(e['sha256'] for e in manifest.get('files', {}).values())
+        freed = 0
+        for root, _, names in os.walk(self.blobs_dir):
+            for name in names:
+                if name.endswith(".gz") and name[:-3] in referenced: continue
+                path = os.path.join(root, name)
+                try:
+                    if now - os.path.getmtime(path) < grace_s: continue
+                    freed += os.path.getsize(path)
+                    os.remove(path)
+                except OSError: pass
+        return freed
+
+    def usage(self):
+        """{'manifests', 'blobs', 'stored_bytes', 'logical_bytes'}"""
+        blobs, stored = 0, 0
+        for root, _, names in os.walk(self.blobs_dir):
+            for name in names:
+                blobs += 1
+                stored += os.path.getsize(os.path.join(root, name))
+        keys = self.keys()
+        logical = sum(e['size'] for k in keys for e in (self.manifest(k) or {}).get('files', {}).values())
+        return {'manifests': len(keys), 'blobs': blobs, 'stored_bytes': stored, 'logical_bytes': logical}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or restore archived evaluation artifacts")
+    parser.add_argument("--root", default="output/artifacts")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("ls"); p.add_argument("prefix", nargs="?", default="")
+    p = sub.add_parser("restore"); p.add_argument("key"); p.add_argument("dest"); p.add_argument("--pattern")
+    sub.add_parser("du")
+    p = sub.add_parser("gc"); p.add_argument("--grace", type=float, default=600.0)
+    args = parser.parse_args()
+
+    store = ArtifactStore(args.root)
+    if args.cmd == "ls":
+        for key in store.keys(args.prefix):
+            m = store.manifest(key)
+            print(f"{key:<40} {len(m['files']):>5} files{' (pruned)' if m.get('pruned') else ''}")
+    elif args.cmd == "restore":
+        print(f"Restored {len(store.materialize(args.key, args.dest, args.pattern))} files to {args.dest}")
+    elif args.cmd == "du":
+        u = store.usage()
+        ratio = u['logical_bytes'] / max(1, u['stored_bytes'])
+        print(f"{u['manifests']} manifests, {u['blobs']} blobs, {u['logical_bytes'] / 2**20:.1f} MiB logical, "
+              f"{u['stored_bytes'] / 2**20:.1f} MiB stored ({ratio:.1f}x)")
+    elif args.cmd == "gc":
+        print(f"Freed {store.gc(grace_s=args.grace) / 2**20:.1f} MiB")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
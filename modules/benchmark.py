@@ -0,0 +1,371 @@
+"""
+端到端基准测试：用 bench/stubs 下的确定性替身程序代替 timeloop-mapper / Ramulator-PIM / BookSim，
+测量框架自身的开销，并以 JSON 保存结果，便于在不同提交之间对比
+
+    python -m modules.benchmark run                         # 标准规模，结果写入 output/bench/
+    python -m modules.benchmark run --suite quick --mapper-latency 0.2
+    python -m modules.benchmark compare output/bench/A.json output/bench/B.json
+
+场景 (每个场景在独立的临时工作目录与全新子进程中运行，峰值内存互不干扰)：
+  evaluator  CoDesignEvaluator.evaluate_system，按层数扩展；先冷启动 (全部仿真) 再热启动 (全部命中单层缓存)
+  engine     DecoupledCoDesignEngine.run，按迭代数与 worker 数扩展 (workers > 0 时走共享目录任务队列)
+
+各阶段耗时来自 modules.tracing 的 span 汇总 (含 worker 进程)。未安装 timeloopfe 时预处理改为
+直接拼接输入文件 (结果中 meta.preprocess = "stub")，替身 mapper 只读取问题规模与阵列参数
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import argparse
+import platform
+import tempfile
+import subprocess
+import importlib.util
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+STUBS_DIR = os.path.join(PROJECT_ROOT, "bench", "stubs")
+
+# 替身程序覆盖的仿真阶段 (span 名)；其余时间计为框架开销
+SIM_STAGES = ("timeloop-mapper", "ramulator", "booksim")
+# 固定的评估硬件点 [mesh_x, mesh_y, pe, sram_log2] (与 engine 的初始信赖域中心相同)
+BENCH_HW = [2, 2, 16, 21]
+
+SUITES = {
+    'quick': {'layers': [1, 11], 'iterations': [3], 'workers': [0]},
+    'standard': {'layers': [1, 4, 11], 'iterations': [3, 9], 'workers': [0, 2]},
+    'full': {'layers': [1, 4, 11], 'iterations': [9, 30], 'workers': [0, 2, 4]},
+}
+
+# compare 时的指标方向：True 表示越大越好
+METRIC_HIGHER_IS_BETTER = {
+    'wall_s': False, 'warm_wall_s': False, 'framework_s': False, 'framework_ms_per_layer': False,
+    'warm_ms_per_layer': False, 'framework_ms_per_eval': False, 'peak_rss_mb': False,
+    'layers_per_s': True, 'evals_per_s': True,
+}
+
+def _peak_rss_mb():
+    if resource is None: return None
+    # Linux 上 ru_maxrss 单位为 KB
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0, 1)
+
+def _git_revision():
+    try:
+        rev = subprocess.run(["git", "rev-parse", "HEAD"], cwd=PROJECT_ROOT, capture_output=True, text=True, timeout=10).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=PROJECT_ROOT,
+                               capture_output=True, text=True, timeout=30).stdout.strip()
+        return rev or None, bool(dirty)
+    except (OSError, subprocess.SubprocessError):
+        return None, None
+
+def preprocess_mode():
+    return "timeloopfe" if importlib.util.find_spec("timeloopfe") is not None else "stub"
+
+def stub_env(latency):
+    """指向替身程序的环境变量；latency: {'mapper' / 'accelergy' / 'ramulator' / 'booksim': 秒}"""
+    env = {
+        'PIM_TIMELOOP_MAPPER': os.path.join(STUBS_DIR, "timeloop-mapper"),
+        'PIM_RAMULATOR_BIN': os.path.join(STUBS_DIR, "ramulator"),
+        'PIM_BOOKSIM_BIN': os.path.join(STUBS_DIR, "booksim"),
+        'PIM_PROGRESS': "json",
+    }
+    for tool, seconds in latency.items():
+        env[f"PIM_STUB_LATENCY_{tool.upper()}"] = str(seconds)
+    return env
+
+# ------------------------------------------------------------
+# 场景 (在子进程中执行，cwd 为临时工作目录)
+# ------------------------------------------------------------
+def _concat_preprocess(self, input_files, output_path):
+    """timeloopfe 不可用时的预处理替身：按顺序拼接全部输入文件"""
+    try:
+        with open(output_path, 'w') as out:
+            for path in input_files:
+                with open(path, 'r') as f: out.write(f"# ---- {os.path.basename(path)} ----\n{f.read()}\n")
+        return True
+    except OSError:
+        return False
+
+def _install_preprocess():
+    if preprocess_mode() == "stub":
+        from modules.evaluation_engine import CoDesignEvaluator
+        CoDesignEvaluator._preprocess_timeloop_input = _concat_preprocess
+
+def _stage_rows(trace_dir):
+    from modules import tracing
+    return {r['name']: {'count': r['count'], 'wall_s': round(r['wall_s'], 4), 'cpu_s': round(r['cpu_s'], 4),
+                        'child_cpu_s': round(r['child_cpu_s'], 4)}
+            for r in tracing.summarize(trace_dir)}
+
+def _sim_seconds(stages):
+    return sum(stages.get(name, {}).get('wall_s', 0.0) for name in SIM_STAGES)
+
+def _bench_arch(arch_gen, hw, name):
+    return arch_gen.generate_config({
+        'MESH_X': hw[0], 'MESH_Y': hw[1], 'NUM_NODES': hw[0] * hw[1],
+        'PE_DIM_X': hw[2], 'PE_DIM_Y': hw[2], 'SRAM_DEPTH': (2 ** hw[3]) // 64, 'SRAM_WIDTH': 64,
+    }, filename=name)
+
+def scenario_evaluator(params, trace_dir):
+    from modules import tracing
+    from modules.arch_gen import ArchGenerator
+    from modules.evaluation_engine import CoDesignEvaluator
+    from modules.software_optimizer import SoftwareOptimizer
+    from modules.trace_gen import TraceGenerator
+    from modules.wrapper_ramulator import RamulatorWrapper
+    from modules.wrapper_timeloop import TimeloopWrapper
+    from modules.workload_manager import WorkloadManager, DEFAULT_INPUT_SIZE
+    from main_optimization import CONFIG
+
+    wm = WorkloadManager(config_dir="configs/prob/generated")
+    wm.generate_batch([("resnet18", DEFAULT_INPUT_SIZE)])
+    shapes = list(dict.fromkeys(wm.shape_files("resnet18", DEFAULT_INPUT_SIZE)))
+    layers = shapes[:params['layers']]
+
+    arch_gen = ArchGenerator(template_path="templates/arch.yaml.jinja2", output_dir="output/generated_arch")
+    evaluator = CoDesignEvaluator(arch_gen, TimeloopWrapper(), RamulatorWrapper(), TraceGenerator("output/dram.trace"), CONFIG)
+    hw = BENCH_HW
+    hw_cfg = {'num_nodes': hw[0] * hw[1], 'pe': hw[2], 'sram_log2': hw[3], 'arch_file': _bench_arch(arch_gen, hw, "arch_bench.yaml")}
+    schedule = SoftwareOptimizer(config_dir="output/generated_configs").optimize(hw_cfg, layers, 0)
+    stats_dir = os.path.abspath("output/iter_bench")
+    os.makedirs(stats_dir, exist_ok=True)
+
+    t0 = time.perf_counter()
+    edp = evaluator.evaluate_system(hw_cfg, schedule, stats_dir, "configs/arch/components")[0]
+    wall = time.perf_counter() - t0
+    if edp >= evaluator.PENALTY_VAL:
+        raise RuntimeError("evaluation failed, see the [Timeloop Failed] lines above")
+    stages = _stage_rows(trace_dir)
+
+    t0 = time.perf_counter()
+    warm_edp = evaluator.evaluate_system(hw_cfg, schedule, stats_dir, "configs/arch/components")[0]
+    warm = time.perf_counter() - t0
+    tracing.flush()
+
+    n = len(layers)
+    framework = wall - _sim_seconds(stages)
+    return {
+        'metrics': {
+            'layers': n, 'wall_s': round(wall, 4), 'layers_per_s': round(n / wall, 3),
+            'framework_s': round(framework, 4), 'framework_ms_per_layer': round(framework * 1000.0 / n, 2),
+            'warm_wall_s': round(warm, 4), 'warm_ms_per_layer': round(warm * 1000.0 / n, 2),
+            'peak_rss_mb': _peak_rss_mb(), 'edp': edp, 'warm_edp_matches': warm_edp == edp,
+        },
+        'stages': stages,
+    }
+
+def scenario_engine(params, trace_dir):
+    import main_optimization as mo
+
+    workers = params['workers']
+    broker_dir = os.path.abspath("queue") if workers else None
+    procs = []
+    if workers:
+        os.makedirs(broker_dir, exist_ok=True)
+        # 同机 worker 平分核心，各自的 CoreScheduler 不会互相超额分配
+        from modules.core_scheduler import host_cores
+        worker_env = dict(os.environ, PIM_CORES=str(max(1, host_cores() // workers)))
+        for k in range(workers):
+            log = open(f"worker_{k}.log", 'w')
+            procs.append(subprocess.Popen([sys.executable, "-m", "modules.benchmark", "_worker", broker_dir],
+                                          stdout=log, stderr=subprocess.STDOUT, env=worker_env))
+    mo.MAX_ITERATIONS = params['iterations']
+    try:
+        t0 = time.perf_counter()
+        engine = mo.DecoupledCoDesignEngine(broker_dir=broker_dir)
+        setup = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        engine.run()
+        wall = time.perf_counter() - t0
+    finally:
+        for p in procs: p.terminate()
+        for p in procs:
+            try:
+                p.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                p.kill()
+
+    statuses = {}
+    for rec in engine.logger.load_journal():
+        if rec.get('type') == 'evaluation': statuses[rec['status']] = statuses.get(rec['status'], 0) + 1
+    n = len(engine.eval_times)
+    stages = _stage_rows(trace_dir)
+    metrics = {
+        'evaluations': n, 'statuses': statuses, 'setup_s': round(setup, 4), 'wall_s': round(wall, 4),
+        'evals_per_s': round(n / wall, 4) if wall > 0 else None, 'peak_rss_mb': _peak_rss_mb(),
+        'best_edp': engine.best_result['edp'],
+    }
+    # 并行 worker 时仿真时间相互重叠，框架开销只对串行模式有意义
+    if not workers and n:
+        framework = wall - _sim_seconds(stages)
+        metrics['framework_s'] = round(framework, 4)
+        metrics['framework_ms_per_eval'] = round(framework * 1000.0 / n, 2)
+    return {'metrics': metrics, 'stages': stages}
+
+SCENARIOS = {'evaluator': scenario_evaluator, 'engine': scenario_engine}
+
+def _run_scenario_child(spec_json, result_path):
+    spec = json.loads(spec_json)
+    _install_preprocess()
+    out = SCENARIOS[spec['scenario']](spec['params'], os.environ["PIM_TRACE_DIR"])
+    with open(result_path, 'w') as f: json.dump(out, f, default=str)
+    return 0
+
+def _run_worker_child(queue_dir):
+    _install_preprocess()
+    from main_optimization import run_worker
+    run_worker(queue_dir)
+    return 0
+
+# ------------------------------------------------------------
+# 调度 (父进程)
+# ------------------------------------------------------------
+def _prepare_workspace():
+    work = tempfile.mkdtemp(prefix="pimbench_")
+    for name in ("configs", "templates"):
+        os.symlink(os.path.join(PROJECT_ROOT, name), os.path.join(work, name))
+    return work
+
+def run_scenario(scenario, params, latency, keep=False, timeout=3600):
+    """在新的工作目录与子进程中运行一个场景，返回结果字典"""
+    from modules.visualizer import C_RED, C_END
+    work = _prepare_workspace()
+    env = dict(os.environ)
+    env.update(stub_env(latency))
+    env['PIM_TRACE_DIR'] = os.path.join(work, "trace")
+    env['PYTHONPATH'] = PROJECT_ROOT + (os.pathsep + env['PYTHONPATH'] if env.get('PYTHONPATH') else "")
+    result_path = os.path.join(work, "result.json")
+    cmd = [sys.executable, "-m", "modules.benchmark", "_scenario", json.dumps({'scenario': scenario, 'params': params}), result_path]
+    t0 = time.perf_counter()
+    with open(os.path.join(work, "scenario.log"), 'w') as log:
+        try:
+            rc = subprocess.run(cmd, cwd=work, env=env, stdout=log, stderr=subprocess.STDOUT, timeout=timeout).returncode
+        except subprocess.TimeoutExpired:
+            rc = "timeout"
+    total = time.perf_counter() - t0
+
+    entry = {'scenario': scenario, 'params': params, 'process_wall_s': round(total, 3)}
+    if rc == 0 and os.path.exists(result_path):
+        with open(result_path, 'r') as f: entry.update(json.load(f))
+    else:
+        entry['error'] = f"exit {rc}, see {os.path.join(work, 'scenario.log')}"
+        keep = True
+        print(f"{C_RED}[Bench] {scenario} {params} failed: {entry['error']}{C_END}")
+    if not keep:
+        shutil.rmtree(work, ignore_errors=True)
+    else:
+        entry['workspace'] = work
+    return entry
+
+def run_suite(layers, iterations, workers, latency, scenarios=("evaluator", "engine"), keep=False):
+    from modules.visualizer import C_CYAN, C_END
+    rev, dirty = _git_revision()
+    report = {
+        'meta': {
+            'commit': rev, 'dirty': dirty, 'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'host': socket.gethostname(), 'cpus': os.cpu_count(), 'python': platform.python_version(),
+            'platform': platform.platform(), 'preprocess': preprocess_mode(), 'latency_s': latency,
+        },
+        'results': []
+    }
+    plan = []
+    if "evaluator" in scenarios: plan += [("evaluator", {'layers': n}) for n in layers]
+    if "engine" in scenarios: plan += [("engine", {'iterations': it, 'workers': w}) for it in iterations for w in workers]
+    for scenario, params in plan:
+        print(f"{C_CYAN}[Bench] {scenario} {params}{C_END}", flush=True)
+        entry = run_scenario(scenario, params, latency, keep=keep)
+        report['results'].append(entry)
+        if 'metrics' in entry: print("        " + _format_metrics(entry['metrics']), flush=True)
+    return report
+
+def _format_metrics(metrics):
+    shown = [k for k in ('wall_s', 'layers_per_s', 'evals_per_s', 'framework_ms_per_layer', 'framework_ms_per_eval',
+                         'warm_ms_per_layer', 'peak_rss_mb') if metrics.get(k) is not None]
+    return "  ".join(f"{k}={metrics[k]}" for k in shown)
+
+def _result_key(entry):
+    return entry['scenario'] + " " + ",".join(f"{k}={v}" for k, v in sorted(entry['params'].items()))
+
+def compare_reports(base, new, threshold=0.10):
+    """返回 (行列表, 回退数)；回退 = 按指标方向变差超过 threshold"""
+    base_map = {_result_key(e): e for e in base['results'] if 'metrics' in e}
+    rows, regressions = [], 0
+    for entry in new['results']:
+        key = _result_key(entry)
+        old = base_map.get(key)
+        if old is None or 'metrics' not in entry: continue
+        for metric, higher_better in METRIC_HIGHER_IS_BETTER.items():
+            a, b = old['metrics'].get(metric), entry['metrics'].get(metric)
+            if not isinstance(a, (int, float)) or not isinstance(b, (int, float)) or a == 0: continue
+            change = (b - a) / abs(a)
+            worse = -change if higher_better else change
+            flag = worse > threshold
+            regressions += int(flag)
+            rows.append((key, metric, a, b, change, flag))
+    return rows, regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the co-design framework against stub simulators")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("run", help="run the benchmark suite and write a JSON report")
+    p.add_argument("--suite", choices=sorted(SUITES), default="standard")
+    p.add_argument("--scenario", choices=["evaluator", "engine", "all"], default="all")
+    p.add_argument("--layers", help="comma-separated layer counts (overrides the suite)")
+    p.add_argument("--iterations", help="comma-separated engine iteration counts (overrides the suite)")
+    p.add_argument("--workers", help="comma-separated worker counts, 0 = in-process (overrides the suite)")
+    p.add_argument("--mapper-latency", type=float, default=0.0, help="seconds added to each timeloop-mapper call")
+    p.add_argument("--accelergy-latency", type=float, default=0.0,
+                   help="seconds added when the mapper has to run Accelergy (no cached ERT/ART)")
+    p.add_argument("--ramulator-latency", type=float, default=0.0, help="seconds added to each Ramulator call")
+    p.add_argument("--booksim-latency", type=float, default=0.0, help="seconds added to each BookSim call")
+    p.add_argument("-o", "--output", default=None, help="report path (default: output/bench/bench_<commit>_<time>.json)")
+    p.add_argument("--keep", action="store_true", help="keep the per-scenario workspaces")
+    p = sub.add_parser("compare", help="compare two reports")
+    p.add_argument("base"); p.add_argument("new")
+    p.add_argument("--threshold", type=float, default=0.10, help="relative change counted as a regression (default 0.10)")
+    p = sub.add_parser("_scenario"); p.add_argument("spec"); p.add_argument("result")
+    p = sub.add_parser("_worker"); p.add_argument("queue_dir")
+    args = parser.parse_args()
+
+    if args.cmd == "_scenario": return _run_scenario_child(args.spec, args.result)
+    if args.cmd == "_worker": return _run_worker_child(args.queue_dir)
+
+    from modules.visualizer import C_GREEN, C_RED, C_END
+    if args.cmd == "compare":
+        with open(args.base, 'r') as f: base = json.load(f)
+        with open(args.new, 'r') as f: new = json.load(f)
+        rows, regressions = compare_reports(base, new, args.threshold)
+        print(f"base {base['meta'].get('commit')}  ->  new {new['meta'].get('commit')}")
+        print(f"{'Scenario':<36}{'Metric':<26}{'Base':>12}{'New':>12}{'Change':>10}")
+        for key, metric, a, b, change, flag in rows:
+            color = C_RED if flag else ""
+            print(f"{color}{key[:35]:<36}{metric:<26}{a:>12.4g}{b:>12.4g}{change * 100:>9.1f}%{C_END if flag else ''}")
+        print(f"{C_RED if regressions else C_GREEN}{regressions} regression(s) beyond {args.threshold * 100:.0f}%{C_END}")
+        return 1 if regressions else 0
+
+    suite = SUITES[args.suite]
+    parse_list = lambda text, default: [int(x) for x in text.split(",")] if text else default
+    scenarios = ("evaluator", "engine") if args.scenario == "all" else (args.scenario,)
+    latency = {'mapper': args.mapper_latency, 'accelergy': args.accelergy_latency,
+               'ramulator': args.ramulator_latency, 'booksim': args.booksim_latency}
+    report = run_suite(parse_list(args.layers, suite['layers']), parse_list(args.iterations, suite['iterations']),
+                       parse_list(args.workers, suite['workers']), latency, scenarios, keep=args.keep)
+
+    out = args.output
+    if out is None:
+        rev = (report['meta']['commit'] or "nogit")[:8]
+        out = os.path.join("output", "bench", f"bench_{rev}_{time.strftime('%Y%m%d_%H%M%S')}.json")
+    if os.path.dirname(out): os.makedirs(os.path.dirname(out), exist_ok=True)
+    with open(out, 'w') as f: json.dump(report, f, indent=2, default=str)
+    print(f"{C_GREEN}[Bench] report written to {out}{C_END}")
+    return 1 if any('error' in e for e in report['results']) else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,144 @@
+"""
+单机核心调度器：协调一次评估中并行运行的各层仿真所占用的 CPU 核心
+
+  - 核心数取自 PIM_CORES 环境变量 / 进程 CPU 亲和性 (taskset、cgroup cpuset) / os.cpu_count()；
+    同一主机上启动多个 worker 时应为每个 worker 设置 PIM_CORES 划分核心
+  - timeloop-mapper 按 "核心数 / 未完成层数" 获得线程预算 (不超过 max_mapper_threads)，
+    剩余层越少每个 mapper 分到的线程越多
+  - 单线程的 Ramulator / BookSim 作业优先填补空闲核心：有单核请求等待时多核请求让位
+  - 层按预测耗时从长到短提交 (LPT)，缩短整批层的完成时间
+  - 利用率：忙碌核心数对时间的积分 / (核心数 x 墙钟时间)，并导出为 Prometheus 指标
+"""
+import os
+import time
+import threading
+from contextlib import contextmanager
+from modules.metrics import REGISTRY
+
+M_SCHED_CORES = REGISTRY.gauge("pimdse_sched_cores", "Host cores managed by the layer scheduler", ["state"])
+M_SCHED_CORE_SECONDS = REGISTRY.counter("pimdse_sched_core_seconds_total", "Core-seconds granted to simulator jobs", ["kind"])
+M_SCHED_UTILIZATION = REGISTRY.gauge("pimdse_sched_utilization", "Fraction of scheduler cores busy since start")
+
+def host_cores():
+    env = os.environ.get("PIM_CORES")
+    if env:
+        try: return max(1, int(env))
+        except ValueError: pass
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+class CoreScheduler:
+    def __init__(self, cores=None, max_mapper_threads=8):
+        self.cores = max(1, int(cores or host_cores()))
+        self.max_mapper_threads = max(1, min(int(max_mapper_threads), self.cores))
+        self.cond = threading.Condition()
+        self.free = self.cores
+        self.single_waiting = 0
+        # map_lpt 中尚未完成的层数，决定 mapper 线程预算
+        self.active = 0
+        self.t_start = self.t_last = time.perf_counter()
+        self.busy_core_s = 0.0
+        self.core_s = {}
+        M_SCHED_CORES.set(self.cores, state="total")
+        M_SCHED_CORES.set(0, state="busy")
+        M_SCHED_UTILIZATION.set_function(lambda: self.utilization()['utilization'])
+
+    def _account(self):
+        """在修改 free 之前调用 (持锁)：累计忙碌核心-秒"""
+        now = time.perf_counter()
+        self.busy_core_s += (self.cores - self.free) * (now - self.t_last)
+        self.t_last = now
+
+    def mapper_threads(self):
+        """当前 mapper 的线程预算"""
+        with self.cond:
+            active = max(1, self.active)
+        return max(1, min(self.max_mapper_threads, self.cores // active))
+
+    def acquire(self, want=1):
+        """阻塞到至少有一个空闲核心，返回实际分得的核心数 (1..want)"""
+        want = max(1, min(int(want), self.cores))
+        single = want == 1
+        with self.cond:
+            if single: self.single_waiting += 1
+            try:
+                # 多核请求让位于等待中的单核作业 (Ramulator / BookSim 填补空隙)
+                while self.free < 1 or (not single and self.single_waiting > 0):
+                    self.cond.wait()
+            finally:
+                if single: self.single_waiting -= 1
+            grant = min(want, self.free)
+            self._account()
+            self.free -= grant
+            M_SCHED_CORES.set(self.cores - self.free, state="busy")
+            self.cond.notify_all()
+        return grant
+
+    def release(self, n, kind="sim", held_s=0.0):
+        with self.cond:
+            self._account()
+            self.free += n
+            self.core_s[kind] = self.core_s.get(kind, 0.0) + n * held_s
+            M_SCHED_CORES.set(self.cores - self.free, state="busy")
+            self.cond.notify_all()
+        M_SCHED_CORE_SECONDS.inc(n * held_s, kind=kind)
+
+    @contextmanager
+    def slot(self, want=1, kind="sim"):
+        n = self.acquire(want)
+        t0 = time.perf_counter()
+        try:
+            yield n
+        finally:
+            self.release(n, kind, time.perf_counter() - t0)
+
+    def map_lpt(self, items, fn, cost):
+        """
+        按 cost(item) 从大到小提交 fn(item)，按完成顺序产出 (item, result)
+        并发数不超过核心数 (每个 fn 内部再通过 slot 申请核心)；调用方提前关闭生成器时不再提交新任务，
+        已在运行的任务等其结束
+        """
+        from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+        pending = sorted(items, key=cost, reverse=True)
+        if not pending: return
+        running = {}
+        with self.cond:
+            self.active += len(pending)
+        pool = ThreadPoolExecutor(max_workers=min(self.cores, len(pending)), thread_name_prefix="layer")
+        try:
+            while pending or running:
+                while pending and len(running) < self.cores:
+                    item = pending.pop(0)
+                    running[pool.submit(fn, item)] = item
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    item = running.pop(fut)
+                    with self.cond:
+                        self.active -= 1
+                    yield item, fut.result()
+        finally:
+            with self.cond:
+                self.active -= len(pending) + len(running)
+            pending.clear()
+            pool.shutdown(wait=True)
+
+    def snapshot(self):
+        with self.cond:
+            self._account()
+            return {'t': self.t_last, 'busy_core_s': self.busy_core_s, 'core_s': dict(self.core_s)}
+
+    def utilization(self, since=None):
+        """{'cores', 'wall_s', 'busy_core_s', 'idle_core_s', 'utilization', 'core_s': {kind: 核心-秒}}；since 为 snapshot()"""
+        now = self.snapshot()
+        base = since or {'t': self.t_start, 'busy_core_s': 0.0, 'core_s': {}}
+        wall = now['t'] - base['t']
+        busy = now['busy_core_s'] - base['busy_core_s']
+        capacity = self.cores * wall
+        return {
+            'cores': self.cores, 'wall_s': round(wall, 4), 'busy_core_s': round(busy, 4),
+            'idle_core_s': round(capacity - busy, 4),
+            'utilization': round(busy / capacity, 4) if capacity > 0 else 0.0,
+            'core_s': {k: round(v - base['core_s'].get(k, 0.0), 4) for k, v in now['core_s'].items()},
+        }
@@ -1,15 +1,33 @@
 import os
 import csv
 import json
-import shutil
 import pickle
 import datetime
+from modules.results_store import ResultsStore
+from modules.artifact_store import ArtifactStore, pareto_front
+
+def _json_default(obj):
+    """numpy 标量 (skopt 返回的整数点) 转为原生类型"""
+    if hasattr(obj, 'item'):
+        return obj.item()
+    if hasattr(obj, 'tolist'):
+        return obj.tolist()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
 
 class DataLogger:
-    def __init__(self, config_dict):
-        # 1. 创建带时间戳的根目录
-        timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
-        self.root_dir = f"results/run_{timestamp}"
+    # 每隔多少次 apply_retention 回收一次不再引用的 blob
+    GC_EVERY = 20
+
+    def __init__(self, config_dict, resume_dir=None, artifact_root="output/artifacts"):
+        # 1. 创建带时间戳的根目录 (续跑时沿用原目录)
+        self.resumed = resume_dir is not None
+        if self.resumed:
+            if not os.path.isdir(resume_dir):
+                raise FileNotFoundError(f"Run directory not found: {resume_dir}")
+            self.root_dir = resume_dir
+        else:
+            timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
+            self.root_dir = f"results/run_{timestamp}"
         self.configs_dir = os.path.join(self.root_dir, "configs")
         self.checkpoints_dir = os.path.join(self.root_dir, "checkpoints")
         
@@ -18,12 +36,29 @@ class DataLogger:
         os.makedirs(self.checkpoints_dir, exist_ok=True)
 
         # 2. 保存实验元数据 (Metadata)
-        self._save_metadata(config_dict)
+        if not self.resumed:
+            self._save_metadata(config_dict)
 
         # 3. 初始化 CSV 文件句柄
         self.summary_file = os.path.join(self.root_dir, "dse_summary.csv")
         self.details_file = os.path.join(self.root_dir, "dse_details.csv")
-        self._init_csvs()
+        if not (self.resumed and os.path.exists(self.summary_file)):
+            self._init_csvs()
+
+        # 4. 评估日志 (Journal)：每完成一次评估追加一行 JSON，用于崩溃后恢复
+        self.journal_file = os.path.join(self.root_dir, "journal.jsonl")
+
+        # 5. 结果库：同一 results/ 下所有 run 共用一个 SQLite 库，便于跨 run 查询
+        self.run_id = os.path.basename(os.path.normpath(self.root_dir))
+        self.store = ResultsStore(os.path.join(os.path.dirname(os.path.normpath(self.root_dir)), "results.db"))
+        self.store.register_run(self.run_id, config_dict)
+        if self.resumed:
+            # 缓冲中未落库的记录随进程退出丢失，续跑时以 journal 为准补齐
+            self.store.import_run(self.root_dir)
+
+        # 6. 产物存储：各迭代的仿真产物按内容去重压缩保存，只有最优 / Pareto 点保留完整产物
+        self.artifacts = ArtifactStore(artifact_root)
+        self.retention_calls = 0
 
     def _save_metadata(self, config):
         """保存全局配置，确保实验可追溯"""
@@ -69,27 +104,88 @@ class DataLogger:
             w.writerow([iter_id, "baseline", db.get('cycles',0), db.get('dram_acc',0), db.get('sram_acc',0), db.get('noc_lat',0), db.get('noc_pwr',0)])
             w.writerow([iter_id, "atomic", da.get('cycles',0), da.get('dram_acc',0), da.get('sram_acc',0), da.get('noc_lat',0), da.get('noc_pwr',0)])
 
-    def archive_artifacts(self, iter_id, files_to_save):
+    def archive_artifacts(self, iter_id, files_to_save, stats_dir=None, remove=True):
         """
-        备份关键的配置文件 (arch.yaml, mapper.yaml)
-        这样如果某次结果很好，你可以直接查看当时生成的 yaml 是什么样
+        归档一次迭代的产物：关键配置文件 (arch.yaml, mapper.yaml ...) 存为 inputs/<文件名>，
+        stats_dir 下的整棵仿真输出树按内容去重压缩存入产物存储，随后删除原目录
+        如果某次结果很好，可用 python -m modules.artifact_store restore <key> <dir> 还原当时的全部文件
         """
-        iter_dir = os.path.join(self.configs_dir, f"iter_{iter_id}")
-        os.makedirs(iter_dir, exist_ok=True)
-        
-        for src_path in files_to_save:
-            if os.path.exists(src_path):
-                filename = os.path.basename(src_path)
-                dst_path = os.path.join(iter_dir, filename)
-                shutil.copy(src_path, dst_path)
+        key = self.artifact_key(iter_id)
+        return self.artifacts.ingest(stats_dir or "", key, extra_files=files_to_save, remove=remove and stats_dir is not None)
+
+    def artifact_key(self, iter_id):
+        return f"{self.run_id}/iter_{iter_id}"
+
+    def apply_retention(self, points, collect=None):
+        """
+        points: [(iter_id, edp, area)] 有效 (非剪枝 / 非失败) 的评估点
+        EDP-面积 Pareto 前沿上的点保留完整产物，其余点只保留关键文件
+        blob 回收需要全量扫描，只在每 GC_EVERY 次调用 (或 collect=True) 时运行；返回释放的字节数
+        """
+        keep = pareto_front([(self.artifact_key(i), edp, area) for i, edp, area in points])
+        self.retention_calls += 1
+        if collect is None: collect = self.retention_calls % self.GC_EVERY == 0
+        return self.artifacts.retain(keep, prefix=f"{self.run_id}/", collect=collect)
+
+    def append_journal(self, record):
+        """
+        追加一条评估记录并立即落盘 (fsync)，进程崩溃或断电后最多丢失正在写的那一行
+        """
+        line = json.dumps(record, default=_json_default)
+        with open(self.journal_file, 'a') as f:
+            f.write(line + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def store_evaluation(self, record):
+        """评估记录写入结果库 (批量缓冲，flush_store 或攒满一批时落库)"""
+        self.store.add_evaluation(self.run_id, record)
+
+    def flush_store(self):
+        self.store.flush()
+
+    def load_journal(self):
+        """
+        读取全部评估记录；末尾被截断的半行 (崩溃时正在写入) 会被丢弃并从文件中截掉，
+        以免后续追加的记录接在半行后面
+        """
+        records = []
+        if not os.path.exists(self.journal_file):
+            return records
+        valid_bytes = 0
+        with open(self.journal_file, 'rb') as f:
+            for line in f:
+                if not line.endswith(b"\n"): break
+                if line.strip():
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        break
+                valid_bytes += len(line)
+        if valid_bytes < os.path.getsize(self.journal_file):
+            with open(self.journal_file, 'r+b') as f:
+                f.truncate(valid_bytes)
+        return records
 
     def save_checkpoint(self, optimizer_state, filename="turbo_state.pkl"):
         """
         保存优化器状态，支持断点续传
         """
         path = os.path.join(self.checkpoints_dir, filename)
-        with open(path, 'wb') as f:
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'wb') as f:
             pickle.dump(optimizer_state, f)
-            
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def load_checkpoint(self, filename="turbo_state.pkl"):
+        path = os.path.join(self.checkpoints_dir, filename)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+
+
     def get_results_dir(self):
         return self.root_dir
@@ -0,0 +1,91 @@
+"""
+Accelergy 能耗 / 面积表 (ERT / ART) 缓存
+
+ERT / ART 只取决于架构文件与组件库，与层形状无关。每个唯一架构只让第一次 timeloop-mapper 调用
+运行 Accelergy，随后把生成的表存入缓存；之后同一架构的所有层 (以及后续迭代中相同的硬件点)
+把缓存的表附加到 Timeloop 输入中，Timeloop 发现输入已含 ERT 与 ART 时不再调用 Accelergy
+
+  root/<key>/ERT.yaml
+  root/<key>/ART.yaml
+  root/<key>/meta.json     {'key', 'sources', 'sizes'}，最后写出 (整个目录原子 rename 发布)
+"""
+import os
+import json
+import glob
+import shutil
+import hashlib
+import tempfile
+
+# 缓存格式或 Accelergy 插件变化时递增，使旧表失效
+CACHE_VERSION = 1
+TABLE_FILES = {'ERT': "ERT.yaml", 'ART': "ART.yaml"}
+
+class ErtCache:
+    def __init__(self, root="output/ert_cache"):
+        self.root = root
+
+    def key(self, source_files):
+        """架构文件 + 组件库文件内容的哈希 (与路径无关，文件顺序无关)"""
+        digests = []
+        for path in source_files:
+            try:
+                with open(path, 'rb') as f: digests.append(hashlib.sha1(f.read()).hexdigest())
+            except OSError:
+                digests.append(f"missing:{os.path.basename(path)}")
+        h = hashlib.sha1(f"ert-cache-v{CACHE_VERSION}".encode())
+        for d in sorted(digests): h.update(d.encode())
+        return h.hexdigest()[:20]
+
+    def _entry_dir(self, key):
+        return os.path.join(self.root, key[:2], key)
+
+    def lookup(self, key):
+        """返回 [ERT 路径, ART 路径]；条目不存在或不完整 (大小与 meta 不符) 时返回 None"""
+        entry = self._entry_dir(key)
+        try:
+            with open(os.path.join(entry, "meta.json"), 'r') as f: meta = json.load(f)
+            paths = [os.path.join(entry, name) for name in TABLE_FILES.values()]
+            if meta.get('key') != key or [os.path.getsize(p) for p in paths] != meta.get('sizes'):
+                raise ValueError("stale entry")
+        except (OSError, ValueError):
+            return None
+        return paths
+
+    def store(self, key, work_dir, sources=()):
+        """
+        从一次完整 timeloop-mapper 运行的工作目录收集 *.ERT.yaml / *.ART.yaml 存入缓存
+        返回缓存中的 [ERT, ART] 路径；工作目录中没有完整的表时返回 None
+        """
+        found = {}
+        for kind in TABLE_FILES:
+            matches = sorted(glob.glob(os.path.join(work_dir, f"*.{kind}.yaml")))
+            if not matches or os.path.getsize(matches[0]) == 0: return None
+            found[kind] = matches[0]
+
+        entry = self._entry_dir(key)
+        if os.path.exists(os.path.join(entry, "meta.json")):
+            return self.lookup(key)
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+        # 先在同一父目录下写完整个条目再 rename，并发的 worker 不会读到半个条目
+        tmp_dir = tempfile.mkdtemp(prefix=f".{key}.", dir=os.path.dirname(entry))
+        try:
+            sizes = []
+            for kind, name in TABLE_FILES.items():
+                shutil.copyfile(found[kind], os.path.join(tmp_dir, name))
+                sizes.append(os.path.getsize(os.path.join(tmp_dir, name)))
+            with open(os.path.join(tmp_dir, "meta.json"), 'w') as f:
+                json.dump({'key': key, 'sources': [os.path.basename(s) for s in sources], 'sizes': sizes}, f)
+            os.rename(tmp_dir, entry)
+        except OSError:
+            # 其它进程抢先发布了同一条目
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        return self.lookup(key)
+
+    def append_tables(self, canonical_input, tables):
+        """把 ERT / ART (各为单个顶层键的 YAML 映射) 追加到已展开的 Timeloop 输入末尾"""
+        with open(canonical_input, 'a') as out:
+            for path in tables:
+                with open(path, 'r') as f: out.write("\n" + f.read().rstrip("\n") + "\n")
+
+    def clear(self):
+        shutil.rmtree(self.root, ignore_errors=True)
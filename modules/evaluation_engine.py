@@ -1,13 +1,36 @@
 import os
 import sys
+import re
 import math
-import subprocess
-from modules.visualizer import C_RED, C_YELLOW, C_BLUE, C_PURPLE, C_CYAN, C_END, AsyncSpinner
+import json
+import time
+import hashlib
+import itertools
+import threading
+import yaml
+from modules.visualizer import C_RED, C_YELLOW, C_BLUE, C_PURPLE, C_CYAN, C_END, AsyncSpinner, log_line
 from modules.result_parser import TimeloopParser
-from timeloopfe.v4.specification import Specification
-from timeloopfe.common.backend_calls import _specification_to_yaml_string
+from modules.scratch import ScratchWorkspace, DEFAULT_PERSIST
+from modules.tracing import span
+from modules.metrics import LAYER_CACHE, ERT_CACHE
+from modules.sim_runner import SimRunner, describe, failure_record
+from modules.ert_cache import ErtCache
+from modules.core_scheduler import CoreScheduler
+from modules.layer_subset import LayerSubsetModel, hw_features, shape_features
+
+def _job_path(rel_path):
+    """任务中的路径必须是工作目录内的相对路径 (不含越出工作目录的 ..)，返回规范化后的路径"""
+    norm = os.path.normpath(rel_path)
+    if os.path.isabs(norm) or norm == os.pardir or norm.startswith(os.pardir + os.sep):
+        raise ValueError(f"Job path outside the working directory: {rel_path}")
+    return norm
 
 class CoDesignEvaluator:
+    LAYER_RESULT_FILE = "layer_result.json"
+    # 单层原始仿真结果中参与外推与汇总的字段 (随评估记录保存，供离线重算)
+    RAW_FIELDS = ('logic_C', 'logic_E', 'area', 'dram_accesses', 'sampled_count',
+                  'ram_cycles', 'ram_energy_pj', 'noc_cycles', 'noc_energy_pj')
+
     def __init__(self, arch_gen, tl_wrapper, ram_wrapper, trace_gen, config):
         self.arch_gen = arch_gen
         self.tl = tl_wrapper
@@ -15,30 +38,107 @@ class CoDesignEvaluator:
         self.trace = trace_gen
         self.cfg = config
         self.PENALTY_VAL = 1e30
-        self.SAMPLE_SIZE = 500 
+        self.SAMPLE_SIZE = 500
+        # 分支定界：剩余层能耗下界默认取 0 (严格下界)；BOUND_SLACK > 0 时改用历史最小能耗 x BOUND_SLACK (启发式，见 _layer_lower_bound)
+        self.BOUND_SLACK = config.get('BOUND_SLACK', 0.0)
+        self.layer_history = {}
+        self.layer_macs = {}
+        # 单层仿真在内存盘临时目录中运行，只有白名单输出写回 stats_dir
+        self.scratch_root = config.get('SCRATCH_ROOT')
+        self.scratch_persist = config.get('SCRATCH_PERSIST', DEFAULT_PERSIST)
+        # timeloop-mapper 可执行文件 (默认从 PATH 查找)
+        self.mapper_bin = os.environ.get("PIM_TIMELOOP_MAPPER", "timeloop-mapper")
+        # ERT / ART 按架构缓存：同一架构只有第一次 mapper 调用运行 Accelergy
+        self.ert_cache = ErtCache(config.get('ERT_CACHE_DIR', "output/ert_cache")) if config.get('ERT_CACHE', True) else None
+        # 所有仿真器子进程经同一启动器运行 (进程组超时清理、资源上限、瞬时失败重试)
+        self.runner = SimRunner(config.get('SIM_LIMITS'))
+        if self.ram is not None:
+            self.ram.runner = self.runner
+            self.ram.sharding.update(config.get('RAM_SHARDING') or {})
+        # 各层并行运行时的核心分配 (mapper 线程预算、Ramulator / BookSim 填补空闲核心)
+        self.sched = CoreScheduler(config.get('SCHED_CORES'), config.get('MAPPER_MAX_THREADS', 8))
+        # 单层实测耗时 {形状文件哈希: (秒, MAC 数)}，用于 LPT 排序
+        self.layer_seconds = {}
+        # 本线程最近一次 _run_layer 失败的结构化记录 (tls.failure)
+        self.tls = threading.local()
+        # 代表层子集评估：从完整评估中学习选层与外推 (evaluate_system 传入 topk_edp 时启用)
+        subset_cfg = config.get('LAYER_SUBSET') or {}
+        self.layer_subset = LayerSubsetModel(
+            fraction=subset_cfg.get('fraction', 0.3), min_layers=subset_cfg.get('min_layers', 2),
+            min_history=subset_cfg.get('min_history', 8), z=subset_cfg.get('z', 2.0),
+            audit_every=subset_cfg.get('audit_every', 10))
+        self.layer_features = {}
 
-    def evaluate_system(self, hw_config, software_schedule, stats_dir, comp_dir, iter_context=None):
+    def evaluate_system(self, hw_config, software_schedule, stats_dir, comp_dir, iter_context=None, incumbent_edp=None,
+                        topk_edp=None):
+        """
+        incumbent_edp: 当前最优 EDP。给定时启用分支定界：每完成一层就用
+        "已完成层 + 剩余层乐观下界" 计算 EDP 下界，一旦超过 incumbent 即放弃剩余层，
+        返回值为下界并在 details 中标记 is_bound=True
+        topk_edp: 第 k 好的完整评估 EDP。给定且子集模型已有足够历史时先只运行代表层并外推全网络，
+        外推 EDP 的乐观下限 (exp(-z x 标准差)) 仍劣于 topk_edp 时不再运行其余层，
+        返回外推值并在 details 中标记 is_estimate=True；否则补齐其余层得到精确结果
+        """
         num_nodes = hw_config['num_nodes']
-        prob_paths = software_schedule['prob_paths']
-        
+        # 多工作负载：{name: {'weight', 'layers': [prob_path, ...]}}。
+        # 同一形状文件 (可被多个模型 / 多层引用) 每个硬件点只评估一次，各模型按各自的层列表汇总
+        workloads = software_schedule.get('workloads') or {
+            'default': {'weight': 1.0, 'layers': list(software_schedule['prob_paths'])}}
+        prob_paths = list(software_schedule['prob_paths'])
+        for wl in workloads.values(): prob_paths += wl['layers']
+        prob_paths = list(dict.fromkeys(prob_paths))
+
         # [关键修复] 在这里定义 total_layers，确保作用域覆盖后续循环
         total_layers = len(prob_paths)
-        
+
         iter_str = ""
         if iter_context:
             iter_str = f"It{iter_context['iter']}/{iter_context['max_iter']} "
 
-        agg = {
-            'log_E': 0.0, 'log_C': 0.0,
-            'mem_E': 0.0, 'mem_C': 0.0,
-            'noc_E': 0.0, 'noc_C': 0.0
-        }
+        layer_results = {}
+        layer_details = {}
+        area_factor = 1.0
         max_area = 0.0
-        
-        for i, prob_path in enumerate(prob_paths):
+        stage_times = {}
+        is_bound = False
+        bound_heuristic = False
+        layers_done = 0
+
+        comp_files = []
+        if os.path.exists(comp_dir):
+            for root, _, files in os.walk(comp_dir):
+                for file in files:
+                    if file.endswith(".yaml"): comp_files.append(os.path.join(root, file))
+
+        # 该架构已有 ERT / ART 时所有层直接复用；否则由第一个完整运行的层生成并存入缓存
+        ert_sources = [hw_config['arch_file']] + comp_files
+        ert_key = self.ert_cache.key(ert_sources) if self.ert_cache else None
+        tables = self.ert_cache.lookup(ert_key) if self.ert_cache else None
+
+        # 预测耗时从长到短 (LPT)：并行执行时缩短整批层的完成时间，昂贵的层也使下界尽早逼近真实值
+        prob_paths = sorted(prob_paths, key=self._predict_layer_seconds, reverse=True)
+        prune = incumbent_edp is not None and math.isfinite(incumbent_edp)
+        remaining_lb = {p: self._layer_lower_bound(p, hw_config) for p in prob_paths} if prune else {}
+        sched_start = self.sched.snapshot()
+
+        # 子集模式：代表层先运行 (第一阶段)，其余层只在需要精确结果时运行 (第二阶段)
+        plan = self._plan_subset(prob_paths, workloads) if topk_edp is not None else None
+        if plan:
+            rep_paths = {plan['paths'][name] for name in plan['reps']}
+            phases = [[p for p in prob_paths if p in rep_paths], [p for p in prob_paths if p not in rep_paths]]
+        else:
+            phases = [prob_paths]
+        position = {p: i for i, p in enumerate(p for phase in phases for p in phase)}
+        subset_info = None
+        is_estimate = False
+
+        def run_layer(task):
+            """在调度器线程中运行 (或读取断点续传结果) 一层，返回 (raw, cached, failure)"""
+            nonlocal tables
+            i, prob_path = task
             layer_name = os.path.basename(prob_path).replace('.yaml', '')
-            
-            bar_len = 8 
+
+            bar_len = 8
             # 这里的 total_layers 现在是安全的
             progress = i / max(1, total_layers)
             filled = int(bar_len * progress)
@@ -46,107 +146,459 @@ class CoDesignEvaluator:
             layer_short = layer_name[:15] + ".." if len(layer_name) > 15 else layer_name
             msg = f"{C_BLUE}{iter_str}Eval{C_END}|{C_PURPLE}[{bar_str}]{C_END}|{C_CYAN}{i+1}/{total_layers}:{layer_short:<17}{C_END}"
 
-            with AsyncSpinner(msg) as spinner:
-                
+            with AsyncSpinner(msg) as spinner, span("layer", layer=layer_name) as layer_span:
+
                 layer_dir = os.path.join(stats_dir, layer_name)
-                if not os.path.exists(layer_dir): os.makedirs(layer_dir)
-
-                # --- 1. Run Timeloop (Logic) ---
-                input_files = [hw_config['arch_file'], prob_path, software_schedule['mapper_path'], software_schedule['constraints_path']]
-                if os.path.exists(comp_dir):
-                    for root, _, files in os.walk(comp_dir):
-                        for file in files:
-                            if file.endswith(".yaml"): input_files.append(os.path.join(root, file))
-
-                canonical_input = os.path.join(layer_dir, "timeloop-input.yaml")
-                if not self._preprocess_timeloop_input(input_files, canonical_input): 
-                    return self.PENALTY_VAL, 0, 0, 0, {}
-
-                cmd = ["timeloop-mapper", canonical_input, "-o", layer_dir]
-                ret = self._run_subprocess(cmd)
-                
-                if not ret['success']:
-                    spinner.stop()
-                    print(f"\n{C_RED}[Timeloop Failed]{C_END} {layer_name}")
-                    return self.PENALTY_VAL, 0, 0, 0, {}
-
-                stats_file = os.path.join(layer_dir, "timeloop-mapper.stats.txt")
-                if not os.path.exists(stats_file): return self.PENALTY_VAL, 0, 0, 0, {}
-
-                try:
-                    parser = TimeloopParser(stats_file)
-                    results = parser.parse()
-                except: return self.PENALTY_VAL, 0, 0, 0, {}
-
-                logic_cyc = results.get('cycles', 0)
-                logic_eng = results.get('energy_pj', 0)
-                area = results.get('area_mm2', 0)
-                max_area = max(max_area, area)
-                
-                real_dram_accesses = results.get('dram_accesses', 0)
-
-                # --- 2. Run Ramulator-PIM & BookSim (Sampling Mode) ---
-                trace_file = os.path.join(layer_dir, "dram.trace")
-                
-                # 生成 Burst Trace
-                sampled_count = self._generate_synthetic_trace(trace_file, real_dram_accesses, self.SAMPLE_SIZE)
-                
-                trace_rel = os.path.relpath(trace_file, os.getcwd())
-                output_rel = os.path.relpath(layer_dir, os.getcwd())
-                
-                # 配置 Ramulator-PIM
-                config_ram = "configs/ramulator/LPDDR4-config.cfg"
-                config_noc = "configs/ramulator/sedram.cfg" 
-
-                sim_res = self.ram.run_simulation(
-                    config_rel_path=config_ram, 
-                    trace_rel_path=trace_rel, 
-                    output_rel_dir=output_rel, 
-                    network_config_path=config_noc, 
-                    num_nodes=num_nodes
-                )
-                
-                # 外推 (Extrapolation)
-                scale_factor = 0.0
-                if sampled_count > 0:
-                    scale_factor = float(real_dram_accesses) / float(sampled_count)
-                
-                mem_cyc = sim_res.get('ram_cycles', 0) * scale_factor
-                mem_eng = sim_res.get('ram_energy_pj', 0.0) * scale_factor
-                
-                noc_eng = sim_res.get('noc_energy_pj', 0.0) * scale_factor
-                noc_cyc = sim_res.get('noc_cycles', 0.0) * scale_factor
-                
-                # 3. Accumulate
-                agg['log_E'] += logic_eng
-                agg['log_C'] += logic_cyc
-                agg['mem_E'] += mem_eng
-                agg['mem_C'] += mem_cyc
-                agg['noc_E'] += noc_eng
-                agg['noc_C'] += noc_cyc
-
-            if i == 0 and max_area > self.cfg['AREA_LIMIT_MM2']:
-                for k in agg: agg[k] *= 10
+                os.makedirs(layer_dir, exist_ok=True)
+
+                input_files = [hw_config['arch_file'], prob_path, software_schedule['mapper_path'], software_schedule['constraints_path']] + comp_files
+                signature = self._layer_signature(input_files, num_nodes)
+
+                # [断点续传] 同一输入已在该目录下完成过，直接复用
+                raw = self._load_layer_result(layer_dir, signature)
+                cached = raw is not None
+                layer_span.set(cached=cached)
+                LAYER_CACHE.inc(result="hit" if cached else "miss")
+                if raw is None:
+                    layer_tables = tables
+                    if self.ert_cache: ERT_CACHE.inc(result="hit" if layer_tables else "miss")
+                    with ScratchWorkspace(layer_dir, self.scratch_persist, root=self.scratch_root) as ws:
+                        raw = self._run_layer(input_files, ws.path, num_nodes, spinner, layer_name, tables=layer_tables)
+                        ws.failed = raw is None
+                        if raw is not None and layer_tables is None and self.ert_cache:
+                            tables = self.ert_cache.store(ert_key, ws.path, ert_sources)
+                    if raw is None:
+                        return None, False, dict(self.tls.failure or {'kind': 'preprocess'}, layer=layer_name)
+                    raw['signature'] = signature
+                    raw['layer'] = layer_name
+                    self._save_layer_result(layer_dir, raw)
+            return raw, cached, None
+
+        for phase_no, phase in enumerate(phases):
+            # 第一层单独运行 (mapper 分得全部线程预算)：其结果决定面积是否违规，并为其余层生成 ERT / ART；
+            # 其余层由调度器并行运行
+            tasks = [(position[p], p) for p in phase]
+            first = [(tasks[0], run_layer(tasks[0]))] if tasks and phase_no == 0 else []
+            rest = self.sched.map_lpt(tasks[len(first):], run_layer, cost=lambda t: self._predict_layer_seconds(t[1]))
+            stop = False
+            try:
+                for (i, prob_path), (raw, cached, failure) in itertools.chain(first, rest):
+                    if failure is not None:
+                        return self.PENALTY_VAL, 0, 0, 0, {'failure': failure}
+                    layer_name = raw.get('layer') or os.path.basename(prob_path).replace('.yaml', '')
+
+                    max_area = max(max_area, raw['area'])
+                    scaled = self._scale_layer(raw)
+                    self._remember_layer(prob_path, scaled, raw)
+                    layer_details[layer_name] = {**scaled, 'area': raw['area'], 'cached': cached,
+                                                 'stage_times': raw.get('stage_times', {}),
+                                                 'raw': {k: raw.get(k, 0) for k in self.RAW_FIELDS}}
+                    if raw.get('failures'): layer_details[layer_name]['failures'] = raw['failures']
+                    for stage, sec in raw.get('stage_times', {}).items():
+                        stage_times[stage] = stage_times.get(stage, 0.0) + sec
+
+                    # 3. Accumulate
+                    layer_results[prob_path] = scaled
+                    layers_done += 1
+
+                    if layers_done == 1 and max_area > self.cfg['AREA_LIMIT_MM2']:
+                        area_factor = 10.0
+                        stop = True
+                        break
+
+                    # --- Branch & Bound ---
+                    if prune and layers_done < total_layers:
+                        remaining_lb.pop(prob_path)
+                        lb_results = {**remaining_lb, **layer_results}
+                        lb_edp = self._combine(workloads, lb_results, max_area)[0]
+                        if lb_edp > incumbent_edp:
+                            layer_results, is_bound = lb_results, True
+                            bound_heuristic = self.BOUND_SLACK > 0
+                            stop = True
+                            break
+            finally:
+                # 提前退出时不再提交新层，等待已在运行的层结束
+                rest.close()
+            if stop or phase_no == len(phases) - 1: break
+
+            # --- 代表层完成：外推全网络，可能进入 top-k (或被抽查) 时才补齐其余层 ---
+            full, edp_est, sigma = self._extrapolate(hw_config, workloads, layer_results, max_area, plan)
+            subset_info = {
+                'layers': plan['reps'], 'predicted': sorted(plan['assign']),
+                'edp_est': edp_est, 'log_edp_std': round(sigma, 4),
+                'edp_interval': [edp_est * math.exp(-self.layer_subset.z * sigma), edp_est * math.exp(self.layer_subset.z * sigma)],
+                'promoted': None,
+            }
+            if subset_info['edp_interval'][0] <= topk_edp: subset_info['promoted'] = 'topk'
+            elif self.layer_subset.should_audit(): subset_info['promoted'] = 'audit'
+            else:
+                layer_results, is_estimate = full, True
                 break
 
+        complete = not is_bound and not is_estimate and area_factor == 1.0 and layers_done == total_layers
+        if complete:
+            if subset_info:
+                self.layer_subset.calibrate(subset_info['edp_est'], self._combine(workloads, layer_results, max_area)[0])
+            self.layer_subset.observe(hw_features(hw_config), {
+                os.path.basename(p).replace('.yaml', ''): r for p, r in layer_results.items()})
+
+        edp, total_cyc, total_eng, agg, workload_edp = self._combine(workloads, layer_results, max_area, area_factor)
+
+        extra = {'is_estimate': True} if is_estimate else {}
+        if bound_heuristic: extra['bound_heuristic'] = True
+        if subset_info: extra['subset'] = subset_info
+        return edp, total_cyc, total_eng, max_area, {**extra,
+            'logic_E': agg['log_E'], 'logic_C': agg['log_C'],
+            'dram_E': agg['mem_E'],  'dram_C': agg['mem_C'],
+            'noc_E': agg['noc_E'],   'noc_C': agg['noc_C'],
+            'total_C': total_cyc,
+            'stage_times': stage_times,
+            'is_bound': is_bound,
+            'layers_done': layers_done,
+            'layers_total': total_layers,
+            'workload_edp': workload_edp,
+            'sched': self.sched.utilization(since=sched_start),
+            'layers': layer_details
+        }
+
+    def _combine(self, workloads, layer_results, max_area, factor=1.0):
+        """
+        按工作负载汇总单层结果：每个模型各自按流水线模型得到 EDP，总目标为加权和
+        layer_results 中缺失的层 (面积违规提前退出时) 不计入
+        返回 (加权 EDP, 加权周期, 加权能耗, 加权分量, {模型: EDP})
+        """
+        total = {k: 0.0 for k in ['log_E', 'log_C', 'mem_E', 'mem_C', 'noc_E', 'noc_C']}
+        edp, total_cyc, total_eng = 0.0, 0.0, 0.0
+        workload_edp = {}
+        for name, wl in workloads.items():
+            agg = dict.fromkeys(total, 0.0)
+            for prob_path in wl['layers']:
+                scaled = layer_results.get(prob_path)
+                if scaled is None: continue
+                for k in agg: agg[k] += scaled[k] * factor
+            w = wl.get('weight', 1.0)
+            wl_edp, wl_cyc, wl_eng = self._aggregate(agg, max_area)
+            workload_edp[name] = wl_edp
+            edp += w * wl_edp
+            total_cyc += w * wl_cyc
+            total_eng += w * wl_eng
+            for k in total: total[k] += w * agg[k]
+        return edp, total_cyc, total_eng, total, workload_edp
+
+    def _aggregate(self, agg, max_area):
+        """由各层累加值计算 (EDP, 总周期, 总能耗)，含面积惩罚"""
         # Pipeline Latency Model: Max(Logic, Memory) + NoC Overhead
         total_cyc = max(agg['log_C'], agg['mem_C']) + agg['noc_C']
         total_eng = agg['log_E'] + agg['mem_E'] + agg['noc_E']
-        
+
         edp = total_cyc * total_eng
         if max_area > self.cfg['AREA_LIMIT_MM2']:
             ratio = max_area / self.cfg['AREA_LIMIT_MM2']
             edp = (edp + 1e20) * (ratio ** 2)
 
         if edp == 0: edp = self.PENALTY_VAL
-        
-        return edp, total_cyc, total_eng, max_area, {
-            'logic_E': agg['log_E'], 'logic_C': agg['log_C'],
-            'dram_E': agg['mem_E'],  'dram_C': agg['mem_C'],
-            'noc_E': agg['noc_E'],   'noc_C': agg['noc_C'],
-            'total_C': total_cyc
+        return edp, total_cyc, total_eng
+
+    def _plan_subset(self, prob_paths, workloads):
+        """
+        代表层计划 {'reps': [层名], 'assign': {非代表层: 代表层}, 'paths': {层名: 形状文件}}
+        历史完整评估不足或代表层已覆盖全部层时返回 None
+        """
+        paths = {os.path.basename(p).replace('.yaml', ''): p for p in prob_paths}
+        if not self.layer_subset.ready(paths): return None
+        mult = dict.fromkeys(paths, 0.0)
+        for wl in workloads.values():
+            for p in wl['layers']:
+                name = os.path.basename(p).replace('.yaml', '')
+                if name in mult: mult[name] += wl.get('weight', 1.0)
+        features = {}
+        for name, p in paths.items():
+            key = self._file_digest(p)
+            if key not in self.layer_features: self.layer_features[key] = shape_features(p)
+            features[name] = self.layer_features[key]
+        selection = self.layer_subset.select(list(paths), features, mult)
+        if selection is None: return None
+        reps, assign = selection
+        return {'reps': reps, 'assign': assign, 'paths': paths}
+
+    def _extrapolate(self, hw_config, workloads, layer_results, max_area, plan):
+        """由代表层实测外推其余层，返回 (全部层结果, 外推 EDP, log EDP 标准差)"""
+        paths = plan['paths']
+        measured = {name: layer_results[paths[name]] for name in plan['reps']}
+        predicted = {paths[name]: v for name, v in
+                     self.layer_subset.predict(hw_features(hw_config), measured, plan['assign']).items()}
+        full = {**layer_results, **{p: comps for p, (comps, _) in predicted.items()}}
+        edp = self._combine(workloads, full, max_area)[0]
+        sigma = self.layer_subset.log_edp_std(lambda res: self._combine(workloads, res, max_area)[0], layer_results, predicted)
+        return full, edp, max(sigma, self.layer_subset.calibrated_sigma())
+
+    def _layer_macs(self, prob_path):
+        """从问题描述 YAML 读取该层 MAC 数 (按内容缓存)"""
+        key = self._file_digest(prob_path)
+        if key not in self.layer_macs:
+            macs = 0
+            try:
+                with open(prob_path, 'r') as f: inst = yaml.safe_load(f)['problem']['instance']
+                macs = 1
+                for dim in ['C', 'M', 'R', 'S', 'N', 'P', 'Q']: macs *= int(inst.get(dim, 1))
+            except (OSError, KeyError, TypeError, ValueError, yaml.YAMLError): pass
+            self.layer_macs[key] = macs
+        return self.layer_macs[key]
+
+    def _layer_lower_bound(self, prob_path, hw_config):
+        """
+        单层的乐观下界：
+          - 逻辑周期：MAC 数 / (节点数 x PE 阵列规模)，即算力满载的解析下界
+          - 能耗：0；BOUND_SLACK > 0 时取该层在所有已评估硬件上观测到的最小值 x BOUND_SLACK (无历史时仍为 0)
+          - 访存 / NoC 周期：0
+        默认 (BOUND_SLACK = 0) 各项都是本硬件点的严格下界。历史能耗来自其它硬件点，新点的单层能耗可能更低，
+        启用后剪枝是近似的 (可能误删优于当前最优的点)，剪枝结果在 details 中标记 bound_heuristic，
+        不作为上界交给代理模型
+        """
+        peak_macs = max(1, hw_config['num_nodes'] * hw_config['pe'] ** 2)
+        hist = self.layer_history.get(self._file_digest(prob_path))
+        min_e = hist['min_E'] * self.BOUND_SLACK if hist else 0.0
+        return {
+            'log_C': self._layer_macs(prob_path) / peak_macs, 'log_E': min_e,
+            'mem_C': 0.0, 'mem_E': 0.0,
+            'noc_C': 0.0, 'noc_E': 0.0
         }
 
+    def _predict_layer_seconds(self, prob_path):
+        """
+        单层仿真耗时预测 (LPT 排序用)：有实测时取最近一次实测，
+        否则按 MAC 数 x 已测层的平均每 MAC 耗时 (尚无实测时只按 MAC 数排序)
+        """
+        key = self._file_digest(prob_path)
+        if key in self.layer_seconds: return self.layer_seconds[key][0]
+        measured = list(self.layer_seconds.values())
+        macs_sum = sum(m for _, m in measured)
+        rate = sum(s for s, _ in measured) / macs_sum if macs_sum > 0 else 1.0
+        return self._layer_macs(prob_path) * rate
+
+    def _remember_layer(self, prob_path, scaled, raw=None):
+        key = self._file_digest(prob_path)
+        if raw and raw.get('stage_times'):
+            self.layer_seconds[key] = (sum(raw['stage_times'].values()), self._layer_macs(prob_path))
+        cyc = max(scaled['log_C'], scaled['mem_C']) + scaled['noc_C']
+        eng = scaled['log_E'] + scaled['mem_E'] + scaled['noc_E']
+        hist = self.layer_history.setdefault(key, {'count': 0, 'cyc_sum': 0.0, 'eng_sum': 0.0, 'min_E': float('inf')})
+        hist['count'] += 1
+        hist['cyc_sum'] += cyc
+        hist['eng_sum'] += eng
+        hist['min_E'] = min(hist['min_E'], eng)
+
+    def _file_digest(self, path):
+        try:
+            with open(path, 'rb') as f: return hashlib.sha1(f.read()).hexdigest()
+        except OSError:
+            return path
+
+    def build_job(self, hw_config, software_schedule, stats_dir, comp_dir, iter_context=None, incumbent_edp=None,
+                  topk_edp=None):
+        """
+        打包一个可交给远程 worker 的评估任务：硬件参数 + SoftwareOptimizer.optimize 产生的调度，
+        并附带所有输入文件内容，使 worker 不依赖与调度端共享的文件系统
+        子集模式 (topk_edp 非 None) 下附带调度端的代表层子集历史，各 worker 共用同一份选层、外推与误差校准
+        """
+        rel = lambda p: os.path.relpath(p, os.getcwd())
+        workloads = software_schedule.get('workloads') or {}
+        prob_paths = list(software_schedule['prob_paths'])
+        for wl in workloads.values(): prob_paths += wl['layers']
+        prob_paths = list(dict.fromkeys(prob_paths))
+        files = [hw_config['arch_file'], software_schedule['mapper_path'], software_schedule['constraints_path']] + prob_paths
+        if os.path.exists(comp_dir):
+            for root, _, names in os.walk(comp_dir):
+                files += [os.path.join(root, n) for n in names if n.endswith(".yaml")]
+
+        contents = {}
+        for path in files:
+            with open(path, 'r') as f: contents[rel(path)] = f.read()
+
+        return {
+            'hw_cfg': {**hw_config, 'arch_file': rel(hw_config['arch_file'])},
+            'schedule': {
+                'mapper_path': rel(software_schedule['mapper_path']),
+                'constraints_path': rel(software_schedule['constraints_path']),
+                'prob_paths': [rel(p) for p in software_schedule['prob_paths']],
+                'workloads': {name: {'weight': wl.get('weight', 1.0), 'layers': [rel(p) for p in wl['layers']]}
+                              for name, wl in workloads.items()}
+            },
+            'stats_dir': rel(stats_dir),
+            'comp_dir': rel(comp_dir),
+            'iter_context': iter_context,
+            'incumbent_edp': incumbent_edp,
+            'topk_edp': topk_edp,
+            'layer_subset': self.layer_subset.state_dict() if topk_edp is not None else None,
+            'files': contents
+        }
+
+    def evaluate_job(self, job):
+        """
+        Worker 模式：还原任务中的输入文件后执行 evaluate_system
+        输入文件只能是工作目录内的相对路径；先写临时文件再 os.replace，
+        同一目录下的其它 worker 不会读到写了一半的文件
+        """
+        for rel_path, content in job.get('files', {}).items():
+            norm = _job_path(rel_path)
+            existing = None
+            if os.path.exists(norm):
+                with open(norm, 'r') as f: existing = f.read()
+            if existing != content:
+                if os.path.dirname(norm): os.makedirs(os.path.dirname(norm), exist_ok=True)
+                tmp_path = f"{norm}.{os.getpid()}.tmp"
+                with open(tmp_path, 'w') as f: f.write(content)
+                os.replace(tmp_path, norm)
+
+        if job.get('layer_subset') is not None: self.layer_subset.load_state_dict(job['layer_subset'])
+        os.makedirs(_job_path(job['stats_dir']), exist_ok=True)
+        with span("evaluate_job", cat="worker", stats_dir=job['stats_dir']):
+            edp, cycles, energy, area, details = self.evaluate_system(
+                job['hw_cfg'], job['schedule'], job['stats_dir'], job['comp_dir'], iter_context=job.get('iter_context'),
+                incumbent_edp=job.get('incumbent_edp'), topk_edp=job.get('topk_edp'))
+        return {'edp': edp, 'cycles': cycles, 'energy': energy, 'area': area, 'details': details}
+
+    def _run_layer(self, input_files, layer_dir, num_nodes, spinner, layer_name, tables=None):
+        """
+        运行单层的 Timeloop + Ramulator-PIM + BookSim，返回未外推的原始结果
+        tables: 缓存的 [ERT, ART]，追加到 Timeloop 输入中以跳过 Accelergy
+        失败时返回 None
+        """
+        # 各阶段耗时 (秒)，供代价模型使用
+        stage_times = {}
+        self.tls.failure = None
+
+        # --- 1. Run Timeloop (Logic) ---
+        canonical_input = os.path.join(layer_dir, "timeloop-input.yaml")
+        t0 = time.perf_counter()
+        with span("preprocess", layer=layer_name):
+            ok = self._preprocess_timeloop_input(input_files, canonical_input)
+            if ok and tables: self.ert_cache.append_tables(canonical_input, tables)
+        if not ok:
+            self.tls.failure = {'simulator': 'timeloopfe', 'kind': 'preprocess'}
+            return None
+        stage_times['preprocess'] = time.perf_counter() - t0
+
+        cmd = [self.mapper_bin, canonical_input, "-o", layer_dir]
+        # 线程数按调度器分得的核心数改写 (不计入 mapper 阶段耗时的是等待核心的时间)
+        with self.sched.slot(self.sched.mapper_threads(), kind="mapper") as threads:
+            self._set_mapper_threads(canonical_input, threads)
+            t0 = time.perf_counter()
+            # 在工作目录中运行，accelergy 日志等副产物不会落到项目根目录
+            with span("timeloop-mapper", layer=layer_name, threads=threads):
+                ret = self._run_subprocess(cmd, cwd=layer_dir)
+            stage_times['mapper'] = time.perf_counter() - t0
+
+        stats_file = os.path.join(layer_dir, "timeloop-mapper.stats.txt")
+        results = None
+        if ret['success']:
+            try:
+                with span("parse-stats", layer=layer_name):
+                    if os.path.exists(stats_file): results = TimeloopParser(stats_file).parse()
+            except: pass
+            if results is None: self.runner.parse_failure(ret)
+
+        if results is None:
+            spinner.stop()
+            log_line(f"{C_RED}[Timeloop Failed]{C_END} {layer_name} ({describe(ret)})")
+            self.tls.failure = failure_record(ret, layer_name)
+            return None
+
+        real_dram_accesses = results.get('dram_accesses', 0)
+
+        # --- 2. Run Ramulator-PIM & BookSim (Sampling Mode) ---
+        trace_file = os.path.join(layer_dir, "dram.trace")
+
+        # 生成 Burst Trace
+        t0 = time.perf_counter()
+        with span("trace", layer=layer_name):
+            sampled_count = self._generate_synthetic_trace(trace_file, real_dram_accesses, self.SAMPLE_SIZE)
+        stage_times['trace'] = time.perf_counter() - t0
+
+        # 工作目录可能不在项目树内 (tmpfs)，传绝对路径
+        trace_rel = os.path.abspath(trace_file)
+        output_rel = os.path.abspath(layer_dir)
+
+        # 配置 Ramulator-PIM
+        config_ram = "configs/ramulator/LPDDR4-config.cfg"
+        config_noc = "configs/ramulator/sedram.cfg"
+
+        # Ramulator / BookSim 均为单线程，各占一个核心；大 trace 按通道分片时按分片数申请核心
+        with self.sched.slot(self.ram.planned_shards(config_ram, sampled_count), kind="sim") as cores:
+            sim_res = self.ram.run_simulation(
+                config_rel_path=config_ram,
+                trace_rel_path=trace_rel,
+                output_rel_dir=output_rel,
+                network_config_path=config_noc,
+                num_nodes=num_nodes,
+                parallel=cores
+            )
+        stage_times['ramulator'] = sim_res.get('ram_time_s', 0.0)
+        stage_times['booksim'] = sim_res.get('noc_time_s', 0.0)
+        # 内存 / 片上网络仿真失败不作废该层 (对应项按 0 计)，但记录下来
+        for fail in sim_res.get('failures', []):
+            spinner.stop()
+            log_line(f"{C_YELLOW}[Sim Warning]{C_END} {layer_name} ({describe(fail)})")
+
+        return {
+            'logic_C': results.get('cycles', 0),
+            'logic_E': results.get('energy_pj', 0),
+            'area': results.get('area_mm2', 0),
+            'dram_accesses': real_dram_accesses,
+            'sampled_count': sampled_count,
+            'ram_cycles': sim_res.get('ram_cycles', 0),
+            'ram_energy_pj': sim_res.get('ram_energy_pj', 0.0),
+            'noc_cycles': sim_res.get('noc_cycles', 0.0),
+            'noc_energy_pj': sim_res.get('noc_energy_pj', 0.0),
+            'stage_times': stage_times,
+            'failures': [failure_record(f, layer_name) for f in sim_res.get('failures', [])]
+        }
+
+    def _scale_layer(self, raw):
+        """将采样仿真结果外推到真实访存量"""
+        # 外推 (Extrapolation)
+        scale_factor = 0.0
+        if raw['sampled_count'] > 0:
+            scale_factor = float(raw['dram_accesses']) / float(raw['sampled_count'])
+
+        return {
+            'log_E': raw['logic_E'], 'log_C': raw['logic_C'],
+            'mem_E': raw['ram_energy_pj'] * scale_factor,
+            'mem_C': raw['ram_cycles'] * scale_factor,
+            'noc_E': raw['noc_energy_pj'] * scale_factor,
+            'noc_C': raw['noc_cycles'] * scale_factor
+        }
+
+    def _layer_signature(self, input_files, num_nodes):
+        """按输入文件内容 (而非路径) 计算签名，用于判断已有的单层结果是否可复用"""
+        h = hashlib.sha1()
+        for path in input_files:
+            try:
+                with open(path, 'rb') as f: h.update(f.read())
+            except OSError:
+                h.update(path.encode())
+        h.update(f"nodes={num_nodes};sample={self.SAMPLE_SIZE}".encode())
+        return h.hexdigest()
+
+    def _load_layer_result(self, layer_dir, signature):
+        path = os.path.join(layer_dir, self.LAYER_RESULT_FILE)
+        if not os.path.exists(path): return None
+        try:
+            with open(path, 'r') as f: raw = json.load(f)
+        except (OSError, ValueError): return None
+        if raw.get('signature') != signature: return None
+        return raw
+
+    def _save_layer_result(self, layer_dir, raw):
+        # 先写临时文件再原子替换，避免崩溃时留下半截 JSON
+        path = os.path.join(layer_dir, self.LAYER_RESULT_FILE)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(raw, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
     def _generate_synthetic_trace(self, filepath, total_accesses, sample_limit):
         count = min(total_accesses, sample_limit)
         if count <= 0:
@@ -161,15 +613,23 @@ class CoDesignEvaluator:
         return count
 
     def _preprocess_timeloop_input(self, input_files, output_path):
+        # timeloopfe 导入较慢，只在第一次真正需要预处理时加载
+        from timeloopfe.v4.specification import Specification
+        from timeloopfe.common.backend_calls import _specification_to_yaml_string
         try:
             spec = Specification.from_yaml_files(input_files)
             with open(output_path, "w") as f: f.write(_specification_to_yaml_string(spec._process()))
             return True
         except: return False
 
-    def _run_subprocess(self, cmd):
+    def _set_mapper_threads(self, canonical_input, threads):
+        """改写已展开的 Timeloop 输入中 mapper 的 num_threads"""
         try:
-            res = subprocess.run(cmd, capture_output=True, text=True, timeout=120)
-            return {'success': res.returncode == 0, 'stdout': res.stdout, 'stderr': res.stderr}
-        except Exception as e:
-            return {'success': False, 'stdout': "", 'stderr': str(e)}
+            with open(canonical_input, 'r') as f: text = f.read()
+            new_text = re.sub(r"^(\s*num_threads:\s*)\d+", lambda m: f"{m.group(1)}{threads}", text, flags=re.MULTILINE)
+            if new_text != text:
+                with open(canonical_input, 'w') as f: f.write(new_text)
+        except OSError: pass
+
+    def _run_subprocess(self, cmd, cwd=None):
+        return self.runner.run(cmd, simulator=os.path.basename(cmd[0]), cwd=cwd)
@@ -0,0 +1,81 @@
+"""
+入口导入耗时预算检查：python -m modules.import_budget
+
+每个入口在全新的 Python 子进程中导入 (与 worker / 进程池派生时一致)，
+记录导入耗时与整个进程的启动耗时，并检查重量级依赖没有在导入阶段被加载。
+任一入口超出预算或提前加载了重量级依赖时返回非零退出码。
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+# 只应在首次使用时加载的依赖
+HEAVY_MODULES = ['torch', 'torchvision', 'sklearn', 'skopt', 'scipy', 'timeloopfe']
+
+# 入口 -> 导入耗时预算 (毫秒)
+IMPORT_BUDGET_MS = {
+    'main_optimization': 300,
+    'modules.evaluation_engine': 100,
+    'modules.job_broker': 50,
+    'modules.workload_manager': 100,
+    'modules.optimizer_turbo': 200,
+    'modules.surrogate': 200,
+    'modules.result_parser': 50,
+    'modules.wrapper_ramulator': 50,
+    'modules.arch_gen': 150,
+}
+
+_PROBE = (
+    "import sys, time, json\n"
+    "t0 = time.perf_counter()\n"
+    "import {module}\n"
+    "dt = (time.perf_counter() - t0) * 1000.0\n"
+    "print(json.dumps({{'import_ms': dt, 'heavy': [m for m in {heavy!r} if m in sys.modules]}}))\n"
+)
+
+def measure(module, repeats=3):
+    """返回 {'import_ms', 'spawn_ms', 'heavy'}，取多次测量中的最小值以排除磁盘缓存抖动"""
+    best = None
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        res = subprocess.run([sys.executable, "-c", _PROBE.format(module=module, heavy=HEAVY_MODULES)],
+                             cwd=PROJECT_ROOT, capture_output=True, text=True)
+        spawn_ms = (time.perf_counter() - t0) * 1000.0
+        if res.returncode != 0:
+            return {'import_ms': float('inf'), 'spawn_ms': spawn_ms, 'heavy': [], 'error': res.stderr.strip().splitlines()[-1:]}
+        out = json.loads(res.stdout.strip().splitlines()[-1])
+        out['spawn_ms'] = spawn_ms
+        if best is None or out['import_ms'] < best['import_ms']:
+            best = out
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description="Check import-time budgets of the entry points")
+    parser.add_argument("modules", nargs="*", help="entry points to check (default: all budgeted modules)")
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    targets = args.modules or list(IMPORT_BUDGET_MS.keys())
+    failed = False
+    print(f"{'Entry point':<30} {'Import(ms)':>10} {'Budget':>8} {'Spawn(ms)':>10}  Status")
+    for module in targets:
+        res = measure(module, args.repeats)
+        budget = IMPORT_BUDGET_MS.get(module, float('inf'))
+        status = "OK"
+        if 'error' in res:
+            status = f"ERROR {res['error']}"
+        elif res['heavy']:
+            status = f"HEAVY {','.join(res['heavy'])}"
+        elif res['import_ms'] > budget:
+            status = "OVER"
+        failed |= status != "OK"
+        print(f"{module:<30} {res['import_ms']:>10.1f} {budget:>8.0f} {res['spawn_ms']:>10.1f}  {status}")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
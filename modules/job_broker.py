@@ -0,0 +1,219 @@
+import os
+import json
+import time
+import socket
+import threading
+
+class DirectoryJobBroker:
+    """
+    基于共享目录的评估任务队列，不依赖任何外部服务 (本机目录或多节点共享的 NFS 目录均可)
+
+    queue_dir/
+      pending/<job_id>.json              待领取的任务
+      running/<job_id>@<worker_id>.json  已被某个 worker 领取 (os.rename 原子领取)
+      results/<job_id>.json              评估结果
+      workers/<worker_id>.hb             worker 心跳 (以 mtime 为准)
+    """
+    def __init__(self, queue_dir, heartbeat_timeout=60.0, max_attempts=3):
+        self.queue_dir = queue_dir
+        self.heartbeat_timeout = heartbeat_timeout
+        self.max_attempts = max_attempts
+        self.pending_dir = os.path.join(queue_dir, "pending")
+        self.running_dir = os.path.join(queue_dir, "running")
+        self.results_dir = os.path.join(queue_dir, "results")
+        self.workers_dir = os.path.join(queue_dir, "workers")
+        for d in [self.pending_dir, self.running_dir, self.results_dir, self.workers_dir]:
+            os.makedirs(d, exist_ok=True)
+
+    # ------------------------------------------------------------
+    # 通用工具
+    # ------------------------------------------------------------
+    def _write_json(self, path, obj):
+        # 同目录下先写临时文件再 rename，读者永远看不到半个文件
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(obj, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def _read_json(self, path):
+        with open(path, 'r') as f:
+            return json.load(f)
+
+    def _running_files(self, job_id=None):
+        files = [f for f in os.listdir(self.running_dir) if f.endswith(".json")]
+        if job_id is not None:
+            files = [f for f in files if f.split("@")[0] == job_id]
+        return files
+
+    # ------------------------------------------------------------
+    # 调度端 (Engine)
+    # ------------------------------------------------------------
+    def submit(self, job_id, payload):
+        """提交任务；若该任务已有结果或已在队列中 (如续跑时重复提交)，则跳过"""
+        if self.get_result(job_id) is not None: return job_id
+        pending_path = os.path.join(self.pending_dir, f"{job_id}.json")
+        if os.path.exists(pending_path) or self._running_files(job_id): return job_id
+        self._write_json(pending_path, {'job_id': job_id, 'attempts': 0, 'payload': payload})
+        return job_id
+
+    def get_result(self, job_id):
+        path = os.path.join(self.results_dir, f"{job_id}.json")
+        if not os.path.exists(path): return None
+        try:
+            return self._read_json(path)
+        except (OSError, ValueError):
+            return None
+
+    def queue_depth(self):
+        pending = len([f for f in os.listdir(self.pending_dir) if f.endswith(".json")])
+        return pending, len(self._running_files())
+
+    def live_workers(self):
+        now = time.time()
+        alive = []
+        for f in os.listdir(self.workers_dir):
+            if not f.endswith(".hb"): continue
+            try:
+                if now - os.path.getmtime(os.path.join(self.workers_dir, f)) <= self.heartbeat_timeout:
+                    alive.append(f[:-3])
+            except OSError: pass
+        return alive
+
+    def requeue_dead(self):
+        """
+        把心跳超时 worker 手中的任务放回 pending；超过 max_attempts 的任务直接记为失败
+        返回被重新排队的 job_id 列表
+        """
+        alive = set(self.live_workers())
+        requeued = []
+        for fname in self._running_files():
+            job_id, worker_id = fname[:-5].split("@", 1)
+            if worker_id in alive: continue
+            running_path = os.path.join(self.running_dir, fname)
+            try:
+                job = self._read_json(running_path)
+            except (OSError, ValueError):
+                continue
+            job['attempts'] = job.get('attempts', 0) + 1
+            if job['attempts'] >= self.max_attempts:
+                self._write_json(os.path.join(self.results_dir, f"{job_id}.json"),
+                                 {'job_id': job_id, 'ok': False, 'error': f"worker {worker_id} died {job['attempts']} times"})
+            else:
+                self._write_json(os.path.join(self.pending_dir, f"{job_id}.json"), job)
+                requeued.append(job_id)
+            try:
+                os.remove(running_path)
+            except FileNotFoundError: pass
+        return requeued
+
+    def collect(self, job_ids, timeout=None, poll_interval=1.0, on_poll=None):
+        """
+        阻塞等待一组任务全部完成，期间持续回收死亡 worker 的任务
+        返回 {job_id: result}；超时则只返回已完成的部分
+        """
+        results = {}
+        start = time.time()
+        while len(results) < len(job_ids):
+            for job_id in job_ids:
+                if job_id in results: continue
+                res = self.get_result(job_id)
+                if res is not None: results[job_id] = res
+            if len(results) == len(job_ids): break
+            if timeout is not None and time.time() - start > timeout: break
+            self.requeue_dead()
+            if on_poll: on_poll(results)
+            time.sleep(poll_interval)
+        return results
+
+    # ------------------------------------------------------------
+    # 执行端 (Worker)
+    # ------------------------------------------------------------
+    def heartbeat(self, worker_id):
+        path = os.path.join(self.workers_dir, f"{worker_id}.hb")
+        with open(path, 'a'): pass
+        os.utime(path, None)
+
+    def unregister(self, worker_id):
+        try:
+            os.remove(os.path.join(self.workers_dir, f"{worker_id}.hb"))
+        except FileNotFoundError: pass
+
+    def claim(self, worker_id):
+        """原子领取最早提交的任务；没有任务时返回 None"""
+        for fname in sorted(os.listdir(self.pending_dir)):
+            if not fname.endswith(".json"): continue
+            job_id = fname[:-5]
+            src = os.path.join(self.pending_dir, fname)
+            dst = os.path.join(self.running_dir, f"{job_id}@{worker_id}.json")
+            try:
+                os.rename(src, dst)
+            except FileNotFoundError:
+                continue  # 被其他 worker 抢先领取
+            try:
+                return self._read_json(dst)
+            except (OSError, ValueError):
+                continue
+        return None
+
+    def complete(self, job_id, worker_id, result):
+        self._write_json(os.path.join(self.results_dir, f"{job_id}.json"), result)
+        try:
+            os.remove(os.path.join(self.running_dir, f"{job_id}@{worker_id}.json"))
+        except FileNotFoundError: pass
+
+
+class EvaluationWorker:
+    """
+    从 broker 拉取任务并执行 evaluate_fn(payload) -> dict，后台线程定期写心跳
+    """
+    def __init__(self, broker, evaluate_fn, worker_id=None, heartbeat_interval=10.0, poll_interval=1.0):
+        self.broker = broker
+        self.evaluate_fn = evaluate_fn
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+        self.heartbeat_interval = heartbeat_interval
+        self.poll_interval = poll_interval
+        self.stop_event = threading.Event()
+
+    def _heartbeat_loop(self):
+        while not self.stop_event.is_set():
+            try:
+                self.broker.heartbeat(self.worker_id)
+            except OSError: pass
+            self.stop_event.wait(self.heartbeat_interval)
+
+    def serve(self, max_jobs=None, idle_exit=None):
+        """
+        循环领取并执行任务
+        max_jobs: 处理指定数量任务后退出；idle_exit: 连续空闲若干秒后退出 (None 表示一直等待)
+        """
+        self.broker.heartbeat(self.worker_id)
+        hb_thread = threading.Thread(target=self._heartbeat_loop, daemon=True)
+        hb_thread.start()
+
+        done = 0
+        idle_since = time.time()
+        try:
+            while max_jobs is None or done < max_jobs:
+                job = self.broker.claim(self.worker_id)
+                if job is None:
+                    if idle_exit is not None and time.time() - idle_since > idle_exit: break
+                    time.sleep(self.poll_interval)
+                    continue
+
+                t0 = time.time()
+                try:
+                    result = dict(self.evaluate_fn(job['payload']))
+                    result['ok'] = True
+                except Exception as e:
+                    result = {'ok': False, 'error': f"{type(e).__name__}: {e}"}
+                result.update({'job_id': job['job_id'], 'worker': self.worker_id, 'elapsed_s': time.time() - t0})
+                self.broker.complete(job['job_id'], self.worker_id, result)
+                done += 1
+                idle_since = time.time()
+        finally:
+            self.stop_event.set()
+            hb_thread.join()
+            self.broker.unregister(self.worker_id)
+        return done
@@ -0,0 +1,194 @@
+"""
+代表层子集评估：多数候选点不需要跑全部层就能排序，EDP 的排序主要由少数主导层决定
+
+  - 选层：按层形状特征 (log C / M / P*Q / R*S / MAC 数、步长) 做加权 k-means，权重为该层在历史完整评估中的
+    代价占比 (周期与能耗占比的平均，含层在各工作负载中的重复次数与权重)；每簇取占比最大的层作为代表
+  - 外推：未运行的层 q 由其簇代表 r 在当前硬件点上的实测分量回归
+        log x_q,k - log x_r,k = a + b . [log2 节点数, log2 PE, sram_log2]      (k 为 6 个周期 / 能耗分量)
+    在历史完整评估上最小二乘拟合 (样本少于 2 倍参数时只拟合常数项)，残差标准差即该层该分量的不确定度；
+    历史中出现 0 值的分量改为直接对 log(1 + x_q,k) 回归
+  - 误差：对外推层按各自不确定度做对数正态扰动，经 _combine 汇总得到 log EDP 的标准差；
+    补齐全部层的候选 (进入 top-k 或抽查) 把外推值与真实 EDP 比较，累计的经验误差 (RMS) 作为标准差下限
+"""
+import math
+import yaml
+
+# numpy / sklearn 在首次选层或外推时才导入 (evaluation_engine 导入本模块，受 import_budget 约束)
+
+COMPONENTS = ('log_C', 'log_E', 'mem_C', 'mem_E', 'noc_C', 'noc_E')
+SIGMA_FLOOR = 0.02
+# 只有常数项且样本极少时的先验不确定度 (log 单位)
+SIGMA_PRIOR = 0.5
+MC_SAMPLES = 64
+
+def hw_features(hw_config):
+    """evaluate_system 的 hw_config -> 回归用硬件特征"""
+    return [math.log2(max(1, hw_config['num_nodes'])), math.log2(max(1, hw_config['pe'])),
+            float(hw_config.get('sram_log2') or 0)]
+
+def shape_features(prob_path):
+    """问题描述 YAML -> 聚类用形状特征；无法解析时返回 None"""
+    try:
+        with open(prob_path, 'r') as f: inst = yaml.safe_load(f)['problem']['instance']
+        dims = {d: max(1, int(inst.get(d, 1))) for d in ['C', 'M', 'R', 'S', 'N', 'P', 'Q']}
+    except (OSError, KeyError, TypeError, ValueError, yaml.YAMLError):
+        return None
+    macs = math.prod(dims.values())
+    return [math.log(dims['C']), math.log(dims['M']), math.log(dims['P'] * dims['Q']), math.log(dims['R'] * dims['S']),
+            math.log(macs), float(inst.get('Wstride', 1)) * float(inst.get('Hstride', 1))]
+
+def _cost(comps):
+    return max(comps['log_C'], comps['mem_C']) + comps['noc_C'], comps['log_E'] + comps['mem_E'] + comps['noc_E']
+
+class LayerSubsetModel:
+    def __init__(self, fraction=0.3, min_layers=2, min_history=8, max_history=200, z=2.0, audit_every=10):
+        self.fraction = fraction
+        self.min_layers = min_layers
+        self.min_history = min_history
+        self.max_history = max_history
+        self.z = z
+        self.audit_every = audit_every
+        # 完整评估 [(硬件特征, {层名: 6 个分量})]
+        self.history = []
+        # 外推 EDP 相对真实 EDP 的 log 误差
+        self.errors = []
+        self.version = 0
+        self.plans = 0
+        self._fits = {}
+        self._selection = None
+
+    def observe(self, hw, layer_results):
+        """记录一次完整评估 (layer_results: {层名: _scale_layer 结果})"""
+        self.history.append((list(hw), {name: {k: float(r[k]) for k in COMPONENTS} for name, r in layer_results.items()}))
+        del self.history[:-self.max_history]
+        self.version += 1
+        self._fits = {}
+
+    def state_dict(self):
+        """分布式模式随任务下发给 worker 的历史 (完整评估与校准误差)"""
+        return {'history': self.history, 'errors': self.errors}
+
+    def load_state_dict(self, state):
+        """以调度端的历史替换本地历史 (worker 每个任务调用一次，拟合与选层缓存随之失效)"""
+        self.history = [(list(hw), comps) for hw, comps in state.get('history', [])]
+        self.errors = list(state.get('errors', []))
+        self.version += 1
+        self._fits = {}
+
+    def calibrate(self, edp_est, edp_true):
+        if edp_est > 0 and edp_true > 0:
+            self.errors.append(math.log(edp_est / edp_true))
+            del self.errors[:-50]
+
+    def calibrated_sigma(self):
+        import numpy as np
+        if len(self.errors) < 3: return 0.0
+        return float(np.sqrt(np.mean(np.square(self.errors))))
+
+    def ready(self, layers):
+        """每个层都至少在 min_history 次完整评估中出现过"""
+        return all(sum(1 for _, comps in self.history if name in comps) >= self.min_history for name in layers)
+
+    def contributions(self, layers, mult):
+        """各层在历史完整评估中的平均代价占比"""
+        share = dict.fromkeys(layers, 0.0)
+        n = 0
+        for _, comps in self.history:
+            if not all(name in comps for name in layers): continue
+            costs = {name: _cost(comps[name]) for name in layers}
+            tot_c = sum(mult[name] * c for name, (c, _) in costs.items()) or 1.0
+            tot_e = sum(mult[name] * e for name, (_, e) in costs.items()) or 1.0
+            for name, (c, e) in costs.items():
+                share[name] += 0.5 * mult[name] * (c / tot_c + e / tot_e)
+            n += 1
+        return {name: s / max(1, n) for name, s in share.items()}
+
+    def select(self, layers, features, mult):
+        """
+        返回 (代表层列表, {非代表层: 其簇代表})；代表层数不少于全部层时返回 None
+        同一历史版本与层集合下结果不变 (k-means 固定随机种子)
+        """
+        key = (self.version, tuple(sorted(layers)))
+        if self._selection and self._selection[0] == key: return self._selection[1]
+        layers = sorted(layers)
+        k = max(self.min_layers, math.ceil(self.fraction * len(layers)))
+        plan = None
+        if k < len(layers) and all(features.get(name) is not None for name in layers):
+            import numpy as np
+            from sklearn.cluster import KMeans
+            share = self.contributions(layers, mult)
+            X = np.array([features[name] for name in layers], dtype=float)
+            X = (X - X.mean(axis=0)) / np.maximum(X.std(axis=0), 1e-9)
+            w = np.array([share[name] for name in layers]) + 1e-3
+            labels = KMeans(n_clusters=k, n_init=10, random_state=0).fit(X, sample_weight=w).labels_
+            reps, assign = [], {}
+            for c in sorted(set(labels)):
+                members = [name for name, lab in zip(layers, labels) if lab == c]
+                rep = max(members, key=lambda name: share[name])
+                reps.append(rep)
+                for name in members:
+                    if name != rep: assign[name] = rep
+            plan = (reps, assign)
+        self._selection = (key, plan)
+        return plan
+
+    def should_audit(self):
+        """每 audit_every 个可子集评估的候选抽查一个完整评估，持续校准误差"""
+        self.plans += 1
+        return bool(self.audit_every) and self.plans % self.audit_every == 0
+
+    def _fit(self, q, r, k):
+        import numpy as np
+        key = (q, r, k)
+        if key in self._fits: return self._fits[key]
+        rows = [(hw, comps[q][k], comps[r][k]) for hw, comps in self.history if q in comps and r in comps]
+        H = np.array([hw for hw, _, _ in rows], dtype=float)
+        xq = np.array([v for _, v, _ in rows])
+        xr = np.array([v for _, _, v in rows])
+        if not np.any(xq > 0):
+            fit = ('zero', np.zeros(1), 0.0)
+        else:
+            if np.all(xq > 0) and np.all(xr > 0):
+                mode, y = 'ratio', np.log(xq) - np.log(xr)
+            else:
+                mode, y = 'direct', np.log1p(xq)
+            A = np.ones((len(y), 1))
+            if len(y) >= 2 * (1 + H.shape[1]): A = np.hstack([A, H])
+            coef = np.linalg.lstsq(A.T @ A + 1e-6 * np.eye(A.shape[1]), A.T @ y, rcond=None)[0]
+            resid = y - A @ coef
+            dof = len(y) - A.shape[1]
+            sigma = math.sqrt(float(resid @ resid) / dof) if dof > 0 else SIGMA_PRIOR
+            fit = (mode, coef, max(SIGMA_FLOOR, sigma))
+        self._fits[key] = fit
+        return fit
+
+    def predict(self, hw, measured, assign):
+        """measured: {代表层名: 分量}；返回 {层名: (预测分量, {分量: log 标准差})}"""
+        import numpy as np
+        out = {}
+        x = np.array([1.0] + list(hw))
+        for q, r in assign.items():
+            comps, sig = {}, {}
+            for k in COMPONENTS:
+                mode, coef, sigma = self._fit(q, r, k)
+                a = float(coef @ x[:len(coef)])
+                if mode == 'zero': comps[k] = 0.0
+                elif mode == 'ratio': comps[k] = measured[r][k] * math.exp(a)
+                else: comps[k] = max(0.0, math.expm1(a))
+                sig[k] = sigma
+            out[q] = (comps, sig)
+        return out
+
+    def log_edp_std(self, combine, measured, predicted, seed=0):
+        """对外推层做对数正态扰动，返回 log EDP 的标准差；combine(layer_results) -> EDP"""
+        if not predicted: return 0.0
+        import numpy as np
+        rng = np.random.RandomState(seed)
+        logs = []
+        for _ in range(MC_SAMPLES):
+            sample = dict(measured)
+            for key, (comps, sig) in predicted.items():
+                sample[key] = {k: comps[k] * math.exp(rng.normal(0.0, sig[k])) for k in COMPONENTS}
+            edp = combine(sample)
+            if edp > 0: logs.append(math.log(edp))
+        return float(np.std(logs)) if len(logs) > 1 else SIGMA_PRIOR
@@ -0,0 +1,190 @@
+"""
+Prometheus 文本格式的运行指标 (无第三方依赖)
+
+各模块在导入时声明指标并随时更新 (只是加锁的字典操作，不启动服务时几乎没有开销)；
+engine 传入 --metrics-port 时启动 MetricsServer，在 http://127.0.0.1:<port>/metrics 提供抓取
+    curl -s localhost:9464/metrics
+"""
+import math
+import threading
+
+DEFAULT_BUCKETS = (0.1, 0.5, 1, 2, 5, 10, 30, 60, 120, 300, 600, 1800, 3600, float('inf'))
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _fmt_labels(labels):
+    if not labels: return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels) + "}"
+
+def _fmt_value(v):
+    if v == float('inf'): return "+Inf"
+    if v == float('-inf'): return "-Inf"
+    if isinstance(v, float) and math.isnan(v): return "NaN"
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple((k, labels[k]) for k in self.labelnames)
+
+    def _samples(self):
+        with self.lock:
+            return [(self.name, key, v) for key, v in sorted(self.values.items())]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for name, key, v in self._samples():
+            lines.append(f"{name}{_fmt_labels(key)} {_fmt_value(v)}")
+        return "\n".join(lines)
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1.0, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0.0) + amount
+
+    def get(self, **labels):
+        with self.lock:
+            return self.values.get(self._key(labels), 0.0)
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name, help_text, labelnames=()):
+        super().__init__(name, help_text, labelnames)
+        self.fn = None
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def set_function(self, fn):
+        """抓取时才计算的无标签值 (如按运行时间折算的吞吐)"""
+        self.fn = fn
+
+    def clear(self):
+        with self.lock:
+            self.values.clear()
+
+    def _samples(self):
+        if self.fn is not None:
+            try:
+                return [(self.name, (), float(self.fn()))]
+            except Exception:
+                return []
+        return super()._samples()
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(set(buckets) | {float('inf')}))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            counts, total = self.values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound: counts[i] += 1
+            self.values[key] = (counts, total + value)
+
+    def _samples(self):
+        out = []
+        with self.lock:
+            items = sorted(self.values.items())
+        for key, (counts, total) in items:
+            for bound, c in zip(self.buckets, counts):
+                out.append((f"{self.name}_bucket", key + (('le', _fmt_value(bound)),), c))
+            out.append((f"{self.name}_sum", key, total))
+            out.append((f"{self.name}_count", key, counts[-1]))
+        return out
+
+class MetricsRegistry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}
+
+    def _get_or_create(self, cls, name, help_text, labelnames, **kwargs):
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = cls(name, help_text, labelnames, **kwargs)
+            return metric
+
+    def counter(self, name, help_text, labelnames=()):
+        return self._get_or_create(Counter, name, help_text, labelnames)
+
+    def gauge(self, name, help_text, labelnames=()):
+        return self._get_or_create(Gauge, name, help_text, labelnames)
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._get_or_create(Histogram, name, help_text, labelnames, buckets=buckets)
+
+    def render(self):
+        with self.lock:
+            metrics = list(self.metrics.values())
+        return "\n".join(m.render() for m in metrics) + "\n"
+
+REGISTRY = MetricsRegistry()
+
+# 各模块共用的指标
+SIM_FAILURES = REGISTRY.counter("pimdse_simulator_failures_total",
+                                "Simulator invocations that failed or timed out", ["simulator", "kind"])
+LAYER_CACHE = REGISTRY.counter("pimdse_layer_cache_total", "Per-layer result lookups", ["result"])
+ERT_CACHE = REGISTRY.counter("pimdse_ert_cache_total", "Accelergy ERT/ART table lookups per simulated layer", ["result"])
+
+class MetricsServer:
+    """在后台线程中提供 /metrics；port=0 时由系统分配端口 (见 self.port)"""
+    def __init__(self, port, host="127.0.0.1", registry=REGISTRY):
+        # http.server 导入约 30ms，只在真正启动服务时加载
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        self.registry = registry
+        registry_ref = registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/metrics", "/"):
+                    self.send_error(404)
+                    return
+                body = registry_ref.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, fmt, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.host, self.port = self.httpd.server_address[:2]
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.thread.join()
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}/metrics"
@@ -1,10 +1,9 @@
 import math
 import numpy as np
-from skopt.space import Integer
-from modules.visualizer import C_YELLOW, C_END
+from modules.visualizer import C_YELLOW, C_END, log_line
 
 class TuRBOState:
-    def __init__(self, dim, length_min=0.5, length_max=2.0, length_init=1.0):
+    def __init__(self, dim, length_min=0.5, length_max=2.0, length_init=1.0, succ_tol=3, fail_tol=5):
         self.dim = dim
         self.length = length_init
         self.length_min = length_min
@@ -14,12 +13,13 @@ class TuRBOState:
         self.success_counter = 0
         self.best_value = float('inf')
         self.best_x = None
-        self.succ_tol = 3
-        self.fail_tol = 5 # 稍微放宽失败容忍度
+        self.succ_tol = succ_tol
+        self.fail_tol = fail_tol # 稍微放宽失败容忍度
         self.restart_count = 0
 
-    def update(self, y, x):
-        if y < self.best_value:
+    def update(self, y, x, is_bound=False):
+        """is_bound=True: y 只是乐观界 (分支定界剪枝 / 子集外推)，不能成为区域最优，按未改进计"""
+        if y < self.best_value and not is_bound:
             self.best_value = y
             self.best_x = x
             self.success_counter += 1
@@ -43,10 +43,30 @@ class TuRBOState:
             self.success_counter = 0
             self.restart_count += 1
 
+    def restart(self, center):
+        """
+        以新的中心点重新开始局部搜索 (清空该区域的历史最优)
+        """
+        self.length = self.length_init
+        self.failure_counter = 0
+        self.success_counter = 0
+        self.best_value = float('inf')
+        self.best_x = list(center)
+
+    def to_dict(self):
+        return dict(self.__dict__)
+
+    @classmethod
+    def from_dict(cls, d):
+        state = cls(d['dim'])
+        state.__dict__.update(d)
+        return state
+
     def get_trust_region_bounds(self, space):
         """
         计算信赖域边界，并针对整数空间进行特殊保护
         """
+        from skopt.space import Integer
         if self.best_x is None: return space
         
         bounds = []
@@ -74,3 +94,120 @@ class TuRBOState:
             
             bounds.append(Integer(x_min, x_max, name=dim.name))
         return bounds
+
+
+class MultiTuRBO:
+    """
+    TuRBO-m: 同时维护多个独立的 TuRBOState 信赖域。
+    每批提案先从各区域的信赖域内采样候选点，再用代理模型的 Thompson 采样
+    在所有候选中逐个挑选，从而把一批提案自动分配到各个区域。
+    停滞 (长度收缩到 length_min 以下) 的区域会在新的中心点重启。
+    若设置了 cost_fn (批量预测评估耗时)，则改用代价感知 EI：在预测改进相近的候选中优先选更便宜的点。
+    """
+    def __init__(self, space, surrogate, n_regions=3, n_candidates=20, init_centers=None, seed=None,
+                 cost_fn=None, cost_tolerance=0.1, **state_kwargs):
+        self.space = space
+        self.surrogate = surrogate
+        self.n_candidates = n_candidates
+        self.cost_fn = cost_fn
+        self.cost_tolerance = cost_tolerance
+        self.rng = np.random.RandomState(seed)
+        self.evaluated = set()
+
+        centers = [list(c) for c in (init_centers or [])]
+        while len(centers) < n_regions:
+            centers.append(self._random_point())
+
+        self.regions = []
+        for center in centers[:n_regions]:
+            state = TuRBOState(len(space), **state_kwargs)
+            state.restart(center)
+            self.regions.append(state)
+
+    def _random_point(self):
+        from skopt.space import Space
+        return [int(v) for v in Space(self.space).rvs(n_samples=1, random_state=self.rng)[0]]
+
+    def _restart_center(self):
+        """在全空间随机采样未评估过的点，选代理模型 UCB 最高者作为新中心"""
+        from skopt.space import Space
+        pool = [tuple(int(v) for v in p) for p in Space(self.space).rvs(n_samples=self.n_candidates, random_state=self.rng)]
+        pool = [p for p in pool if p not in self.evaluated] or pool
+        scores = [self.surrogate.predict(list(p)) for p in pool]
+        return list(pool[int(np.argmax(scores))])
+
+    def ask(self, n_points):
+        """
+        返回 [(hw_point, region_idx), ...]，长度至多 n_points
+        """
+        from skopt.space import Space
+        proposals = []
+        taken = set(self.evaluated)
+
+        # 1. 中心点尚未评估的区域 (初始设计 / 刚重启) 先评估中心点
+        for idx, state in enumerate(self.regions):
+            if len(proposals) >= n_points: break
+            center = tuple(state.best_x)
+            if state.best_value == float('inf') and center not in taken:
+                proposals.append((list(center), idx))
+                taken.add(center)
+
+        # 2. 各区域在自己的信赖域内采样候选点
+        candidates = {}
+        for idx, state in enumerate(self.regions):
+            tr_space = state.get_trust_region_bounds(self.space)
+            for p in Space(tr_space).rvs(n_samples=self.n_candidates, random_state=self.rng):
+                p = tuple(int(v) for v in p)
+                if p not in taken and p not in candidates:
+                    candidates[p] = idx
+
+        points = list(candidates.keys())
+        if self.cost_fn is not None:
+            proposals += self._cost_aware_pick(points, candidates, n_points - len(proposals))
+            return proposals
+
+        # 3. 批量 Thompson 采样：每个名额抽一次后验样本，取最大者
+        while len(proposals) < n_points and points:
+            scores = self.surrogate.sample(points, self.rng)
+            j = int(np.argmax(scores))
+            p = points.pop(j)
+            proposals.append((list(p), candidates[p]))
+        return proposals
+
+    def _cost_aware_pick(self, points, owners, n_points):
+        """
+        代价感知 EI：EI 不低于当前最大 EI 的 (1 - cost_tolerance) 倍的候选视为改进相近，
+        其中选预测耗时最短者
+        """
+        picked = []
+        if not points or n_points <= 0: return picked
+        ei = np.asarray(self.surrogate.expected_improvement([list(p) for p in points]), dtype=float)
+        cost = np.asarray(self.cost_fn([list(p) for p in points]), dtype=float)
+        alive = np.ones(len(points), dtype=bool)
+        while len(picked) < n_points and alive.any():
+            top = ei[alive].max()
+            eligible = np.where(alive & (ei >= top * (1.0 - self.cost_tolerance)))[0]
+            j = eligible[int(np.argmin(cost[eligible]))]
+            alive[j] = False
+            picked.append((list(points[j]), owners[points[j]]))
+        return picked
+
+    def tell(self, hw_point, y, region_idx, is_bound=False):
+        """y 越小越好 (例如 log10(EDP))；is_bound=True 表示 y 不是精确值，只计为未改进"""
+        self.evaluated.add(tuple(int(v) for v in hw_point))
+        state = self.regions[region_idx]
+        restarts = state.restart_count
+        state.update(y, list(hw_point), is_bound=is_bound)
+        if state.restart_count != restarts:
+            state.restart(self._restart_center())
+            log_line(f"{C_YELLOW}[TuRBO] Region {region_idx} stagnated, restarted at {state.best_x}{C_END}")
+
+    def lengths(self):
+        return [state.length for state in self.regions]
+
+    def state_dict(self):
+        return {'regions': [state.to_dict() for state in self.regions]}
+
+    def load_state_dict(self, d, evaluated=()):
+        self.regions = [TuRBOState.from_dict(r) for r in d['regions']]
+        self.evaluated = set(tuple(int(v) for v in p) for p in evaluated)
@@ -0,0 +1,255 @@
+"""
+离线重放：不调用任何仿真器，用当前代码中的外推 (_scale_layer)、流水线延迟模型与面积惩罚
+(_combine / _aggregate) 重新计算已归档评估点的 EDP 并重新排名
+
+    python -m modules.replay results/run_20250101_120000 results/run_20250102_090000
+    python -m modules.replay --store results/results.db --run run_20250101_120000 --top 20 -o rescored.json
+
+单层原始结果 (Timeloop 周期 / 能耗 / 面积、Ramulator 与 BookSim 的采样结果) 的来源，按优先级：
+  1. 评估记录中 details.layers.<层>.raw (journal 或结果库 layers.raw 列)
+  2. 产物存储中该迭代 manifest 下的 <层>/layer_result.json
+  3. 尚未归档的 output/iter_N/<层>/layer_result.json
+
+工作负载 (各模型的逐层形状与权重) 取自 run 的 experiment_metadata.json；缺失时把点上的每个层各计一次。
+被分支定界剪枝或中途失败的点只有部分层，无法重算，记为 Incomplete 且不参与排名
+"""
+import os
+import sys
+import json
+import time
+import argparse
+
+from modules.artifact_store import ArtifactStore
+from modules.results_store import ResultsStore
+
+CHUNK_SIZE = 256
+
+def _layer_name(path):
+    return os.path.splitext(os.path.basename(path))[0]
+
+def load_workloads(config, prob_dir="configs/prob/generated"):
+    """run 配置中的 WORKLOADS -> {name: {'weight', 'layers': [层名, ...]}}；无法还原时返回 None"""
+    from modules.workload_manager import WorkloadManager
+    specs = (config or {}).get('WORKLOADS')
+    if not specs: return None
+    wm = WorkloadManager(config_dir=prob_dir)
+    workloads = {}
+    for spec in specs:
+        layers = wm.shape_files(spec['model'], tuple(spec['input_size']))
+        if not layers: return None
+        workloads[wm.workload_name(spec['model'], spec['input_size'])] = {
+            'weight': spec.get('weight', 1.0), 'layers': [_layer_name(p) for p in layers]}
+    return workloads
+
+def _point(run_id, rec):
+    details = rec.get('details') or {}
+    layers = details.get('layers') or {}
+    return {
+        'run_id': run_id, 'iter': int(rec['iter']), 'hw': list(rec['hw']),
+        'old_edp': rec.get('edp'), 'old_status': rec.get('status'),
+        'is_bound': bool(details.get('is_bound', False)),
+        'layers_done': details.get('layers_done'), 'layers_total': details.get('layers_total'),
+        'layers': {name: res.get('raw') for name, res in layers.items()},
+    }
+
+def points_from_run(run_dir):
+    """从 run 目录的 journal.jsonl 读取评估点，返回 (run_id, config, points)"""
+    run_id = os.path.basename(os.path.normpath(run_dir))
+    config = None
+    try:
+        with open(os.path.join(run_dir, "experiment_metadata.json"), 'r') as f: config = json.load(f)
+    except (OSError, ValueError): pass
+    points = []
+    journal = os.path.join(run_dir, "journal.jsonl")
+    if os.path.exists(journal):
+        with open(journal, 'r') as f:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    continue
+                if rec.get('type') == 'evaluation': points.append(_point(run_id, rec))
+    return run_id, config, points
+
+def points_from_store(db_path, run_id=None):
+    """从结果库读取评估点，返回 {run_id: (config, points)}"""
+    out = {}
+    with ResultsStore(db_path) as store:
+        runs = {r['run_id']: r for r in store.query("SELECT run_id, config FROM runs")}
+        where, args = ("WHERE run_id = ?", (run_id,)) if run_id else ("", ())
+        by_key = {}
+        for p in store.query(f"SELECT * FROM points {where} ORDER BY run_id, iter", args):
+            hw = [p['mesh_x'], p['mesh_y'], p['pe'], p['sram_log2']]
+            rec = {'iter': p['iter'], 'hw': hw, 'edp': p['edp'], 'status': p['status'],
+                   'details': {'is_bound': bool(p['is_bound']), 'layers_done': p['layers_done'],
+                               'layers_total': p['layers_total'], 'layers': {}}}
+            by_key[(p['run_id'], p['iter'])] = rec
+        for row in store.query(f"SELECT run_id, iter, layer, raw FROM layers {where}", args):
+            rec = by_key.get((row['run_id'], row['iter']))
+            if rec is None: continue
+            rec['details']['layers'][row['layer']] = {'raw': json.loads(row['raw']) if row['raw'] else None}
+    for (rid, _), rec in by_key.items():
+        config = None
+        try:
+            config = json.loads(runs[rid]['config']) if rid in runs else None
+        except (TypeError, ValueError): pass
+        out.setdefault(rid, (config, []))[1].append(_point(rid, rec))
+    return out
+
+# ------------------------------------------------------------
+# 重算 (进程池中执行)
+# ------------------------------------------------------------
+_evaluator = None
+_artifacts = None
+
+def _init_worker(config, artifact_root):
+    global _evaluator, _artifacts
+    from modules.evaluation_engine import CoDesignEvaluator
+    # 重算只用到外推与汇总，不需要仿真器包装
+    _evaluator = CoDesignEvaluator(None, None, None, None, config)
+    _artifacts = ArtifactStore(artifact_root) if artifact_root and os.path.isdir(artifact_root) else None
+
+def _load_raw(point, layer, output_root):
+    """journal / 结果库中缺少 raw 时，从产物存储或未归档的输出目录读取 layer_result.json"""
+    rel = f"{layer}/{_evaluator.LAYER_RESULT_FILE}"
+    data = None
+    if _artifacts is not None:
+        try:
+            data = _artifacts.read(f"{point['run_id']}/iter_{point['iter']}", rel)
+        except OSError:
+            data = None
+    if data is None and output_root:
+        path = os.path.join(output_root, f"iter_{point['iter']}", rel)
+        if os.path.exists(path):
+            with open(path, 'rb') as f: data = f.read()
+    if data is None: return None
+    try:
+        return json.loads(data)
+    except ValueError:
+        return None
+
+def rescore_point(point, workloads, output_root=None):
+    """返回重算结果字典；原始数据不全时 status 为 Incomplete / Missing"""
+    out = {k: point[k] for k in ('run_id', 'iter', 'hw', 'old_edp', 'old_status')}
+    out.update({'edp': None, 'cycles': None, 'energy': None, 'area': None, 'workload_edp': {}})
+    if not point['layers']:
+        out['status'] = "Missing"
+        return out
+    raws = {}
+    for layer, raw in point['layers'].items():
+        if raw is None: raw = _load_raw(point, layer, output_root)
+        if raw is None:
+            out['status'] = "Missing"
+            return out
+        raws[layer] = raw
+
+    max_area = max(r.get('area', 0.0) for r in raws.values())
+    limit = _evaluator.cfg['AREA_LIMIT_MM2']
+    complete = not point['is_bound'] and (point['layers_total'] is None or len(raws) >= point['layers_total'])
+    factor = 1.0
+    if not complete:
+        # 与 evaluate_system 一致：首层即超面积时提前退出并放大 10 倍；其它情况 (剪枝 / 失败) 无法重算
+        if max_area > limit: factor = 10.0
+        else:
+            out['status'] = "Incomplete"
+            return out
+
+    scaled = {layer: _evaluator._scale_layer(raw) for layer, raw in raws.items()}
+    wl = workloads or {'default': {'weight': 1.0, 'layers': list(scaled)}}
+    edp, cyc, eng, _, workload_edp = _evaluator._combine(wl, scaled, max_area, factor)
+    status = "OK"
+    if max_area > limit: status = "AreaVio"
+    elif edp > 1e25: status = "Failed"
+    out.update({'edp': edp, 'cycles': cyc, 'energy': eng, 'area': max_area, 'workload_edp': workload_edp, 'status': status})
+    return out
+
+def _rescore_chunk(args):
+    points, workloads, output_root = args
+    return [rescore_point(p, workloads, output_root) for p in points]
+
+def rescore(sources, config, artifact_root="output/artifacts", output_root="output", jobs=None):
+    """
+    sources: [(workloads, points)]；返回按新 EDP 排序的结果列表 (可排名的点在前)
+    点数较多时按块分发到 jobs 个进程
+    """
+    tasks = [(points[i:i + CHUNK_SIZE], workloads, output_root)
+             for workloads, points in sources for i in range(0, len(points), CHUNK_SIZE)]
+    n_points = sum(len(t[0]) for t in tasks)
+    jobs = max(1, min(jobs or os.cpu_count() or 1, len(tasks)))
+    if jobs == 1 or n_points < CHUNK_SIZE:
+        _init_worker(config, artifact_root)
+        chunks = [_rescore_chunk(t) for t in tasks]
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker, initargs=(config, artifact_root)) as pool:
+            chunks = list(pool.map(_rescore_chunk, tasks))
+    results = [r for chunk in chunks for r in chunk]
+    return rank(results)
+
+def rank(results):
+    """有效点按新 EDP 排名 (new_rank)，并给出按原 EDP 的排名 (old_rank)"""
+    rankable = [r for r in results if r['status'] == "OK"]
+    old_order = sorted((r for r in rankable if r['old_edp'] is not None), key=lambda r: r['old_edp'])
+    old_rank = {(r['run_id'], r['iter']): k + 1 for k, r in enumerate(old_order)}
+    rankable.sort(key=lambda r: r['edp'])
+    for k, r in enumerate(rankable):
+        r['new_rank'] = k + 1
+        r['old_rank'] = old_rank.get((r['run_id'], r['iter']))
+    others = [r for r in results if r['status'] != "OK"]
+    return rankable + sorted(others, key=lambda r: (r['status'], r['run_id'], r['iter']))
+
+def main():
+    from main_optimization import CONFIG
+    from modules.visualizer import C_GREEN, C_YELLOW, C_CYAN, C_END
+
+    parser = argparse.ArgumentParser(description="Re-score archived evaluations with the current aggregation model")
+    parser.add_argument("run_dirs", nargs="*", help="results/run_* directories (journal source)")
+    parser.add_argument("--store", help="results database to replay instead of run journals")
+    parser.add_argument("--run", help="with --store: only this run_id")
+    parser.add_argument("--artifacts", default="output/artifacts", help="artifact store for layer results missing from records")
+    parser.add_argument("--output-root", default="output", help="unarchived output/iter_N directories")
+    parser.add_argument("--prob-dir", default="configs/prob/generated", help="workload manifest directory")
+    parser.add_argument("--area-limit", type=float, default=None, help="override AREA_LIMIT_MM2")
+    parser.add_argument("--jobs", type=int, default=None)
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument("-o", "--output", help="write all re-scored points as JSON")
+    args = parser.parse_args()
+    if not args.run_dirs and not args.store:
+        parser.error("give run directories or --store")
+
+    config = dict(CONFIG)
+    if args.area_limit is not None: config['AREA_LIMIT_MM2'] = args.area_limit
+
+    t0 = time.perf_counter()
+    runs = {}
+    if args.store:
+        runs.update(points_from_store(args.store, args.run))
+    for run_dir in args.run_dirs:
+        run_id, run_config, points = points_from_run(run_dir)
+        runs[run_id] = (run_config, points)
+    sources = [(load_workloads(run_config, args.prob_dir), points) for run_config, points in runs.values()]
+    results = rescore(sources, config, args.artifacts, args.output_root, args.jobs)
+    elapsed = time.perf_counter() - t0
+
+    counts = {}
+    for r in results: counts[r['status']] = counts.get(r['status'], 0) + 1
+    print(f"{C_CYAN}Re-scored {len(results)} points from {len(runs)} run(s) in {elapsed:.2f}s: "
+          f"{', '.join(f'{k} {v}' for k, v in sorted(counts.items()))}{C_END}")
+    print(f"{'New':>4} {'Old':>4}  {'Run':<22}{'Iter':>5}  {'HW':<16}{'Old EDP':>11}{'New EDP':>11}{'Area':>8}")
+    for r in [r for r in results if 'new_rank' in r][:args.top]:
+        moved = r['old_rank'] is not None and r['old_rank'] != r['new_rank']
+        old = "-" if r['old_rank'] is None else str(r['old_rank'])
+        old_edp = f"{r['old_edp']:.2e}" if r['old_edp'] is not None else "-"
+        line = (f"{r['new_rank']:>4} {old:>4}  {r['run_id'][:21]:<22}{r['iter']:>5}  {str(r['hw']):<16}"
+                f"{old_edp:>11}{r['edp']:>11.2e}{r['area']:>8.1f}")
+        print(f"{C_YELLOW if moved else ''}{line}{C_END if moved else ''}")
+    if counts.get("Incomplete"):
+        print(f"{C_YELLOW}{counts['Incomplete']} pruned/partial point(s) cannot be re-scored; re-evaluate them if the "
+              f"new model may favour them{C_END}")
+    if args.output:
+        with open(args.output, 'w') as f: json.dump(results, f, indent=2)
+        print(f"{C_GREEN}Wrote {args.output}{C_END}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,248 @@
+"""
+评估结果库 (SQLite)：一个数据库汇总整个实验活动 (campaign) 中所有 run 的评估结果
+
+  runs         每个 results/run_* 一行 (配置 JSON)
+  points       每次硬件点评估一行 (硬件参数、EDP、状态、耗时 ...)
+  workload_edp 多工作负载时每个模型的 EDP
+  layers       每个点上各层 (形状) 的外推结果，以及外推前的原始仿真结果 (raw，JSON；供 modules.replay 重算)
+  stage_times  各层各阶段耗时 (preprocess / mapper / trace / ramulator / booksim)
+
+写入先进入内存缓冲，攒够 batch_size 行或显式 flush() 时在一个事务内批量写入。
+查询示例见 main()：python -m modules.results_store results/results.db best
+"""
+import os
+import sys
+import json
+import time
+import sqlite3
+import argparse
+from urllib.parse import quote
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY, created REAL, config TEXT
+);
+CREATE TABLE IF NOT EXISTS points (
+    run_id TEXT, iter INTEGER, mesh_x INTEGER, mesh_y INTEGER, pe INTEGER, sram_log2 INTEGER,
+    region INTEGER, edp REAL, cycles REAL, energy REAL, area REAL, status TEXT, target REAL,
+    is_bound INTEGER, layers_done INTEGER, layers_total INTEGER, eval_time_s REAL,
+    PRIMARY KEY (run_id, iter)
+);
+CREATE TABLE IF NOT EXISTS workload_edp (
+    run_id TEXT, iter INTEGER, workload TEXT, edp REAL,
+    PRIMARY KEY (run_id, iter, workload)
+);
+CREATE TABLE IF NOT EXISTS layers (
+    run_id TEXT, iter INTEGER, layer TEXT, log_C REAL, log_E REAL, mem_C REAL, mem_E REAL,
+    noc_C REAL, noc_E REAL, area REAL, cached INTEGER, raw TEXT,
+    PRIMARY KEY (run_id, iter, layer)
+);
+CREATE TABLE IF NOT EXISTS stage_times (
+    run_id TEXT, iter INTEGER, layer TEXT, stage TEXT, seconds REAL,
+    PRIMARY KEY (run_id, iter, layer, stage)
+);
+CREATE INDEX IF NOT EXISTS idx_points_edp ON points (edp);
+CREATE INDEX IF NOT EXISTS idx_workload_edp ON workload_edp (workload, edp);
+"""
+
+_COLUMNS = {
+    'points': ['run_id', 'iter', 'mesh_x', 'mesh_y', 'pe', 'sram_log2', 'region', 'edp', 'cycles', 'energy',
+               'area', 'status', 'target', 'is_bound', 'layers_done', 'layers_total', 'eval_time_s'],
+    'workload_edp': ['run_id', 'iter', 'workload', 'edp'],
+    'layers': ['run_id', 'iter', 'layer', 'log_C', 'log_E', 'mem_C', 'mem_E', 'noc_C', 'noc_E', 'area', 'cached', 'raw'],
+    'stage_times': ['run_id', 'iter', 'layer', 'stage', 'seconds'],
+}
+
+class ResultsStore:
+    def __init__(self, db_path, batch_size=200):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        if os.path.dirname(db_path): os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        # 多个 run 可能同时写同一个库：WAL 模式 + 锁等待
+        self.conn = sqlite3.connect(db_path, timeout=30.0)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        self._migrate()
+        self.buffer = {table: [] for table in _COLUMNS}
+        self.pending = 0
+        # query() 使用的只读连接 (mode=ro，首次查询时打开)，任意 SQL 无法修改库
+        self.ro_conn = None
+
+    def _migrate(self):
+        """旧版本创建的库补齐新增列"""
+        cols = {row[1] for row in self.conn.execute("PRAGMA table_info(layers)")}
+        if 'raw' not in cols:
+            with self.conn:
+                self.conn.execute("ALTER TABLE layers ADD COLUMN raw TEXT")
+
+    # ------------------------------------------------------------
+    # 写入
+    # ------------------------------------------------------------
+    def register_run(self, run_id, config=None):
+        with self.conn:
+            self.conn.execute("INSERT OR IGNORE INTO runs VALUES (?, ?, ?)",
+                              (run_id, time.time(), json.dumps(config or {}, default=str)))
+        return run_id
+
+    def add_evaluation(self, run_id, record):
+        """record 与评估日志 (journal) 中 type='evaluation' 的记录格式相同"""
+        hw = list(record['hw']) + [None] * 4
+        details = record.get('details') or {}
+        it = int(record['iter'])
+        self._queue('points', (
+            run_id, it, hw[0], hw[1], hw[2], hw[3], record.get('region'),
+            record.get('edp'), record.get('cycles'), record.get('energy'), record.get('area'),
+            record.get('status'), record.get('target'), int(bool(details.get('is_bound', False))),
+            details.get('layers_done'), details.get('layers_total'), record.get('eval_time_s')))
+        for workload, edp in (details.get('workload_edp') or {}).items():
+            self._queue('workload_edp', (run_id, it, workload, edp))
+        for layer, res in (details.get('layers') or {}).items():
+            self._queue('layers', (run_id, it, layer, res.get('log_C'), res.get('log_E'), res.get('mem_C'), res.get('mem_E'),
+                                   res.get('noc_C'), res.get('noc_E'), res.get('area'), int(bool(res.get('cached', False))),
+                                   json.dumps(res['raw']) if res.get('raw') else None))
+            for stage, sec in (res.get('stage_times') or {}).items():
+                self._queue('stage_times', (run_id, it, layer, stage, sec))
+        if self.pending >= self.batch_size:
+            self.flush()
+
+    def _queue(self, table, row):
+        self.buffer[table].append(row)
+        self.pending += 1
+
+    def flush(self):
+        if not self.pending: return
+        with self.conn:
+            for table, rows in self.buffer.items():
+                if not rows: continue
+                cols = _COLUMNS[table]
+                self.conn.executemany(f"INSERT OR REPLACE INTO {table} ({','.join(cols)}) VALUES ({','.join('?' * len(cols))})", rows)
+                rows.clear()
+        self.pending = 0
+
+    def close(self):
+        self.flush()
+        self.conn.close()
+        if self.ro_conn is not None: self.ro_conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def import_run(self, run_dir):
+        """从已有 run 目录的 journal.jsonl 导入 (可重复执行，按主键覆盖)"""
+        run_id = os.path.basename(os.path.normpath(run_dir))
+        config = None
+        try:
+            with open(os.path.join(run_dir, "experiment_metadata.json"), 'r') as f: config = json.load(f)
+        except (OSError, ValueError): pass
+        self.register_run(run_id, config)
+        count = 0
+        journal = os.path.join(run_dir, "journal.jsonl")
+        if os.path.exists(journal):
+            with open(journal, 'r') as f:
+                for line in f:
+                    try:
+                        rec = json.loads(line)
+                    except ValueError:
+                        continue
+                    if rec.get('type') != 'evaluation': continue
+                    self.add_evaluation(run_id, rec)
+                    count += 1
+        self.flush()
+        return count
+
+    # ------------------------------------------------------------
+    # 查询
+    # ------------------------------------------------------------
+    def _rows(self, sql, args=(), conn=None):
+        self.flush()
+        cur = (conn or self.conn).execute(sql, args)
+        cols = [d[0] for d in cur.description]
+        return [dict(zip(cols, row)) for row in cur.fetchall()]
+
+    def runs(self):
+        return self._rows("SELECT run_id, created, (SELECT COUNT(*) FROM points p WHERE p.run_id = r.run_id) AS points "
+                          "FROM runs r ORDER BY created")
+
+    def best_points(self, run_id=None, limit=10):
+        """EDP 最低的完整评估点 (排除剪枝 / 失败 / 面积违规)"""
+        sql = "SELECT * FROM points WHERE is_bound = 0 AND status IN ('OK', 'NewBest')"
+        args = ()
+        if run_id is not None:
+            sql += " AND run_id = ?"
+            args = (run_id,)
+        return self._rows(sql + " ORDER BY edp LIMIT ?", args + (limit,))
+
+    def best_edp_per_model(self, run_id=None):
+        """每个工作负载的最佳 EDP 及对应硬件点"""
+        where = "WHERE p.is_bound = 0 AND p.status IN ('OK', 'NewBest')"
+        args = ()
+        if run_id is not None:
+            where += " AND p.run_id = ?"
+            args = (run_id,)
+        return self._rows(
+            "SELECT w.workload, MIN(w.edp) AS edp, p.run_id, p.iter, p.mesh_x, p.mesh_y, p.pe, p.sram_log2 "
+            "FROM workload_edp w JOIN points p ON p.run_id = w.run_id AND p.iter = w.iter "
+            f"{where} GROUP BY w.workload ORDER BY w.workload", args)
+
+    def layers_for_point(self, run_id, iter_id):
+        return self._rows("SELECT * FROM layers WHERE run_id = ? AND iter = ? ORDER BY layer", (run_id, iter_id))
+
+    def stage_summary(self, run_id=None):
+        """各阶段耗时汇总 (次数 / 总计 / 平均)"""
+        sql = "SELECT stage, COUNT(*) AS n, SUM(seconds) AS total_s, AVG(seconds) AS avg_s FROM stage_times"
+        args = ()
+        if run_id is not None:
+            sql += " WHERE run_id = ?"
+            args = (run_id,)
+        return self._rows(sql + " GROUP BY stage ORDER BY total_s DESC", args)
+
+    def query(self, sql, args=()):
+        """任意只读 SQL (在单独的 mode=ro 连接上执行，写语句会抛出 sqlite3.OperationalError)"""
+        if self.ro_conn is None:
+            uri = f"file:{quote(os.path.abspath(self.db_path))}?mode=ro"
+            self.ro_conn = sqlite3.connect(uri, uri=True, timeout=30.0)
+        return self._rows(sql, args, conn=self.ro_conn)
+
+
+def _print_rows(rows):
+    if not rows:
+        print("(no rows)")
+        return
+    cols = list(rows[0].keys())
+    fmt = lambda v: f"{v:.3e}" if isinstance(v, float) else str(v)
+    widths = [max(len(c), *(len(fmt(r[c])) for r in rows)) for c in cols]
+    print("  ".join(c.ljust(w) for c, w in zip(cols, widths)))
+    for r in rows:
+        print("  ".join(fmt(r[c]).ljust(w) for c, w in zip(cols, widths)))
+
+def main():
+    parser = argparse.ArgumentParser(description="Query the co-design results database")
+    parser.add_argument("db", help="database path, e.g. results/results.db")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("runs")
+    p = sub.add_parser("best"); p.add_argument("--run"); p.add_argument("--limit", type=int, default=10)
+    p = sub.add_parser("models"); p.add_argument("--run")
+    p = sub.add_parser("layers"); p.add_argument("run"); p.add_argument("iter", type=int)
+    p = sub.add_parser("stages"); p.add_argument("--run")
+    p = sub.add_parser("import"); p.add_argument("run_dirs", nargs="+")
+    p = sub.add_parser("sql"); p.add_argument("statement")
+    args = parser.parse_args()
+
+    with ResultsStore(args.db) as store:
+        if args.cmd == "runs": _print_rows(store.runs())
+        elif args.cmd == "best": _print_rows(store.best_points(args.run, args.limit))
+        elif args.cmd == "models": _print_rows(store.best_edp_per_model(args.run))
+        elif args.cmd == "layers": _print_rows(store.layers_for_point(args.run, args.iter))
+        elif args.cmd == "stages": _print_rows(store.stage_summary(args.run))
+        elif args.cmd == "sql": _print_rows(store.query(args.statement))
+        elif args.cmd == "import":
+            for run_dir in args.run_dirs:
+                print(f"{run_dir}: {store.import_run(run_dir)} evaluations")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,69 @@
+"""
+内存盘 (tmpfs) 上的临时工作目录：单层评估的全部中间文件都写在这里，
+结束时只把白名单内的输出复制到持久目录，其余随目录一起删除
+"""
+import os
+import shutil
+import fnmatch
+import tempfile
+
+# 默认持久化的输出 (按文件名匹配)；dram.trace / booksim 配置 / accelergy 日志等不保留
+DEFAULT_PERSIST = [
+    "timeloop-input.yaml",
+    "timeloop-mapper.stats.txt",
+    "timeloop-mapper.map.txt",
+    "*.ERT.yaml",
+    "*.ART.yaml",
+    "*.stats",
+    "booksim.log",
+]
+
+def default_scratch_root():
+    """PIM_SCRATCH_ROOT 环境变量 > /dev/shm (可写时) > 系统临时目录"""
+    root = os.environ.get("PIM_SCRATCH_ROOT")
+    if root: return root
+    if os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK):
+        return "/dev/shm"
+    return tempfile.gettempdir()
+
+class ScratchWorkspace:
+    """
+    with ScratchWorkspace(layer_dir) as ws:
+        ... 在 ws.path 下运行仿真 ...
+    退出时把 ws.path 中匹配 persist 的文件复制到 persist_dir (保持相对路径)，然后删除 ws.path
+    发生异常或标记 ws.failed = True 时保留全部文件，方便排查
+    """
+    def __init__(self, persist_dir, persist=None, root=None, prefix="pimdse_"):
+        self.persist_dir = persist_dir
+        self.persist = DEFAULT_PERSIST if persist is None else persist
+        self.root = root or default_scratch_root()
+        self.prefix = prefix
+        self.path = None
+        self.failed = False
+
+    def __enter__(self):
+        os.makedirs(self.root, exist_ok=True)
+        self.path = tempfile.mkdtemp(prefix=self.prefix, dir=self.root)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        try:
+            self.save(keep_all=self.failed or exc_type is not None)
+        finally:
+            shutil.rmtree(self.path, ignore_errors=True)
+        return False
+
+    def save(self, keep_all=False):
+        """复制白名单文件到持久目录，返回复制的文件数"""
+        copied = 0
+        for root, _, names in os.walk(self.path):
+            for name in names:
+                if not keep_all and not any(fnmatch.fnmatch(name, p) for p in self.persist): continue
+                src = os.path.join(root, name)
+                dst = os.path.join(self.persist_dir, os.path.relpath(src, self.path))
+                os.makedirs(os.path.dirname(dst), exist_ok=True)
+                try:
+                    shutil.copyfile(src, dst)
+                    copied += 1
+                except OSError: pass
+        return copied
@@ -0,0 +1,356 @@
+"""
+硬件搜索策略的样本效率基准：不运行任何仿真器，用廉价目标函数反复运行整套搜索，
+比较修改 FastReestimator / TuRBOState / engine 的信赖域规则前后"用多少次评估能找到好点"
+
+    python -m modules.search_bench                                  # 合成目标，全部策略，10 个种子
+    python -m modules.search_bench --strategies turbo,random --seeds 30 --budget 45 --jobs 8
+    python -m modules.search_bench --replay results/run_20250101_120000 --store results/results.db
+
+目标函数 (输入 [mesh_x, mesh_y, pe, sram_log2]，输出 EDP，越小越好)：
+  smooth / plateau  合成 EDP：算力 / SRAM 复用 / DRAM 带宽 / NoC 跳数的解析模型，按 engine 相同的面积上限
+                    施加面积惩罚 (CoDesignEvaluator._aggregate)；plateau 按整块 tile 取整，形成平台与台阶
+  replay:<run>      已归档真实评估点 (journal 或结果库)；未评估过的点取归一化空间中最近的已评估点
+
+策略：
+  turbo    engine 实际使用的 FastReestimator + MultiTuRBO (main_optimization.build_search / tell_search)
+  random   无重复均匀随机采样
+  gp-ei    skopt 的 GP + EI 贝叶斯优化 (批量提案用 constant liar)
+
+报告 (JSON + 终端表格)：达到目标 (与最优 EDP 的差距不超过 --target) 所需评估次数的中位数与成功率、
+各评估次数下 best-so-far 差距 log10(best / 最优) 的分位数曲线、每个提案的优化器墙钟时间
+"""
+import os
+import io
+import sys
+import json
+import time
+import math
+import random
+import argparse
+import itertools
+import contextlib
+
+import numpy as np
+
+# 曲线中打印的评估次数检查点
+CHECKPOINTS = (5, 10, 15, 20, 30, 45, 60, 90, 120)
+
+# ------------------------------------------------------------
+# 目标函数
+# ------------------------------------------------------------
+class SyntheticEDP:
+    """
+    形状与真实 EDP 地形相近的解析模型 (单位与量级大致对应 resnet18 / 28nm)：
+      - 计算周期 = MAC 数 / (节点数 x PE^2 x 利用率)，利用率取决于层维度能否被 PE 整除
+      - DRAM 访问量 = 各层工作集 x 重载次数，片上 SRAM (所有节点合计) 装得下工作集时只读一次
+      - 访存周期受通道数限制，NoC 周期 / 能耗与平均跳数成正比
+      - 面积 = 节点数 x (PE 阵列 + SRAM + 固定开销)，超过 AREA_LIMIT_MM2 的区域不可行；
+        静态能耗与面积 x 周期成正比
+    kind='plateau' 时利用率与重载次数按整块取整 (台阶与平台)；'smooth' 时用连续近似
+    instance 决定系数的随机扰动 (同一 instance 地形固定)
+    """
+    LAYER_DIMS = (64, 128, 256, 512, 96, 192, 384)
+    WORKING_SETS_MB = (0.4, 0.9, 1.6, 2.8, 4.5, 7.0)
+
+    def __init__(self, kind="plateau", instance=0, config=None):
+        from main_optimization import CONFIG
+        from modules.evaluation_engine import CoDesignEvaluator
+        self.kind = kind
+        self.name = f"{kind}" if instance == 0 else f"{kind}#{instance}"
+        self.evaluator = CoDesignEvaluator(None, None, None, None, config or CONFIG)
+        rng = np.random.RandomState(1000 + instance)
+        jitter = lambda: float(np.exp(rng.normal(0.0, 0.2))) if instance else 1.0
+        self.macs = 1.8e9 * jitter()
+        self.c = {'mac_area': 0.01 * jitter(), 'sram_area': 0.45 * jitter(), 'node_area': 0.3,
+                  'e_mac': 0.5 * jitter(), 'e_sram': 0.12 * jitter(), 'e_dram': 20.0 * jitter(),
+                  'e_hop': 0.6 * jitter(), 'leak': 50.0 * jitter(), 'bw': 64.0, 'channels': 8}
+        self.working_sets = [w * 2 ** 20 * jitter() for w in self.WORKING_SETS_MB]
+
+    def _util(self, pe):
+        if self.kind == "plateau":
+            return float(np.mean([d / (math.ceil(d / pe) * pe) for d in self.LAYER_DIMS]))
+        return float(np.mean([d / (d + pe / 2.0) for d in self.LAYER_DIMS]))
+
+    def _reloads(self, work, capacity):
+        if capacity >= work: return 1.0
+        return float(math.ceil(work / capacity)) if self.kind == "plateau" else work / capacity
+
+    def __call__(self, hw):
+        mx, my, pe, sram_log2 = [int(v) for v in hw]
+        c = self.c
+        nodes = mx * my
+        sram_bytes = 2.0 ** sram_log2
+        area = nodes * (c['mac_area'] * pe ** 2 + c['sram_area'] * sram_bytes / 2 ** 20 + c['node_area'])
+
+        log_c = self.macs / (nodes * pe ** 2 * self._util(pe))
+        log_e = self.macs * (c['e_mac'] + c['e_sram'] * math.sqrt(sram_bytes / 2 ** 20))
+        accesses = sum(w * self._reloads(w, sram_bytes * nodes) for w in self.working_sets)
+        mem_c = accesses / (c['bw'] * min(nodes, c['channels']))
+        mem_e = accesses * c['e_dram']
+        hops = (mx + my) / 2.0
+        noc_c = accesses / c['bw'] * hops / max(1, nodes) * 4.0
+        noc_e = accesses * hops * c['e_hop']
+        # 静态功耗：面积 x 运行周期 (pJ / mm^2 / cycle)，大阵列低利用率时不划算
+        log_e += c['leak'] * area * max(log_c, mem_c)
+        agg = {'log_C': log_c, 'log_E': log_e, 'mem_C': mem_c, 'mem_E': mem_e, 'noc_C': noc_c, 'noc_E': noc_e}
+        return self.evaluator._aggregate(agg, area)[0]
+
+    def optimum(self, bounds):
+        return min(self(p) for p in itertools.product(*[range(lo, hi + 1) for lo, hi in bounds]))
+
+class ReplayObjective:
+    """已归档真实评估点的查表目标；未评估过的点取归一化坐标下最近的已评估点 (等距时取平均)"""
+    def __init__(self, name, table, bounds):
+        self.name = name
+        self.table = {tuple(int(v) for v in hw): float(edp) for hw, edp in table}
+        self.bounds = bounds
+        self.keys = list(self.table)
+        self.coords = np.array([self._norm(k) for k in self.keys])
+        self.values = np.array([self.table[k] for k in self.keys])
+        self.queries = 0
+        self.exact = 0
+
+    def _norm(self, hw):
+        return [(v - lo) / max(1, hi - lo) for v, (lo, hi) in zip(hw, self.bounds)]
+
+    def __call__(self, hw):
+        key = tuple(int(v) for v in hw)
+        self.queries += 1
+        if key in self.table:
+            self.exact += 1
+            return self.table[key]
+        d = np.abs(self.coords - np.array(self._norm(key))).sum(axis=1)
+        nearest = np.where(d <= d.min() + 1e-12)[0]
+        return float(np.exp(np.mean(np.log(self.values[nearest]))))
+
+    def optimum(self, bounds):
+        return float(self.values.min())
+
+def replay_tables(run_dirs=(), store=None, run_id=None):
+    """归档评估 -> {目标名: [(hw, edp), ...]}；只取完整评估 (OK / NewBest / AreaVio，且未被剪枝)"""
+    from modules.replay import points_from_run, points_from_store
+    sources = [points_from_run(d) for d in run_dirs]
+    if store:
+        sources += [(rid, cfg, pts) for rid, (cfg, pts) in points_from_store(store, run_id).items()]
+    tables = {}
+    for rid, _, points in sources:
+        rows = [(p['hw'], p['old_edp']) for p in points
+                if p['old_status'] in ("OK", "NewBest", "AreaVio") and not p['is_bound'] and p['old_edp']]
+        if rows: tables.setdefault(f"replay:{rid}", []).extend(rows)
+    return tables
+
+def make_objective(spec):
+    kind, params = spec
+    if kind == "synthetic":
+        return SyntheticEDP(params['kind'], params.get('instance', 0))
+    from main_optimization import HW_BOUNDS
+    return ReplayObjective(params['name'], params['table'], HW_BOUNDS)
+
+# ------------------------------------------------------------
+# 搜索策略：ask(n) -> [(hw, token)]，tell(hw, edp, token)
+# ------------------------------------------------------------
+class TurboStrategy:
+    def __init__(self, space, seed):
+        from main_optimization import build_search
+        self.surrogate, self.turbo = build_search(space, seed=seed)
+
+    def ask(self, n):
+        return self.turbo.ask(n)
+
+    def tell(self, hw, edp, region):
+        from main_optimization import tell_search
+        tell_search(self.surrogate, self.turbo, hw, edp, region)
+
+class RandomStrategy:
+    def __init__(self, space, seed):
+        self.grid = list(itertools.product(*[range(d.low, d.high + 1) for d in space]))
+        random.Random(seed).shuffle(self.grid)
+
+    def ask(self, n):
+        batch, self.grid = self.grid[:n], self.grid[n:]
+        return [(list(p), None) for p in batch]
+
+    def tell(self, hw, edp, token):
+        pass
+
+class GpEiStrategy:
+    def __init__(self, space, seed):
+        from skopt import Optimizer
+        self.opt = Optimizer(space, base_estimator="GP", acq_func="EI", n_initial_points=5, random_state=seed)
+
+    def ask(self, n):
+        points = self.opt.ask(n_points=n) if n > 1 else [self.opt.ask()]
+        return [([int(v) for v in p], None) for p in points]
+
+    def tell(self, hw, edp, token):
+        self.opt.tell(list(hw), float(np.log10(edp + 1e-9)))
+
+STRATEGIES = {'turbo': TurboStrategy, 'random': RandomStrategy, 'gp-ei': GpEiStrategy}
+
+# ------------------------------------------------------------
+# 运行 (进程池中执行)
+# ------------------------------------------------------------
+_objectives = {}
+
+def _objective(spec):
+    key = json.dumps(spec[1].get('name') or spec[1], sort_keys=True, default=str)
+    if key not in _objectives: _objectives[key] = make_objective(spec)
+    return _objectives[key]
+
+def run_one(spec, strategy, seed, budget, batch):
+    """一个 (目标, 策略, 种子) 组合的完整搜索；返回每次评估的 EDP 与优化器耗时"""
+    from main_optimization import hw_space
+    np.random.seed(seed)
+    random.seed(seed)
+    objective = _objective(spec)
+    exact0, queries0 = getattr(objective, 'exact', 0), getattr(objective, 'queries', 0)
+    history, ask_s, tell_s = [], 0.0, 0.0
+    # TuRBO 重启等提示不混入基准输出
+    with contextlib.redirect_stdout(io.StringIO()):
+        strat = STRATEGIES[strategy](hw_space(), seed)
+        while len(history) < budget:
+            t0 = time.perf_counter()
+            proposals = strat.ask(min(batch, budget - len(history)))
+            ask_s += time.perf_counter() - t0
+            if not proposals: break
+            for hw, token in proposals:
+                edp = objective(hw)
+                t0 = time.perf_counter()
+                strat.tell(hw, edp, token)
+                tell_s += time.perf_counter() - t0
+                history.append(edp)
+    out = {'objective': objective.name, 'strategy': strategy, 'seed': seed, 'edp': history,
+           'ask_s': ask_s, 'tell_s': tell_s}
+    if isinstance(objective, ReplayObjective):
+        # 命中已归档点的比例 (其余为最近邻近似)
+        out['exact_fraction'] = round((objective.exact - exact0) / max(1, objective.queries - queries0), 3)
+    return out
+
+def _run_task(task):
+    return run_one(*task)
+
+def summarize(runs, optima, target):
+    """按 (目标, 策略) 汇总：评估次数-达标、best-so-far 差距曲线、每提案耗时"""
+    threshold = math.log10(1.0 + target)
+    groups = {}
+    for r in runs: groups.setdefault((r['objective'], r['strategy']), []).append(r)
+    summary = []
+    for (obj, strat), group in sorted(groups.items()):
+        opt = optima[obj]
+        curves, hits = [], []
+        for r in group:
+            best = np.minimum.accumulate(np.asarray(r['edp'], dtype=float))
+            gap = np.log10(best) - math.log10(opt)
+            curves.append(gap)
+            reached = np.where(gap <= threshold)[0]
+            hits.append(int(reached[0]) + 1 if len(reached) else None)
+        length = min(len(c) for c in curves)
+        stacked = np.vstack([c[:length] for c in curves])
+        solved = sorted(h for h in hits if h is not None)
+        n_evals = sum(len(r['edp']) for r in group)
+        summary.append({
+            'objective': obj, 'strategy': strat, 'seeds': len(group), 'optimum_edp': opt,
+            'success_rate': round(len(solved) / len(group), 3),
+            # 未达标的种子按无穷大计入中位数：过半未达标时中位数为 None
+            'evals_to_target_median': (solved + [math.inf] * (len(group) - len(solved)))[len(group) // 2]
+                                      if len(solved) * 2 > len(group) else None,
+            'evals_to_target': hits,
+            'curve_gap_p25': np.percentile(stacked, 25, axis=0).round(4).tolist(),
+            'curve_gap_median': np.median(stacked, axis=0).round(4).tolist(),
+            'curve_gap_p75': np.percentile(stacked, 75, axis=0).round(4).tolist(),
+            'ms_per_proposal': round(1000.0 * sum(r['ask_s'] + r['tell_s'] for r in group) / max(1, n_evals), 2),
+            'ask_ms_per_proposal': round(1000.0 * sum(r['ask_s'] for r in group) / max(1, n_evals), 2),
+        })
+    return summary
+
+def run_bench(specs, strategies, seeds, budget, batch, target, jobs=None):
+    from main_optimization import HW_BOUNDS
+    optima = {}
+    for spec in specs:
+        obj = make_objective(spec)
+        optima[obj.name] = obj.optimum(HW_BOUNDS)
+    tasks = [(spec, strat, seed, budget, batch) for spec in specs for strat in strategies for seed in range(seeds)]
+    jobs = max(1, min(jobs or os.cpu_count() or 1, len(tasks)))
+    if jobs == 1:
+        runs = [_run_task(t) for t in tasks]
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            runs = list(pool.map(_run_task, tasks))
+    return runs, summarize(runs, optima, target)
+
+def print_summary(summary, budget):
+    from modules.visualizer import C_CYAN, C_END
+    points = [c for c in CHECKPOINTS if c <= budget]
+    head = f"{'Objective':<22}{'Strategy':<9}{'Solved':>7}{'Evals':>7}{'ms/prop':>9}  " + \
+           "".join(f"{'@' + str(c):>7}" for c in points)
+    print(f"{C_CYAN}{head}{C_END}")
+    print(f"{'':<47}  median log10(best / optimum)")
+    for s in summary:
+        evals = s['evals_to_target_median']
+        curve = s['curve_gap_median']
+        cells = "".join(f"{curve[c - 1]:>7.3f}" if c <= len(curve) else f"{'-':>7}" for c in points)
+        print(f"{s['objective'][:21]:<22}{s['strategy']:<9}{s['success_rate'] * 100:>6.0f}%"
+              f"{(str(evals) if evals is not None else '-'):>7}{s['ms_per_proposal']:>9.1f}  {cells}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Sample-efficiency benchmark for the hardware search strategies")
+    parser.add_argument("--objectives", default="smooth,plateau",
+                        help="comma-separated synthetic objectives: smooth, plateau, optionally kind#instance "
+                             "(e.g. plateau#3); empty to use only --replay / --store")
+    parser.add_argument("--replay", nargs="*", default=[], metavar="RUN_DIR", help="run directories to replay as objectives")
+    parser.add_argument("--store", default=None, help="results database to replay (every run becomes an objective)")
+    parser.add_argument("--run", default=None, help="with --store: only this run_id")
+    parser.add_argument("--strategies", default=",".join(STRATEGIES), help=f"comma-separated, from {sorted(STRATEGIES)}")
+    parser.add_argument("--seeds", type=int, default=10)
+    parser.add_argument("--budget", type=int, default=30, help="evaluations per search (default 30)")
+    parser.add_argument("--batch", type=int, default=None, help="proposals per round (default: engine TURBO_PROPOSALS)")
+    parser.add_argument("--target", type=float, default=0.05,
+                        help="a point reaches the target when its EDP is within this fraction of the optimum (default 0.05)")
+    parser.add_argument("--jobs", type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument("-o", "--output", default=None, help="JSON report (default: output/bench/search_<time>.json)")
+    args = parser.parse_args()
+
+    from modules.visualizer import C_GREEN, C_RED, C_END
+    from main_optimization import TURBO_PROPOSALS
+    strategies = [s for s in args.strategies.split(",") if s]
+    unknown = [s for s in strategies if s not in STRATEGIES]
+    if unknown:
+        print(f"{C_RED}[SearchBench] unknown strategies: {unknown}{C_END}")
+        return 2
+
+    specs = []
+    for name in [o for o in args.objectives.split(",") if o]:
+        kind, _, inst = name.partition("#")
+        if kind not in ("smooth", "plateau"):
+            print(f"{C_RED}[SearchBench] unknown objective: {name}{C_END}")
+            return 2
+        specs.append(("synthetic", {'kind': kind, 'instance': int(inst or 0)}))
+    for name, table in replay_tables(args.replay, args.store, args.run).items():
+        specs.append(("replay", {'name': name, 'table': table}))
+    if not specs:
+        print(f"{C_RED}[SearchBench] no objectives (archived runs had no complete evaluations?){C_END}")
+        return 1
+
+    batch = args.batch or TURBO_PROPOSALS
+    t0 = time.perf_counter()
+    runs, summary = run_bench(specs, strategies, args.seeds, args.budget, batch, args.target, args.jobs)
+    wall = time.perf_counter() - t0
+    print_summary(summary, args.budget)
+
+    out = args.output or os.path.join("output", "bench", f"search_{time.strftime('%Y%m%d_%H%M%S')}.json")
+    if os.path.dirname(out): os.makedirs(os.path.dirname(out), exist_ok=True)
+    report = {
+        'meta': {'created': time.strftime('%Y-%m-%d %H:%M:%S'), 'seeds': args.seeds, 'budget': args.budget,
+                 'batch': batch, 'target': args.target, 'wall_s': round(wall, 2),
+                 'objectives': [s[1].get('name') or s[1]['kind'] + (f"#{s[1]['instance']}" if s[1]['instance'] else "")
+                                for s in specs]},
+        'summary': summary,
+        'runs': runs,
+    }
+    with open(out, 'w') as f: json.dump(report, f, indent=1, default=str)
+    print(f"{C_GREEN}[SearchBench] {len(runs)} searches in {wall:.1f}s, report written to {out}{C_END}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,222 @@
+"""
+仿真器子进程的统一启动器 (timeloop-mapper / ramulator / booksim)
+
+  - 每个仿真器在独立的进程组 (新会话) 中运行，超时后 SIGTERM -> SIGKILL 整个进程组，
+    mapper 派生的 accelergy 等子进程不会残留
+  - 可按仿真器设置内存 (RLIMIT_AS) 与 CPU 时间 (RLIMIT_CPU) 上限
+  - 失败分类: timeout / oom / cpu_limit / signal / exit_code / launch / parse，
+    瞬时性失败 (默认 oom / signal / launch) 按指数退避重试；设置了 mem_mb 时 oom 是确定性的 (同一输入必然再次超限)，不重试
+  - 每次失败计入 pimdse_simulator_failures_total{simulator, kind}，重试计入 pimdse_simulator_retries_total
+  - 子进程以 wait4 回收，其 CPU 时间 (user+sys，含已回收的后代) 与峰值 RSS 报告给当前线程的追踪 span
+
+run() 返回字典:
+  {'success', 'stdout', 'stderr', 'returncode', 'failure', 'attempts', 'elapsed_s', 'simulator', 'cpu_s'}
+failure 为 None 或失败类别；调用方解析输出失败时用 parse_failure() 记录 'parse'
+"""
+import os
+import re
+import time
+import signal
+import threading
+import subprocess
+from modules import tracing
+from modules.metrics import REGISTRY, SIM_FAILURES
+
+try:
+    import resource
+except ImportError:  # 非 POSIX 平台：不设资源上限
+    resource = None
+
+SIM_RETRIES = REGISTRY.counter("pimdse_simulator_retries_total", "Simulator invocations retried after a transient failure",
+                               ["simulator", "kind"])
+
+FAILURE_KINDS = ('timeout', 'oom', 'cpu_limit', 'signal', 'exit_code', 'launch', 'parse')
+
+# 仿真器默认策略；CONFIG['SIM_LIMITS'] 中的同名键逐项覆盖，'default' 作用于未列出的仿真器
+DEFAULT_LIMITS = {
+    'default':         {'timeout_s': 120, 'mem_mb': None, 'cpu_s': None, 'retries': 1, 'backoff_s': 1.0},
+    'timeloop-mapper': {'timeout_s': 120},
+    'ramulator':       {'timeout_s': 30},
+    'booksim':         {'timeout_s': 15},
+}
+TRANSIENT = ('oom', 'signal', 'launch')
+KILL_GRACE_S = 2.0
+STDERR_TAIL = 2000
+
+_OOM_PATTERN = re.compile(r"std::bad_alloc|MemoryError|Cannot allocate memory|out of memory", re.IGNORECASE)
+
+def classify(returncode, stderr="", timed_out=False, cpu_s=None, cpu_limit_s=None, maxrss_mb=None, mem_limit_mb=None):
+    """
+    根据退出码与 stderr 判定失败类别；成功返回 None
+    cpu_s / cpu_limit_s, maxrss_mb / mem_limit_mb: 子进程实际用量与配置的上限，用于判定 SIGKILL 的原因
+    """
+    if timed_out: return 'timeout'
+    if returncode == 0: return None
+    if _OOM_PATTERN.search(stderr or ""): return 'oom'
+    if returncode == -signal.SIGXCPU: return 'cpu_limit'
+    if returncode == -signal.SIGKILL:
+        # 忽略 SIGXCPU 的进程到 RLIMIT_CPU 硬上限时被内核 SIGKILL：CPU 时间已达软上限
+        if cpu_limit_s and cpu_s is not None and cpu_s >= cpu_limit_s: return 'cpu_limit'
+        # 峰值内存已达上限才归为内核 OOM killer；其余 (外部 kill 等) 按普通信号处理
+        # (超时由我们发出的 SIGKILL 已在上面归为 timeout)
+        if mem_limit_mb and maxrss_mb is not None and maxrss_mb >= mem_limit_mb: return 'oom'
+        return 'signal'
+    if returncode < 0: return 'signal'
+    return 'exit_code'
+
+class _Waiter(threading.Thread):
+    """
+    后台线程阻塞于 wait4 回收子进程 (子进程一退出即返回，无轮询延迟)，保留其 rusage (含已回收的后代)
+    调用方以 join(timeout) 实现超时；不支持 wait4 的平台退回 Popen.wait，rusage 为 None
+    """
+    def __init__(self, proc):
+        super().__init__(daemon=True)
+        self.proc = proc
+        self.rusage = None
+
+    def run(self):
+        if not hasattr(os, 'wait4'):
+            self.proc.wait()
+            return
+        _, status, self.rusage = os.wait4(self.proc.pid, 0)
+        self.proc.returncode = os.waitstatus_to_exitcode(status)
+
+def _drain(stream, chunks):
+    """后台线程读完管道 (stdout / stderr 分开读，避免任一管道写满阻塞子进程)"""
+    chunks.append(stream.read())
+    stream.close()
+
+def _usage(ru):
+    """rusage -> (CPU 秒, 峰值 RSS MB)；None 时为 (0, 0)"""
+    if ru is None: return 0.0, 0.0
+    # Linux 上 ru_maxrss 单位为 KB
+    return ru.ru_utime + ru.ru_stime, ru.ru_maxrss / 1024.0
+
+class SimRunner:
+    def __init__(self, limits=None, transient=TRANSIENT):
+        self.limits = {name: dict(policy) for name, policy in DEFAULT_LIMITS.items()}
+        for name, policy in (limits or {}).items():
+            self.limits.setdefault(name, {}).update(policy)
+        self.transient = tuple(transient)
+
+    def policy(self, simulator):
+        merged = dict(self.limits['default'])
+        merged.update(self.limits.get(simulator, {}))
+        return merged
+
+    def _apply_limits(self, pid, policy):
+        """子进程启动后立即设置资源上限 (prlimit 不需要 preexec_fn，多线程父进程中也安全)"""
+        if resource is None or not hasattr(resource, 'prlimit'): return
+        try:
+            if policy.get('mem_mb'):
+                nbytes = int(policy['mem_mb']) * 1024 * 1024
+                resource.prlimit(pid, resource.RLIMIT_AS, (nbytes, nbytes))
+            if policy.get('cpu_s'):
+                # 软上限发 SIGXCPU，硬上限留 5 秒余量再 SIGKILL
+                soft = int(policy['cpu_s'])
+                resource.prlimit(pid, resource.RLIMIT_CPU, (soft, soft + 5))
+        except (OSError, ValueError):
+            pass
+
+    def _kill_group(self, proc, waiter):
+        """SIGTERM 整个进程组，宽限期后仍存活则 SIGKILL；返回时主进程已被 waiter 回收"""
+        for sig, grace in ((signal.SIGTERM, KILL_GRACE_S), (signal.SIGKILL, None)):
+            try:
+                os.killpg(proc.pid, sig)
+            except (ProcessLookupError, PermissionError):
+                break
+            waiter.join(grace)
+            if not waiter.is_alive(): return
+        waiter.join()
+
+    def _attempt(self, cmd, policy, cwd, env, stdout_file):
+        """单次运行，返回 (returncode, stdout, stderr, failure, cpu_s)"""
+        stdout = stdout_file if stdout_file is not None else subprocess.PIPE
+        stderr = subprocess.STDOUT if stdout_file is not None else subprocess.PIPE
+        try:
+            proc = subprocess.Popen(cmd, stdout=stdout, stderr=stderr, text=True, cwd=cwd, env=env,
+                                    start_new_session=True)
+        except OSError as e:
+            return None, "", str(e), 'launch', 0.0
+        self._apply_limits(proc.pid, policy)
+        # 不用 communicate()：它会以 waitpid 回收子进程，拿不到该子进程自己的 rusage
+        outputs = {}
+        readers = []
+        for name, stream in (('out', proc.stdout), ('err', proc.stderr)):
+            if stream is None: continue
+            outputs[name] = []
+            readers.append(threading.Thread(target=_drain, args=(stream, outputs[name]), daemon=True))
+        for t in readers: t.start()
+        waiter = _Waiter(proc)
+        waiter.start()
+        timed_out = False
+        try:
+            waiter.join(policy.get('timeout_s'))
+            if waiter.is_alive():
+                timed_out = True
+                self._kill_group(proc, waiter)
+        finally:
+            # 主进程已退出时清理组内残留的子进程 (它们可能仍持有管道)
+            try: os.killpg(proc.pid, signal.SIGKILL)
+            except (ProcessLookupError, PermissionError): pass
+            for t in readers: t.join()
+        out, err = "".join(outputs.get('out', [])), "".join(outputs.get('err', []))
+        ru = waiter.rusage
+        cpu_s, maxrss_mb = _usage(ru)
+        tracing.add_child_usage(cpu_s, maxrss_mb)
+        failure = classify(proc.returncode, err or out, timed_out, cpu_s=cpu_s if ru else None,
+                           cpu_limit_s=policy.get('cpu_s'), maxrss_mb=maxrss_mb if ru else None,
+                           mem_limit_mb=policy.get('mem_mb'))
+        return proc.returncode, out, err, failure, cpu_s
+
+    def _retryable(self, failure, policy):
+        """RLIMIT_AS 下的内存不足由输入决定，重试只会重复一次慢失败"""
+        if failure == 'oom' and policy.get('mem_mb'): return False
+        return failure in self.transient
+
+    def run(self, cmd, simulator=None, cwd=None, env=None, stdout_path=None):
+        """
+        运行仿真器命令，瞬时性失败按策略重试
+        stdout_path: 给定时 stdout + stderr 写入该文件 (如 booksim.log)，返回值中的 stdout 为空
+        """
+        simulator = simulator or os.path.basename(cmd[0])
+        policy = self.policy(simulator)
+        retries = max(0, int(policy.get('retries') or 0))
+        t0 = time.perf_counter()
+        cpu_total = 0.0
+        for attempt in range(1, retries + 2):
+            if stdout_path is not None:
+                with open(stdout_path, 'w') as log_f:
+                    code, out, err, failure, cpu_s = self._attempt(cmd, policy, cwd, env, log_f)
+            else:
+                code, out, err, failure, cpu_s = self._attempt(cmd, policy, cwd, env, None)
+            cpu_total += cpu_s
+            if failure is None: break
+            SIM_FAILURES.inc(simulator=simulator, kind=failure)
+            if not self._retryable(failure, policy) or attempt > retries: break
+            SIM_RETRIES.inc(simulator=simulator, kind=failure)
+            time.sleep(float(policy.get('backoff_s') or 0) * (2 ** (attempt - 1)))
+        return {'success': failure is None, 'stdout': out, 'stderr': err[-STDERR_TAIL:], 'returncode': code,
+                'failure': failure, 'attempts': attempt, 'elapsed_s': time.perf_counter() - t0,
+                'simulator': simulator, 'cpu_s': cpu_total}
+
+    def parse_failure(self, result):
+        """进程成功但输出无法解析：记为 'parse' 失败 (不重试，同一输入结果确定)"""
+        SIM_FAILURES.inc(simulator=result['simulator'], kind='parse')
+        result.update(success=False, failure='parse')
+        return result
+
+def describe(result):
+    """失败结果的一行说明，用于日志"""
+    if not result or result.get('failure') is None: return ""
+    text = f"{result['simulator']}: {result['failure']}"
+    if result['failure'] == 'exit_code': text += f" (rc={result['returncode']})"
+    if result.get('attempts', 1) > 1: text += f" after {result['attempts']} attempts"
+    return text
+
+def failure_record(result, layer=None):
+    """写入评估详情 / 日志的结构化失败记录"""
+    return {'layer': layer, 'simulator': result.get('simulator'), 'kind': result.get('failure'),
+            'returncode': result.get('returncode'), 'attempts': result.get('attempts', 1),
+            'elapsed_s': round(result.get('elapsed_s', 0.0), 3),
+            'stderr_tail': (result.get('stderr') or "")[-400:]}
@@ -44,7 +44,8 @@ class SoftwareOptimizer:
                 'timeout': 100,             
                 'optimization_metrics': ['edp', 'delay'],
                 'live_status': False,
-                'num_threads': 8,           
+                # 上限；评估时按 CoreScheduler 分得的核心数改写
+                'num_threads': 8,
                 'search_size': 0
             },
             'mapspace': {
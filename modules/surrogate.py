@@ -0,0 +1,129 @@
+import numpy as np
+from modules.tracing import span
+
+# sklearn / scipy 在首次构建或使用模型时才导入，避免拖慢只需解析结果或跑仿真的进程
+
+class FastReestimator:
+    def __init__(self):
+        from sklearn.gaussian_process import GaussianProcessRegressor
+        from sklearn.gaussian_process.kernels import Matern, WhiteKernel
+        kernel = Matern(length_scale=1.0, length_scale_bounds=(1e-2, 1e5), nu=2.5) + \
+                 WhiteKernel(noise_level=1e-5, noise_level_bounds=(1e-9, 1e-1))
+        self.model = GaussianProcessRegressor(kernel=kernel, n_restarts_optimizer=5, normalize_y=True)
+        self.X_history = []
+        self.y_history = []
+        self.bound_mask = []
+        self.is_fitted = False
+
+    def update(self, hw_params, performance_metric, is_bound=False):
+        """is_bound=True 表示该值来自分支定界剪枝，只是真实 target 的上界"""
+        self.X_history.append(hw_params)
+        self.y_history.append(performance_metric) 
+        self.bound_mask.append(bool(is_bound))
+        self._fit()
+
+    def load_history(self, X, y, is_bound=None):
+        """续跑时一次性恢复全部历史并只拟合一次"""
+        self.X_history = [list(x) for x in X]
+        self.y_history = list(y)
+        self.bound_mask = list(is_bound) if is_bound is not None else [False] * len(self.y_history)
+        self._fit()
+
+    def _fit(self):
+        if len(self.X_history) >= 3:
+            with span("surrogate_fit", cat="search", n=len(self.X_history)):
+                try:
+                    X = np.array(self.X_history)
+                    y = np.array(self.y_history, dtype=float)
+                    mask = np.array(self.bound_mask, dtype=bool)
+                    # 上界点：先只用精确点拟合，再把上界截断为 min(上界, 精确模型的预测均值) 后整体拟合
+                    if mask.any() and (~mask).sum() >= 3:
+                        self.model.fit(X[~mask], y[~mask])
+                        y[mask] = np.minimum(y[mask], self.model.predict(X[mask]))
+                    self.model.fit(X, y)
+                    self.is_fitted = True
+                except: pass
+
+    def best_target(self):
+        exact = [v for v, b in zip(self.y_history, self.bound_mask) if not b]
+        return max(exact) if exact else max(self.y_history)
+
+    def predict(self, hw_params):
+        if not self.is_fitted: return np.random.rand() 
+        pred, std = self.model.predict(np.array([hw_params]), return_std=True)
+        return pred[0] + 1.96 * std[0] 
+
+    def expected_improvement(self, points, xi=0.01):
+        """相对当前最优 target (越大越好) 的期望改进"""
+        from scipy.stats import norm
+        if not self.is_fitted: return np.random.rand(len(points))
+        mu, std = self.model.predict(np.array(points), return_std=True)
+        std = np.maximum(std, 1e-9)
+        imp = mu - self.best_target() - xi
+        z = imp / std
+        return imp * norm.cdf(z) + std * norm.pdf(z)
+
+    def sample(self, points, rng):
+        """对一组点抽取一次联合后验样本 (Thompson Sampling)"""
+        if not self.is_fitted: return rng.rand(len(points))
+        return self.model.sample_y(np.array(points), 1, random_state=rng.randint(2**31 - 1))[:, 0]
+
+class StageCostModel:
+    """
+    评估代价模型：按硬件参数预测一次完整评估各阶段的耗时 (秒)
+    对每个阶段的 log(秒) 单独做 GP 回归；样本不足 3 个时退化为历史均值
+    """
+    STAGES = ['preprocess', 'mapper', 'trace', 'ramulator', 'booksim', 'overhead']
+
+    def __init__(self):
+        self.X_history = []
+        self.t_history = {stage: [] for stage in self.STAGES}
+        self.models = {}
+
+    def update(self, hw_params, stage_times, wall_time):
+        self._append(hw_params, stage_times, wall_time)
+        self._fit()
+
+    def load_history(self, X, stage_times_list, wall_times):
+        for hw_params, stage_times, wall_time in zip(X, stage_times_list, wall_times):
+            self._append(hw_params, stage_times, wall_time)
+        self._fit()
+
+    def _append(self, hw_params, stage_times, wall_time):
+        self.X_history.append(list(hw_params))
+        # 各阶段之外的时间 (软件优化、架构生成、结果解析等) 计入 overhead
+        overhead = wall_time - sum(stage_times.get(s, 0.0) for s in self.STAGES if s != 'overhead')
+        for stage in self.STAGES:
+            sec = overhead if stage == 'overhead' else stage_times.get(stage, 0.0)
+            self.t_history[stage].append(max(sec, 1e-3))
+
+    def _fit(self):
+        self.models = {}
+        if len(self.X_history) < 3: return
+        from sklearn.gaussian_process import GaussianProcessRegressor
+        from sklearn.gaussian_process.kernels import Matern, WhiteKernel
+        with span("cost_model_fit", cat="search", n=len(self.X_history)):
+            for stage in self.STAGES:
+                kernel = Matern(length_scale=1.0, length_scale_bounds=(1e-2, 1e5), nu=2.5) + \
+                         WhiteKernel(noise_level=1e-2, noise_level_bounds=(1e-6, 1e1))
+                model = GaussianProcessRegressor(kernel=kernel, n_restarts_optimizer=2, normalize_y=True)
+                try:
+                    model.fit(np.array(self.X_history), np.log(np.array(self.t_history[stage])))
+                    self.models[stage] = model
+                except: pass
+
+    def predict(self, points):
+        """返回 {stage: ndarray(秒)}；尚无任何样本时返回 None"""
+        if not self.X_history: return None
+        pred = {}
+        for stage in self.STAGES:
+            if stage in self.models:
+                pred[stage] = np.exp(self.models[stage].predict(np.array(points)))
+            else:
+                pred[stage] = np.full(len(points), np.mean(self.t_history[stage]))
+        return pred
+
+    def predict_total(self, points):
+        pred = self.predict(points)
+        if pred is None: return np.ones(len(points))
+        return sum(pred.values())
@@ -0,0 +1,493 @@
+"""
+代理模型查询服务：汇总全部已归档评估 (结果库 + run 目录 journal)，拟合并缓存 FastReestimator 同款 GP，
+以毫秒级响应批量 what-if 查询 ("3x2 mesh、24x24 PE、2 MB SRAM 的 EDP 是多少？")
+
+    python -m modules.surrogate_service query --store results/results.db 3,2,24,21 2,2,16,20
+    python -m modules.surrogate_service query --store results/results.db --runs results '{"mesh_x": 3, "mesh_y": 2, "pe": 24, "sram_mb": 2}'
+    python -m modules.surrogate_service serve --store results/results.db --runs results --port 8765
+    curl -s localhost:8765/query -d '{"points": [[3, 2, 24, 21]]}'
+    curl -s localhost:8765/status
+
+每个回答包含预测 EDP (GP 均值)、不确定度 (log10 EDP 的标准差与 95% 区间) 以及最近的已评估点
+(归一化硬件空间中的欧氏距离；distance 为 0 即该点已精确评估过)
+
+  - 不同工作负载的 EDP 不可比：按 run 配置中的 WORKLOADS 分组，每组一个模型，默认查询点数最多的组
+  - 只使用完整评估 (OK / NewBest / AreaVio，未被剪枝)，与搜索中代理模型看到的 target 一致
+  - 增量刷新：结果库按 rowid、journal 按字节偏移只读取新增记录；超参数固定时扩展 Cholesky 因子
+    (O(n^2) 而非重新拟合的 O(n^3))，点数比上次超参数拟合增长 REFIT_GROWTH 倍后才重新优化超参数
+  - --cache 指定时拟合结果与读取位置写入磁盘，重启服务不需要从头拟合
+"""
+import os
+import sys
+import glob
+import json
+import time
+import pickle
+import argparse
+import threading
+import numpy as np
+
+from modules.visualizer import C_CYAN, C_GREEN, C_RED, C_YELLOW, C_END
+
+# 超参数优化最多使用的点数 (EDP 最好的一半 + 其余均匀抽样)；Cholesky 扩展始终使用全部点
+HYPERFIT_MAX = 600
+REFIT_GROWTH = 1.5
+COMPLETE_STATUS = ("OK", "NewBest", "AreaVio")
+CACHE_VERSION = 1
+
+def workload_key(config):
+    """run 配置 -> 工作负载组名 (如 resnet18@224x224)；缺失时为 'default'"""
+    specs = (config or {}).get('WORKLOADS')
+    if not specs: return "default"
+    parts = []
+    for spec in specs:
+        name = f"{spec['model']}@{'x'.join(str(v) for v in spec['input_size'])}"
+        if spec.get('weight', 1.0) != 1.0: name += f"*{spec['weight']:g}"
+        parts.append(name)
+    return "+".join(parts)
+
+def parse_point(text):
+    """
+    "3,2,24,21" / "3x2,24,21" / [3, 2, 24, 21] / {"mesh_x", "mesh_y", "pe", "sram_log2" | "sram_kb" | "sram_mb"}
+    -> [mesh_x, mesh_y, pe, sram_log2]
+    """
+    value = text
+    if isinstance(text, str):
+        try:
+            value = json.loads(text)
+        except ValueError:
+            value = [int(v) for v in text.replace("x", ",").split(",") if v.strip()]
+    if isinstance(value, dict):
+        if 'sram_log2' in value: sram = int(value['sram_log2'])
+        elif 'sram_kb' in value: sram = int(round(np.log2(float(value['sram_kb']) * 1024)))
+        elif 'sram_mb' in value: sram = int(round(np.log2(float(value['sram_mb']) * 1024 * 1024)))
+        else: raise ValueError(f"no SRAM size in {value}")
+        value = [value['mesh_x'], value['mesh_y'], value['pe'], sram]
+    if len(value) != 4:
+        raise ValueError(f"expected [mesh_x, mesh_y, pe, sram_log2], got {text!r}")
+    return [int(v) for v in value]
+
+# ------------------------------------------------------------
+# 增量读取归档评估
+# ------------------------------------------------------------
+class ArchiveFeed:
+    """
+    poll() 返回上次调用以来新增的完整评估：[{'run_id', 'iter', 'hw', 'edp', 'status', 'workload'}]
+    run_paths 中的目录本身含 journal.jsonl 时作为 run 目录，否则视为 results/ 这样的父目录 (每次 poll 重新扫描 run_*)
+    """
+    def __init__(self, store=None, run_paths=()):
+        self.store = store
+        self.run_paths = list(run_paths)
+        self.store_rowid = 0
+        self.journal_offsets = {}
+        self.workloads = {}
+        self.seen = set()
+
+    def _run_dirs(self):
+        dirs = []
+        for path in self.run_paths:
+            if os.path.exists(os.path.join(path, "journal.jsonl")): dirs.append(path)
+            else: dirs.extend(sorted(d for d in glob.glob(os.path.join(path, "run_*")) if os.path.isdir(d)))
+        return dirs
+
+    def _accept(self, run_id, it, hw, edp, status, is_bound, out):
+        key = (run_id, int(it))
+        if key in self.seen: return
+        self.seen.add(key)
+        if status not in COMPLETE_STATUS or is_bound or not edp or None in hw: return
+        out.append({'run_id': run_id, 'iter': int(it), 'hw': [int(v) for v in hw], 'edp': float(edp),
+                    'status': status, 'workload': self.workloads.get(run_id, "default")})
+
+    def _poll_store(self, out):
+        if not self.store or not os.path.exists(self.store): return
+        from modules.results_store import ResultsStore
+        with ResultsStore(self.store) as store:
+            for r in store.query("SELECT run_id, config FROM runs"):
+                if r['run_id'] in self.workloads: continue
+                try:
+                    self.workloads[r['run_id']] = workload_key(json.loads(r['config']) if r['config'] else None)
+                except (TypeError, ValueError, KeyError):
+                    self.workloads[r['run_id']] = "default"
+            # INSERT OR REPLACE 覆盖的行会得到新的 rowid，同样会被读到
+            rows = store.query("SELECT rowid AS rid, run_id, iter, mesh_x, mesh_y, pe, sram_log2, edp, status, is_bound "
+                               "FROM points WHERE rowid > ? ORDER BY rowid", (self.store_rowid,))
+        for p in rows:
+            self.store_rowid = max(self.store_rowid, p['rid'])
+            self._accept(p['run_id'], p['iter'], [p['mesh_x'], p['mesh_y'], p['pe'], p['sram_log2']],
+                         p['edp'], p['status'], bool(p['is_bound']), out)
+
+    def _poll_journal(self, run_dir, out):
+        run_id = os.path.basename(os.path.normpath(run_dir))
+        if run_id not in self.workloads:
+            config = None
+            try:
+                with open(os.path.join(run_dir, "experiment_metadata.json"), 'r') as f: config = json.load(f)
+            except (OSError, ValueError): pass
+            self.workloads[run_id] = workload_key(config)
+        journal = os.path.join(run_dir, "journal.jsonl")
+        offset = self.journal_offsets.get(journal, 0)
+        try:
+            if os.path.getsize(journal) <= offset: return
+            with open(journal, 'rb') as f:
+                f.seek(offset)
+                data = f.read()
+        except OSError:
+            return
+        # 只消费完整的行，写到一半的最后一行留到下次
+        end = data.rfind(b"\n") + 1
+        self.journal_offsets[journal] = offset + end
+        for line in data[:end].splitlines():
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                continue
+            if rec.get('type') != 'evaluation': continue
+            details = rec.get('details') or {}
+            self._accept(run_id, rec['iter'], list(rec['hw']), rec.get('edp'), rec.get('status'),
+                         bool(details.get('is_bound', False)), out)
+
+    def poll(self):
+        out = []
+        self._poll_store(out)
+        for run_dir in self._run_dirs():
+            self._poll_journal(run_dir, out)
+        return out
+
+    def state(self):
+        return {'store_rowid': self.store_rowid, 'journal_offsets': dict(self.journal_offsets),
+                'workloads': dict(self.workloads), 'seen': set(self.seen)}
+
+    def restore(self, state):
+        self.store_rowid = state['store_rowid']
+        self.journal_offsets = state['journal_offsets']
+        self.workloads = state['workloads']
+        self.seen = state['seen']
+
+# ------------------------------------------------------------
+# 模型
+# ------------------------------------------------------------
+class IncrementalGP:
+    """
+    超参数 (kernel_ 与 y 归一化常数) 固定的 GP 后验
+    extend() 对新增的 k 个点做分块 Cholesky 更新，返回新对象 (查询线程持有的旧对象保持不变)
+    """
+    JITTER = 1e-8
+
+    def __init__(self, kernel, y_mean, y_std, X, y):
+        from scipy.linalg import cholesky, cho_solve
+        self.kernel, self.y_mean, self.y_std = kernel, y_mean, y_std
+        self.X = np.asarray(X, dtype=float)
+        self.y = np.asarray(y, dtype=float)
+        K = self.kernel(self.X) + self.JITTER * np.eye(len(self.X))
+        self.L = cholesky(K, lower=True)
+        self.alpha = cho_solve((self.L, True), (self.y - y_mean) / y_std)
+
+    def extend(self, X_new, y_new):
+        from scipy.linalg import cholesky, cho_solve, solve_triangular
+        X_new = np.asarray(X_new, dtype=float)
+        K12 = self.kernel(self.X, X_new)
+        K22 = self.kernel(X_new) + self.JITTER * np.eye(len(X_new))
+        L21 = solve_triangular(self.L, K12, lower=True).T
+        L22 = cholesky(K22 - L21 @ L21.T, lower=True)
+        n, k = len(self.X), len(X_new)
+        gp = IncrementalGP.__new__(IncrementalGP)
+        gp.kernel, gp.y_mean, gp.y_std = self.kernel, self.y_mean, self.y_std
+        gp.X = np.vstack([self.X, X_new])
+        gp.y = np.concatenate([self.y, np.asarray(y_new, dtype=float)])
+        gp.L = np.zeros((n + k, n + k))
+        gp.L[:n, :n] = self.L
+        gp.L[n:, :n] = L21
+        gp.L[n:, n:] = L22
+        gp.alpha = cho_solve((gp.L, True), (gp.y - gp.y_mean) / gp.y_std)
+        return gp
+
+    def state(self):
+        return (self.kernel, self.y_mean, self.y_std, self.X, self.y, self.L, self.alpha)
+
+    @classmethod
+    def from_state(cls, state):
+        gp = cls.__new__(cls)
+        gp.kernel, gp.y_mean, gp.y_std, gp.X, gp.y, gp.L, gp.alpha = state
+        return gp
+
+    def predict(self, Xq):
+        from scipy.linalg import solve_triangular
+        Xq = np.asarray(Xq, dtype=float)
+        Ks = self.kernel(Xq, self.X)
+        mu = Ks @ self.alpha
+        v = solve_triangular(self.L, Ks.T, lower=True)
+        var = np.maximum(self.kernel.diag(Xq) - np.sum(v * v, axis=0), 1e-12)
+        return mu * self.y_std + self.y_mean, np.sqrt(var) * self.y_std
+
+class WorkloadModel:
+    """一个工作负载组：全部评估记录 + GP；target 与搜索一致 (main_optimization.search_target)"""
+    def __init__(self, name):
+        self.name = name
+        self.records = []
+        self.gp = None
+        self.n_hyperfit = 0
+        self.fits = {'full': 0, 'incremental': 0}
+
+    def state(self):
+        return {'name': self.name, 'records': self.records, 'n_hyperfit': self.n_hyperfit, 'fits': dict(self.fits),
+                'gp': self.gp.state() if self.gp is not None else None}
+
+    @classmethod
+    def from_state(cls, state):
+        model = cls(state['name'])
+        model.records, model.n_hyperfit, model.fits = state['records'], state['n_hyperfit'], state['fits']
+        model.gp = IncrementalGP.from_state(state['gp']) if state['gp'] is not None else None
+        return model
+
+    def _hyperfit(self, X, y):
+        """FastReestimator 同款核与重启次数；点太多时用 EDP 最好的一半 + 均匀抽样子集优化超参数"""
+        from modules.surrogate import FastReestimator
+        idx = np.arange(len(y))
+        if len(y) > HYPERFIT_MAX:
+            order = np.argsort(-y)
+            best = order[:HYPERFIT_MAX // 2]
+            rest = np.random.RandomState(0).choice(order[HYPERFIT_MAX // 2:], HYPERFIT_MAX - len(best), replace=False)
+            idx = np.concatenate([best, rest])
+        est = FastReestimator()
+        est.load_history(X[idx].tolist(), y[idx].tolist())
+        if not est.is_fitted: return None
+        return est.model.kernel_, float(np.mean(y[idx])), float(np.std(y[idx]) or 1.0)
+
+    def add(self, records):
+        from main_optimization import search_target
+        if not records: return
+        X_new = np.array([r['hw'] for r in records], dtype=float)
+        y_new = np.array([search_target(r['edp']) for r in records])
+        self.records.extend(records)
+        n = len(self.records)
+        if n < 3: return
+        if self.gp is not None and n < self.n_hyperfit * REFIT_GROWTH:
+            try:
+                self.gp = self.gp.extend(X_new, y_new)
+                self.fits['incremental'] += 1
+                return
+            except (np.linalg.LinAlgError, ValueError):
+                pass  # 数值上不再正定：退回完整拟合
+        X = np.array([r['hw'] for r in self.records], dtype=float)
+        y = np.array([search_target(r['edp']) for r in self.records])
+        hyper = self._hyperfit(X, y)
+        if hyper is None: return
+        self.gp = IncrementalGP(hyper[0], hyper[1], hyper[2], X, y)
+        self.n_hyperfit = n
+        self.fits['full'] += 1
+
+    def nearest(self, points, bounds):
+        """每个查询点最近的已评估点 (同一硬件点多次评估时取 EDP 最好的一次)"""
+        X = np.array([r['hw'] for r in self.records], dtype=float)
+        scale = np.array([hi - lo for lo, hi in bounds], dtype=float)
+        d = np.linalg.norm((np.asarray(points, dtype=float)[:, None, :] - X[None, :, :]) / scale, axis=2)
+        out = []
+        for row in d:
+            near = np.flatnonzero(row <= row.min() + 1e-12)
+            rec = min((self.records[i] for i in near), key=lambda r: r['edp'])
+            out.append({'hw': rec['hw'], 'edp': rec['edp'], 'status': rec['status'], 'run_id': rec['run_id'],
+                        'iter': rec['iter'], 'distance': round(float(row.min()), 4), 'evaluations': len(near)})
+        return out
+
+# ------------------------------------------------------------
+# 服务
+# ------------------------------------------------------------
+class SurrogateService:
+    def __init__(self, store=None, run_paths=(), cache=None):
+        from main_optimization import HW_BOUNDS
+        self.bounds = HW_BOUNDS
+        self.feed = ArchiveFeed(store, run_paths)
+        self.models = {}
+        self.cache = cache
+        self.lock = threading.Lock()
+        self.refreshed = None
+        if cache: self._load_cache()
+
+    def _cache_tag(self):
+        return {'version': CACHE_VERSION, 'store': os.path.abspath(self.feed.store) if self.feed.store else None,
+                'runs': sorted(os.path.abspath(p) for p in self.feed.run_paths)}
+
+    def _load_cache(self):
+        try:
+            with open(self.cache, 'rb') as f: data = pickle.load(f)
+            if data.get('tag') != self._cache_tag(): return
+            self.feed.restore(data['feed'])
+            self.models = {name: WorkloadModel.from_state(m) for name, m in data['models'].items()}
+        except (OSError, pickle.UnpicklingError, EOFError, KeyError, AttributeError, ValueError):
+            pass
+
+    def _save_cache(self):
+        if os.path.dirname(self.cache): os.makedirs(os.path.dirname(self.cache), exist_ok=True)
+        tmp = f"{self.cache}.{os.getpid()}.tmp"
+        with self.lock:
+            # 只存基本类型、numpy 数组与 sklearn 核 (不依赖本模块的类路径)
+            data = {'tag': self._cache_tag(), 'feed': self.feed.state(),
+                    'models': {name: m.state() for name, m in self.models.items()}}
+            with open(tmp, 'wb') as f: pickle.dump(data, f)
+        os.replace(tmp, self.cache)
+
+    def refresh(self):
+        """读取新增评估并更新对应模型，返回新增点数"""
+        new = self.feed.poll()
+        by_group = {}
+        for rec in new: by_group.setdefault(rec['workload'], []).append(rec)
+        for name, records in by_group.items():
+            model = self.models.get(name) or WorkloadModel(name)
+            model.add(records)
+            with self.lock: self.models[name] = model
+        self.refreshed = time.time()
+        if new and self.cache: self._save_cache()
+        return len(new)
+
+    def default_workload(self):
+        with self.lock:
+            if not self.models: return None
+            return max(self.models.values(), key=lambda m: len(m.records)).name
+
+    def query(self, points, workload=None):
+        t0 = time.perf_counter()
+        workload = workload or self.default_workload()
+        with self.lock:
+            model = self.models.get(workload)
+            gp = model.gp if model else None
+        if model is None:
+            raise KeyError(f"no evaluations for workload {workload!r}")
+        points = [parse_point(p) for p in points]
+        nearest = model.nearest(points, self.bounds)
+        answers = []
+        if gp is not None:
+            mu, std = gp.predict(points)
+        for k, hw in enumerate(points):
+            ans = {'hw': hw, 'edp': None, 'log10_edp_std': None, 'edp_95': None, 'nearest': nearest[k]}
+            if gp is not None:
+                # target = -log10(EDP)
+                ans['edp'] = float(10 ** -mu[k])
+                ans['log10_edp_std'] = round(float(std[k]), 4)
+                ans['edp_95'] = [float(10 ** -(mu[k] + 1.96 * std[k])), float(10 ** -(mu[k] - 1.96 * std[k]))]
+            answers.append(ans)
+        return {'workload': workload, 'points': len(model.records), 'answers': answers,
+                'ms': round((time.perf_counter() - t0) * 1000, 3)}
+
+    def status(self):
+        with self.lock:
+            groups = {name: {'points': len(m.records), 'fitted': m.gp is not None, 'hyperfit_at': m.n_hyperfit,
+                             'fits': dict(m.fits)} for name, m in self.models.items()}
+        return {'workloads': groups, 'default': self.default_workload(), 'refreshed': self.refreshed,
+                'store': self.feed.store, 'runs': self.feed.run_paths}
+
+class SurrogateServer:
+    """本机 HTTP 服务：POST /query {"points": [...], "workload": 可选}，GET /status；后台线程定期 refresh()"""
+    def __init__(self, service, port, host="127.0.0.1", refresh_s=30.0):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        self.service = service
+        self.refresh_s = refresh_s
+        self.stop_event = threading.Event()
+        service_ref = service
+
+        class Handler(BaseHTTPRequestHandler):
+            def _reply(self, code, obj):
+                body = json.dumps(obj).encode()
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if self.path.split("?")[0] == "/status": self._reply(200, service_ref.status())
+                else: self.send_error(404)
+
+            def do_POST(self):
+                if self.path.split("?")[0] != "/query":
+                    self.send_error(404)
+                    return
+                try:
+                    req = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+                    self._reply(200, service_ref.query(req.get('points') or [], req.get('workload')))
+                except (ValueError, KeyError, TypeError) as e:
+                    self._reply(400, {'error': str(e)})
+
+            def log_message(self, fmt, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.host, self.port = self.httpd.server_address[:2]
+        self.refresher = threading.Thread(target=self._refresh_loop, daemon=True)
+
+    def _refresh_loop(self):
+        while not self.stop_event.wait(self.refresh_s):
+            try:
+                n = self.service.refresh()
+                if n: print(f"{C_CYAN}[Surrogate] +{n} evaluations{C_END}")
+            except Exception as e:
+                print(f"{C_YELLOW}[Surrogate] refresh failed: {e}{C_END}")
+
+    def serve_forever(self):
+        self.refresher.start()
+        try:
+            self.httpd.serve_forever()
+        finally:
+            self.stop_event.set()
+            self.httpd.server_close()
+
+def _print_answers(result):
+    print(f"{C_CYAN}workload {result['workload']}  ({result['points']} evaluations, {result['ms']:.1f} ms){C_END}")
+    print(f"{'hw':<18}{'EDP':>11}{'95% interval':>25}   nearest evaluated")
+    for a in result['answers']:
+        n = a['nearest']
+        near = f"{n['hw']} EDP {n['edp']:.3e} ({'exact' if n['distance'] == 0 else 'd=' + str(n['distance'])})"
+        if a['edp'] is None:
+            print(f"{str(a['hw']):<18}{'-':>11}{'-':>25}   {near}")
+        else:
+            lo, hi = a['edp_95']
+            print(f"{str(a['hw']):<18}{a['edp']:>11.3e}{f'[{lo:.2e}, {hi:.2e}]':>25}   {near}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Answer what-if EDP queries from archived evaluations")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    for name in ("query", "serve"):
+        p = sub.add_parser(name)
+        p.add_argument("--store", help="results database, e.g. results/results.db")
+        p.add_argument("--runs", nargs="*", default=[], help="run directories, or parents such as results/ containing run_*")
+        p.add_argument("--cache", help="pickle file keeping the fitted models between invocations")
+        p.add_argument("--workload", help="workload group (default: the one with most evaluations)")
+    q = sub.choices["query"]
+    q.add_argument("points", nargs="+", help='"mesh_x,mesh_y,pe,sram_log2" or a JSON object with sram_kb / sram_mb')
+    q.add_argument("--json", action="store_true", help="print the raw JSON answer")
+    s = sub.choices["serve"]
+    s.add_argument("--port", type=int, default=8765)
+    s.add_argument("--host", default="127.0.0.1")
+    s.add_argument("--refresh-s", type=float, default=30.0)
+    args = parser.parse_args()
+
+    if not args.store and not args.runs:
+        parser.error("give --store and/or --runs")
+    t0 = time.perf_counter()
+    service = SurrogateService(args.store, args.runs, cache=args.cache)
+    n = service.refresh()
+    print(f"{C_GREEN}[Surrogate] {n} new evaluations loaded in {time.perf_counter() - t0:.2f}s{C_END}", file=sys.stderr)
+    if not service.models:
+        print(f"{C_RED}[Surrogate] no complete evaluations found{C_END}", file=sys.stderr)
+        return 1
+
+    if args.cmd == "query":
+        try:
+            result = service.query(args.points, args.workload)
+        except (ValueError, KeyError) as e:
+            print(f"{C_RED}[Surrogate] {e}{C_END}", file=sys.stderr)
+            return 1
+        if args.json: print(json.dumps(result, indent=2))
+        else: _print_answers(result)
+        return 0
+
+    server = SurrogateServer(service, args.port, args.host, args.refresh_s)
+    print(f"{C_GREEN}[Surrogate] serving http://{server.host}:{server.port}/query (refresh every {args.refresh_s:g}s){C_END}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,226 @@
+"""
+轻量级阶段追踪 (span)，导出 Chrome / Perfetto trace JSON
+
+    from modules.tracing import span
+    with span("timeloop-mapper", layer=name):
+        ...
+
+未启用时 span() 返回一个共享的空上下文，开销只有一次函数调用。
+启用方式：tracing.enable(trace_dir) 或环境变量 PIM_TRACE_DIR (子进程 / 进程池 / worker 继承)。
+每个进程把事件追加写入 trace_dir/events_<host>_<pid>.jsonl，互不干扰；
+export_chrome() 合并全部文件，summarize() 输出按阶段汇总的耗时表。
+
+每个 span 记录：墙钟时间、本线程 CPU 时间 (thread_time)，以及期间由本线程启动并回收的仿真器子进程
+的 CPU 时间 (user+sys) 与峰值 RSS。子进程用量由 SimRunner 在 wait4 回收时通过 add_child_usage()
+报告给本线程当前所在的 span (外层 span 累计内层的值)，并行运行的其它层不会计入
+"""
+import os
+import sys
+import json
+import time
+import atexit
+import socket
+import argparse
+import threading
+
+ENV_VAR = "PIM_TRACE_DIR"
+
+_tracer = None
+
+class _NullSpan:
+    def __enter__(self): return self
+    def __exit__(self, exc_type, exc_val, exc_tb): return False
+    def set(self, **kwargs): pass
+
+_NULL_SPAN = _NullSpan()
+
+# 每个线程当前打开的 span 栈 (子进程用量记到栈顶)
+_local = threading.local()
+
+def _stack():
+    stack = getattr(_local, 'stack', None)
+    if stack is None: stack = _local.stack = []
+    return stack
+
+def add_child_usage(cpu_s, maxrss_mb):
+    """记录一个已回收子进程的 CPU 时间 (秒) 与峰值 RSS (MB) 到本线程当前的 span；未启用或不在 span 内时忽略"""
+    stack = getattr(_local, 'stack', None)
+    if not stack: return
+    top = stack[-1]
+    top.child_cpu += cpu_s
+    top.child_rss = max(top.child_rss, maxrss_mb)
+
+class _Span:
+    __slots__ = ('tracer', 'name', 'cat', 'args', 'ts', 't0', 'cpu0', 'child_cpu', 'child_rss')
+
+    def __init__(self, tracer, name, cat, args):
+        self.tracer = tracer
+        self.name = name
+        self.cat = cat
+        self.args = args
+
+    def set(self, **kwargs):
+        """在 span 内补充参数 (如缓存命中、结果大小)"""
+        self.args.update(kwargs)
+
+    def __enter__(self):
+        self.ts = time.time()
+        self.t0 = time.perf_counter()
+        self.cpu0 = time.thread_time()
+        self.child_cpu, self.child_rss = 0.0, 0.0
+        _stack().append(self)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        dur = time.perf_counter() - self.t0
+        cpu = time.thread_time() - self.cpu0
+        stack = _stack()
+        if stack and stack[-1] is self:
+            stack.pop()
+            if stack: add_child_usage(self.child_cpu, self.child_rss)
+        args = dict(self.args)
+        args.update({
+            'cpu_s': round(cpu, 6),
+            'child_cpu_s': round(self.child_cpu, 6),
+            'child_maxrss_mb': round(self.child_rss, 1),
+        })
+        if exc_type is not None: args['error'] = exc_type.__name__
+        self.tracer.record({
+            'name': self.name, 'cat': self.cat, 'ph': 'X',
+            'ts': int(self.ts * 1e6), 'dur': int(dur * 1e6),
+            'pid': os.getpid(), 'tid': threading.get_ident() % 2**31,
+            'args': args
+        })
+        return False
+
+class Tracer:
+    def __init__(self, trace_dir, flush_every=200):
+        self.trace_dir = trace_dir
+        self.flush_every = flush_every
+        self.lock = threading.Lock()
+        self.buffer = []
+        self.pid = os.getpid()
+        os.makedirs(trace_dir, exist_ok=True)
+
+    def _events_path(self):
+        return os.path.join(self.trace_dir, f"events_{socket.gethostname()}_{os.getpid()}.jsonl")
+
+    def record(self, event):
+        with self.lock:
+            # fork 出的子进程继承了父进程的缓冲，丢弃以免重复写出
+            if os.getpid() != self.pid:
+                self.buffer = []
+                self.pid = os.getpid()
+                _register_exit_flush(self)
+            self.buffer.append(event)
+            full = len(self.buffer) >= self.flush_every
+        if full: self.flush()
+
+    def flush(self):
+        with self.lock:
+            if os.getpid() != self.pid or not self.buffer: return
+            events, self.buffer = self.buffer, []
+        with open(self._events_path(), 'a') as f:
+            for ev in events:
+                f.write(json.dumps(ev) + "\n")
+
+def _register_exit_flush(tracer):
+    """
+    进程退出时写出缓冲。multiprocessing 的子进程以 os._exit 结束、不执行 atexit，
+    需另外注册 multiprocessing 的 Finalize (仅当本进程已加载 multiprocessing 时)
+    """
+    atexit.register(tracer.flush)
+    if 'multiprocessing' in sys.modules:
+        from multiprocessing.util import Finalize
+        Finalize(tracer, tracer.flush, exitpriority=100)
+
+def enable(trace_dir):
+    """启用追踪；同时设置环境变量，使之后启动的子进程也写入同一目录"""
+    global _tracer
+    trace_dir = os.path.abspath(trace_dir)
+    os.environ[ENV_VAR] = trace_dir
+    if _tracer is None or _tracer.trace_dir != trace_dir:
+        if _tracer is not None: _tracer.flush()
+        _tracer = Tracer(trace_dir)
+        _register_exit_flush(_tracer)
+    return _tracer
+
+def enabled():
+    return _tracer is not None
+
+def trace_dir():
+    """当前事件目录 (可能来自 PIM_TRACE_DIR 而非 enable 的调用方)；未启用时为 None"""
+    return _tracer.trace_dir if _tracer is not None else None
+
+def flush():
+    if _tracer is not None: _tracer.flush()
+
+def span(name, cat="stage", **args):
+    if _tracer is None: return _NULL_SPAN
+    return _Span(_tracer, name, cat, args)
+
+# ------------------------------------------------------------
+# 导出与汇总
+# ------------------------------------------------------------
+def load_events(trace_dir):
+    events = []
+    if not os.path.isdir(trace_dir): return events
+    for name in sorted(os.listdir(trace_dir)):
+        if not (name.startswith("events_") and name.endswith(".jsonl")): continue
+        with open(os.path.join(trace_dir, name), 'r') as f:
+            for line in f:
+                try:
+                    events.append(json.loads(line))
+                except ValueError:
+                    continue  # 进程被杀时可能留下半行
+    return events
+
+def export_chrome(trace_dir, out_path=None):
+    """合并所有进程的事件为 Chrome trace JSON (chrome://tracing 或 ui.perfetto.dev 打开)"""
+    flush()
+    events = load_events(trace_dir)
+    out_path = out_path or os.path.join(trace_dir, "trace.json")
+    meta = [{'name': 'process_name', 'ph': 'M', 'pid': pid, 'args': {'name': f"pid {pid}"}}
+            for pid in sorted({ev['pid'] for ev in events})]
+    with open(out_path, 'w') as f:
+        json.dump({'traceEvents': meta + events, 'displayTimeUnit': 'ms'}, f)
+    return out_path
+
+def summarize(trace_dir):
+    """按 span 名汇总：次数、总墙钟时间、平均、本进程 CPU、子进程 CPU、子进程峰值 RSS"""
+    flush()
+    rows = {}
+    for ev in load_events(trace_dir):
+        if ev.get('ph') != 'X': continue
+        r = rows.setdefault(ev['name'], {'name': ev['name'], 'count': 0, 'wall_s': 0.0, 'cpu_s': 0.0,
+                                         'child_cpu_s': 0.0, 'child_maxrss_mb': 0.0})
+        args = ev.get('args', {})
+        r['count'] += 1
+        r['wall_s'] += ev['dur'] / 1e6
+        r['cpu_s'] += args.get('cpu_s', 0.0)
+        r['child_cpu_s'] += args.get('child_cpu_s', 0.0)
+        r['child_maxrss_mb'] = max(r['child_maxrss_mb'], args.get('child_maxrss_mb', 0.0))
+    return sorted(rows.values(), key=lambda r: r['wall_s'], reverse=True)
+
+def format_summary(rows):
+    lines = [f"{'Stage':<28}{'Count':>7}{'Wall(s)':>11}{'Avg(s)':>10}{'CPU(s)':>10}{'ChildCPU(s)':>13}{'ChildRSS(MB)':>14}"]
+    for r in rows:
+        lines.append(f"{r['name'][:27]:<28}{r['count']:>7}{r['wall_s']:>11.2f}{r['wall_s'] / r['count']:>10.3f}"
+                     f"{r['cpu_s']:>10.2f}{r['child_cpu_s']:>13.2f}{r['child_maxrss_mb']:>14.1f}")
+    return "\n".join(lines)
+
+def main():
+    parser = argparse.ArgumentParser(description="Merge span events into a Chrome trace and print a stage summary")
+    parser.add_argument("trace_dir")
+    parser.add_argument("-o", "--output", default=None, help="trace JSON path (default: TRACE_DIR/trace.json)")
+    args = parser.parse_args()
+    print(f"Wrote {export_chrome(args.trace_dir, args.output)}")
+    print(format_summary(summarize(args.trace_dir)))
+    return 0
+
+# 由父进程通过环境变量启用时，子进程导入即开始记录
+if os.environ.get(ENV_VAR):
+    enable(os.environ[ENV_VAR])
+
+if __name__ == "__main__":
+    sys.exit(main())
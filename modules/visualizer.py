@@ -1,5 +1,10 @@
+import os
+import re
 import sys
+import json
 import time
+import queue
+import atexit
 import threading
 import itertools
 import shutil
@@ -23,85 +28,212 @@ CURSOR_HIDE = '\033[?25l'
 CURSOR_SHOW = '\033[?25h'
 
 # ==========================================
-# Async Spinner (防刷屏版)
+# Progress Service (单一渲染线程)
 # ==========================================
-class AsyncSpinner:
-    def __init__(self, message="", interval=0.1):
-        self.message = message
+_ANSI_RE = re.compile(r'\033\[[0-9;?]*[A-Za-z]')
+
+def strip_ansi(text):
+    return _ANSI_RE.sub('', text)
+
+def _visible_truncate(text, max_len):
+    """按可见字符截断；需要截断时去掉颜色代码，避免切断转义序列"""
+    plain = strip_ansi(text)
+    if len(plain) <= max_len: return text
+    return plain[:max(0, max_len - 3)] + "..."
+
+class ProgressService:
+    """
+    进程内唯一的进度渲染器：所有任务 (线程或子进程) 只投递事件，由一个渲染线程限速重绘状态行
+      - TTY: 单行状态 "最新任务消息 [done/total] ⠋ (+N)"，最多每 interval 秒重绘一次
+      - 非 TTY (重定向 / 日志采集) 或 PIM_PROGRESS=json: 每个事件输出一行 JSON，update 事件按任务限速
+    子进程通过 attach(multiprocessing 队列) 接入，在子进程中用 post_to(queue, ...) 投递同样的事件
+    """
+    def __init__(self, stream=None, interval=0.1, json_mode=None, json_update_interval=1.0):
+        self.stream = stream or sys.stdout
         self.interval = interval
-        self.stop_event = threading.Event()
-        self.thread = None
-        self.lock = threading.Lock()
-        # Braille 字符
+        if json_mode is None:
+            json_mode = os.environ.get("PIM_PROGRESS") == "json" or not self.stream.isatty()
+        self.json_mode = json_mode
+        self.json_update_interval = json_update_interval
+        self.events = queue.Queue()
+        self.external = []
+        self.tasks = {}
+        self.order = []
+        self.ids = itertools.count(1)
+        self.write_lock = threading.Lock()
         self.spinner_cycle = itertools.cycle(['⠋', '⠙', '⠹', '⠸', '⠼', '⠴', '⠦', '⠧', '⠇', '⠏'])
+        self.thread = None
+        self.stop_event = threading.Event()
+        # 结束事件立即唤醒渲染线程，AsyncSpinner.stop() 不必等满一个 interval
+        self.wake = threading.Event()
+        self.line_active = False
+        self.cols = 80
+        self.cols_checked = 0.0
+
+    # ---------- 投递端 (任意线程) ----------
+    def start_task(self, message, total=None):
+        task_id = f"{os.getpid()}-{next(self.ids)}"
+        self.post(task_id, 'start', message=message, total=total)
+        return task_id
+
+    def post(self, task_id, kind='update', **fields):
+        self._ensure_thread()
+        self.events.put((time.time(), task_id, kind, fields))
+        if kind == 'end': self.wake.set()
+
+    def attach(self, mp_queue):
+        """接入子进程事件队列 (multiprocessing.Queue)"""
+        self.external.append(mp_queue)
+        self._ensure_thread()
+
+    def log(self, text):
+        """输出一行永久文本 (表格行 / 警告)，不与状态行互相覆盖"""
+        with self.write_lock:
+            if self.line_active and not self.json_mode:
+                self.stream.write("\r\033[K")
+            self.stream.write(text + "\n")
+            self.stream.flush()
+            self.line_active = False
+
+    # ---------- 渲染线程 ----------
+    def _ensure_thread(self):
+        if self.thread is not None and self.thread.is_alive(): return
+        with self.write_lock:
+            if self.thread is not None and self.thread.is_alive(): return
+            self.stop_event.clear()
+            self.thread = threading.Thread(target=self._run, name="progress-render", daemon=True)
+            self.thread.start()
+
+    def _drain(self):
+        changed = False
+        while True:
+            try:
+                ev = self.events.get_nowait()
+            except queue.Empty:
+                break
+            self._apply(*ev)
+            changed = True
+        for q in self.external:
+            while True:
+                try:
+                    ev = q.get_nowait()
+                except Exception:
+                    break
+                self._apply(*ev)
+                changed = True
+        return changed
+
+    def _apply(self, ts, task_id, kind, fields):
+        if kind == 'start':
+            self.tasks[task_id] = {'message': fields.get('message', ""), 'done': 0, 'total': fields.get('total'),
+                                   'started': ts, 'last_json': 0.0}
+            self.order.append(task_id)
+        task = self.tasks.get(task_id)
+        if task is None: return
+        for k in ('message', 'done', 'total'):
+            if fields.get(k) is not None: task[k] = fields[k]
+        if self.json_mode:
+            if kind == 'update' and ts - task['last_json'] < self.json_update_interval: return
+            task['last_json'] = ts
+            rec = {'ts': round(ts, 3), 'task': task_id, 'event': kind, 'message': strip_ansi(task['message'])}
+            if task['total'] is not None: rec.update({'done': task['done'], 'total': task['total']})
+            if kind == 'end': rec['elapsed_s'] = round(ts - task['started'], 3)
+            with self.write_lock:
+                self.stream.write(json.dumps(rec, ensure_ascii=False) + "\n")
+                self.stream.flush()
+        if kind == 'end':
+            self.tasks.pop(task_id, None)
+            self.order.remove(task_id)
+
+    def _render(self):
+        now = time.time()
+        if now - self.cols_checked > 1.0:
+            self.cols = shutil.get_terminal_size((80, 20)).columns
+            self.cols_checked = now
+        with self.write_lock:
+            if not self.order:
+                if self.line_active:
+                    self.stream.write(f"\r\033[K{CURSOR_SHOW}")
+                    self.stream.flush()
+                    self.line_active = False
+                return
+            task = self.tasks[self.order[-1]]
+            extra = f" (+{len(self.order) - 1})" if len(self.order) > 1 else ""
+            count = f" [{task['done']}/{task['total']}]" if task['total'] else ""
+            body = _visible_truncate(task['message'] + count, max(10, self.cols - 5 - len(extra)))
+            self.stream.write(f"\r{CURSOR_HIDE}{body} {C_GREEN}{next(self.spinner_cycle)}{C_END}{extra}\033[K")
+            self.stream.flush()
+            self.line_active = True
+
+    def _run(self):
+        while not self.stop_event.is_set():
+            self._drain()
+            if not self.json_mode: self._render()
+            self.wake.wait(self.interval)
+            self.wake.clear()
+        self._drain()
+        if not self.json_mode: self._render()
+
+    def shutdown(self):
+        self.stop_event.set()
+        self.wake.set()
+        if self.thread is not None: self.thread.join()
+        if not self.json_mode:
+            with self.write_lock:
+                self.stream.write(CURSOR_SHOW)
+                self.stream.flush()
+
+_service = None
+_service_lock = threading.Lock()
+
+def get_progress():
+    global _service
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                _service = ProgressService()
+                atexit.register(_service.shutdown)
+    return _service
+
+def log_line(text):
+    get_progress().log(text)
+
+def post_to(mp_queue, task_id, kind='update', **fields):
+    """子进程中投递进度事件到父进程 attach 的队列"""
+    mp_queue.put((time.time(), task_id, kind, fields))
+
+# ==========================================
+# Async Spinner (兼容接口，事件交给 ProgressService 渲染)
+# ==========================================
+class AsyncSpinner:
+    def __init__(self, message="", interval=0.1, total=None):
+        self.message = message
+        self.total = total
+        self.task_id = None
+        self.service = get_progress()
 
     def __enter__(self):
-        # 如果不是终端（如重定向到文件），直接打印并跳过
-        if not sys.stdout.isatty():
-            print(self.message)
-            return self
-
-        sys.stdout.write(CURSOR_HIDE)
-        sys.stdout.flush()
-        
-        self.stop_event.clear()
-        self.thread = threading.Thread(target=self._spin)
-        self.thread.daemon = True 
-        self.thread.start()
+        self.task_id = self.service.start_task(self.message, total=self.total)
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        if self.thread:
-            self.stop_event.set()
-            self.thread.join()
-            
-            # 恢复光标并清理行
-            sys.stdout.write(f"\r{CURSOR_SHOW}")
-            # 用静态消息覆盖，清除 spinner 字符
-            # 这里我们需要重新计算长度以清除残留
-            cols = shutil.get_terminal_size((80, 20)).columns
-            clean_msg = self._truncate(self.message, cols - 1)
-            sys.stdout.write(f"\r{clean_msg} \033[K") # \033[K 清除行尾
-            sys.stdout.flush()
-
-    def _truncate(self, text, max_len):
-        """简单粗暴的截断，忽略颜色代码长度的精细计算（为了性能和稳定性）"""
-        # 注意：这里按字符截断，ANSI颜色代码可能会占用长度导致实际显示更短，
-        # 但这比换行刷屏要好。为了安全，我们预留更多空间。
-        if len(text) > max_len:
-            return text[:max_len-3] + "..."
-        return text
-
-    def _spin(self):
-        while not self.stop_event.is_set():
-            spin_char = next(self.spinner_cycle)
-            
-            # 获取当前终端宽度
-            cols = shutil.get_terminal_size((80, 20)).columns
-            # 预留 5 个字符给 spinner 和边距
-            avail_len = max(10, cols - 5)
-            
-            # 构造行内容
-            display_msg = self._truncate(self.message, avail_len)
-            line = f"\r{display_msg} {C_GREEN}{spin_char}{C_END}\033[K"
-            
-            with self.lock:
-                sys.stdout.write(line)
-                sys.stdout.flush()
-            
-            time.sleep(self.interval)
-
-    def update_message(self, new_message):
+        self.stop()
+        return False
+
+    def update_message(self, new_message, done=None):
         self.message = new_message
-        
+        if self.task_id is not None:
+            self.service.post(self.task_id, message=new_message, done=done)
+
     def stop(self):
-        """手动停止旋转，用于在with块内部发生错误需要打印日志时"""
-        self.stop_event.set()
-        if self.thread and self.thread.is_alive():
-            self.thread.join()
-        # 清理当前行
-        sys.stdout.write("\r" + " " * 80 + "\r")
-        sys.stdout.flush()
+        """结束该任务 (可在 with 块内提前调用，随后打印的错误信息不会被状态行覆盖)"""
+        if self.task_id is None: return
+        self.service.post(self.task_id, 'end')
+        self.task_id = None
+        # 等渲染线程处理完结束事件，保证随后的输出不被旧状态行覆盖
+        deadline = time.time() + 2 * self.service.interval
+        while not self.service.events.empty() and time.time() < deadline:
+            time.sleep(0.005)
 
 # ==========================================
 # Legacy Helper
@@ -1,11 +1,15 @@
 import os
+import sys
+import json
 import glob
 import yaml
-import torch
-import torch.nn as nn
-import torch.fx as fx
-import torchvision.models as models
-from dataclasses import dataclass
+import hashlib
+import argparse
+from dataclasses import dataclass, asdict
+
+# 层提取逻辑或输出格式变化时递增，旧 manifest 条目随之失效
+CONVERTER_VERSION = 2
+DEFAULT_INPUT_SIZE = (1, 3, 224, 224)
 
 # === 数据结构 ===
 @dataclass
@@ -24,128 +28,333 @@ class LayerParams:
     Hdilation: int = 1
     Groups: int = 1
 
+# 决定问题描述内容的全部字段 (不含层名)，形状相同的层共享同一个 shape_id
+SHAPE_FIELDS = ['N', 'C', 'M', 'P', 'Q', 'R', 'S', 'Wstride', 'Hstride', 'Wdilation', 'Hdilation', 'Groups']
+
+def shape_id(params):
+    """层形状的内容哈希，params 可以是 LayerParams 或 manifest 中的 dict"""
+    if not isinstance(params, dict): params = asdict(params)
+    key = "|".join(f"{k}={params.get(k, 1)}" for k in SHAPE_FIELDS)
+    return hashlib.sha1(key.encode()).hexdigest()[:16]
+
+def write_problem_yaml(filename, params):
+    problem = {
+        'problem': {
+            'version': 0.4,
+            'shape': {
+                'name': 'CNN_Layer',
+                'dimensions': ['C', 'M', 'R', 'S', 'N', 'P', 'Q'],
+                'coefficients': [
+                    {'name': 'Wstride', 'default': 1},
+                    {'name': 'Hstride', 'default': 1},
+                    {'name': 'Wdilation', 'default': 1},
+                    {'name': 'Hdilation', 'default': 1}
+                ],
+                'data_spaces': [
+                    {
+                        'name': 'Weights',
+                        'projection': [[['C']], [['M']], [['R']], [['S']]]
+                    },
+                    {
+                        'name': 'Inputs',
+                        'projection': [
+                            [['N']],
+                            [['C']],
+                            # [修正] R/P 是高度，对应 Hdilation/Hstride
+                            [['R', 'Hdilation'], ['P', 'Hstride']],
+                            # [修正] S/Q 是宽度，对应 Wdilation/Wstride
+                            [['S', 'Wdilation'], ['Q', 'Wstride']]
+                        ]
+                    },
+                    {
+                        'name': 'Outputs',
+                        'projection': [[['N']], [['M']], [['P']], [['Q']]],
+                        'read_write': True
+                    }
+                ]
+            },
+            'instance': {
+                'C': params.C, 'M': params.M, 'R': params.R, 'S': params.S,
+                'N': params.N, 'P': params.P, 'Q': params.Q,
+                'Wstride': getattr(params, 'Wstride', 1),
+                'Hstride': getattr(params, 'Hstride', 1),
+                'Wdilation': getattr(params, 'Wdilation', 1),
+                'Hdilation': getattr(params, 'Hdilation', 1)
+            }
+        }
+    }
+    with open(filename, 'w') as f:
+        yaml.dump(problem, f, default_flow_style=False)
+
 # === 核心转换器 ===
-class WorkloadConverter(fx.Interpreter):
-    def __init__(self, model, input_size=(1, 3, 224, 224), output_dir="configs/prob"):
-        super().__init__(fx.symbolic_trace(model))
+class WorkloadConverter:
+    """
+    用 FX 形状传播提取卷积层参数。
+    模型与输入都放在 meta 设备上，只传播 shape/dtype，不执行任何卷积运算。
+    """
+    def __init__(self, model, input_size=DEFAULT_INPUT_SIZE, output_dir="configs/prob"):
+        import torch.fx as fx
+        self.graph_module = fx.symbolic_trace(model)
         self.input_size = input_size
         self.output_dir = output_dir
         self.generated_files = []
-        os.makedirs(output_dir, exist_ok=True)
 
-    def run(self):
+    def extract_layers(self):
+        import torch
+        import torch.nn as nn
+        from torch.fx.passes.shape_prop import ShapeProp
+
+        gm = self.graph_module.to('meta')
         try:
-            dummy_input = torch.randn(self.input_size)
-            super().run(dummy_input)
+            ShapeProp(gm).propagate(torch.empty(self.input_size, device='meta'))
         except Exception as e:
-            print(f"  [Warning] FX Trace partial fail: {e}")
-        return self.generated_files
+            print(f"  [Warning] FX shape propagation partial fail: {e}")
+
+        layers = []
+        for node in gm.graph.nodes:
+            if node.op != 'call_module': continue
+            submod = gm.get_submodule(node.target)
+            if not isinstance(submod, nn.Conv2d): continue
+            in_meta = node.args[0].meta.get('tensor_meta') if isinstance(node.args[0], torch.fx.Node) else None
+            out_meta = node.meta.get('tensor_meta')
+            if in_meta is None or out_meta is None: break
 
-    def call_module(self, target, args: tuple, kwargs: dict):
-        output = super().call_module(target, args, kwargs)
-        submod = self.fetch_attr(target)
-        params = None
-        # 替换非法字符，增加索引
-        layer_idx = len(self.generated_files)
-        layer_name = f"{layer_idx:03d}_" + target.replace('.', '_')
-        
-        if isinstance(submod, nn.Conv2d):
-            input_tensor = args[0]
-            N, C, H, W = input_tensor.shape
-            _, M, P, Q = output.shape
-            
-            params = LayerParams(
+            N, C, H, W = in_meta.shape
+            _, M, P, Q = out_meta.shape
+            # 替换非法字符，增加索引
+            layer_name = f"{len(layers):03d}_" + node.target.replace('.', '_')
+            layers.append(LayerParams(
                 name=layer_name,
                 N=N, C=C, M=M, P=P, Q=Q,
                 R=submod.kernel_size[0], S=submod.kernel_size[1],
                 Wstride=submod.stride[1], Hstride=submod.stride[0],
                 Wdilation=submod.dilation[1], Hdilation=submod.dilation[0],
                 Groups=submod.groups
-            )
-            
-        if params:
-            filename = os.path.join(self.output_dir, f"{layer_name}.yaml")
-            self._write_yaml(filename, params)
+            ))
+        return layers
+
+    def run(self):
+        self.layers = self.extract_layers()
+        os.makedirs(self.output_dir, exist_ok=True)
+        for params in self.layers:
+            filename = os.path.join(self.output_dir, f"{params.name}.yaml")
+            write_problem_yaml(filename, params)
             self.generated_files.append(filename)
-            
-        return output
-
-    def _write_yaml(self, filename, params):
-        problem = {
-            'problem': {
-                'version': 0.4,
-                'shape': {
-                    'name': 'CNN_Layer',
-                    'dimensions': ['C', 'M', 'R', 'S', 'N', 'P', 'Q'],
-                    'coefficients': [
-                        {'name': 'Wstride', 'default': 1},
-                        {'name': 'Hstride', 'default': 1},
-                        {'name': 'Wdilation', 'default': 1},
-                        {'name': 'Hdilation', 'default': 1}
-                    ],
-                    'data_spaces': [
-                        {
-                            'name': 'Weights', 
-                            'projection': [[['C']], [['M']], [['R']], [['S']]]
-                        },
-                        {
-                            'name': 'Inputs', 
-                            'projection': [
-                                [['N']], 
-                                [['C']], 
-                                # [修正] R/P 是高度，对应 Hdilation/Hstride
-                                [['R', 'Hdilation'], ['P', 'Hstride']], 
-                                # [修正] S/Q 是宽度，对应 Wdilation/Wstride
-                                [['S', 'Wdilation'], ['Q', 'Wstride']]
-                            ]
-                        },
-                        {
-                            'name': 'Outputs', 
-                            'projection': [[['N']], [['M']], [['P']], [['Q']]], 
-                            'read_write': True
-                        }
-                    ]
-                },
-                'instance': {
-                    'C': params.C, 'M': params.M, 'R': params.R, 'S': params.S,
-                    'N': params.N, 'P': params.P, 'Q': params.Q,
-                    'Wstride': getattr(params, 'Wstride', 1),
-                    'Hstride': getattr(params, 'Hstride', 1),
-                    'Wdilation': getattr(params, 'Wdilation', 1),
-                    'Hdilation': getattr(params, 'Hdilation', 1)
-                }
-            }
-        }
-        with open(filename, 'w') as f:
-            yaml.dump(problem, f, default_flow_style=False)
+        return self.generated_files
 
 # === 管理器 ===
 class WorkloadManager:
     def __init__(self, config_dir="configs/prob/generated"):
         self.config_dir = config_dir
+        self.manifest_path = os.path.join(config_dir, "manifest.json")
+        self.registry_path = os.path.join(config_dir, "shapes.json")
         os.makedirs(self.config_dir, exist_ok=True)
 
-    def generate_full_model(self, model_name="resnet18"):
-        model_dir = os.path.join(self.config_dir, model_name)
-        
-        # 即使文件存在也强制重新生成，以确保修正后的格式被应用
-        # existing_files = sorted(glob.glob(os.path.join(model_dir, "*.yaml")))
-        # if len(existing_files) > 0: return existing_files
+    @staticmethod
+    def manifest_key(model_name, input_size):
+        return f"{model_name}|{'x'.join(str(d) for d in input_size)}|v{CONVERTER_VERSION}"
+
+    @staticmethod
+    def workload_name(model_name, input_size):
+        return f"{model_name}@{'x'.join(str(d) for d in input_size)}"
 
-        print(f"[Workload] Generating full workload for {model_name}...")
+    def _load_manifest(self):
+        if not os.path.exists(self.manifest_path): return {}
         try:
-            if model_name == "resnet18":
-                model = models.resnet18()
-            elif model_name == "mobilenet_v2":
-                model = models.mobilenet_v2()
+            with open(self.manifest_path, 'r') as f: return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_manifest(self, manifest):
+        tmp_path = f"{self.manifest_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+
+    def _model_dir(self, model_name, input_size):
+        if tuple(input_size) == DEFAULT_INPUT_SIZE:
+            return os.path.join(self.config_dir, model_name)
+        return os.path.join(self.config_dir, f"{model_name}_{'x'.join(str(d) for d in input_size)}")
+
+    def _materialize(self, model_dir, layers):
+        """按 manifest 中的层参数写出缺失的问题描述文件 (无需 torch)"""
+        os.makedirs(model_dir, exist_ok=True)
+        files = []
+        for layer in layers:
+            filename = os.path.join(model_dir, f"{layer['name']}.yaml")
+            if not os.path.exists(filename):
+                write_problem_yaml(filename, LayerParams(**layer))
+            files.append(filename)
+        return files
+
+    def generate_full_model(self, model_name="resnet18", input_size=DEFAULT_INPUT_SIZE):
+        """单个模型；未知模型名抛出 ValueError，其它转换失败返回空列表"""
+        return self.generate_batch([(model_name, input_size)], jobs=1)[(model_name, tuple(input_size))]
+
+    def generate_batch(self, specs, jobs=None):
+        """
+        批量生成多个 (model, input_size) 的问题描述文件
+        manifest 未命中的规格分发到 jobs 个子进程并行提取 (torch 只在子进程中加载)，
+        manifest / 形状注册表 / YAML 只由当前进程写入，避免并发写冲突
+        返回 {(model, input_size): [files]}
+        """
+        specs = list(dict.fromkeys((m, tuple(s)) for m, s in specs))
+        manifest = self._load_manifest()
+        misses = [spec for spec in specs if self.manifest_key(*spec) not in manifest]
+
+        errors = {}
+        if misses:
+            print(f"[Workload] Generating {len(misses)} workload(s): {', '.join(m for m, _ in misses)}...")
+            jobs = max(1, min(jobs or os.cpu_count() or 1, len(misses)))
+            if jobs == 1:
+                extracted = [_extract_spec(spec) for spec in misses]
             else:
-                model = models.resnet18()
-            
-            converter = WorkloadConverter(model, output_dir=model_dir)
-            files = converter.run()
-            print(f"[Workload] Generated {len(files)} layers.")
-            return sorted(files)
-            
-        except Exception as e:
-            print(f"[Error] Model conversion failed: {e}")
-            return []
+                from concurrent.futures import ProcessPoolExecutor
+                with ProcessPoolExecutor(max_workers=jobs) as pool:
+                    extracted = list(pool.map(_extract_spec, misses))
+
+            manifest = self._load_manifest()
+            for spec, (layers, error) in zip(misses, extracted):
+                if error is not None:
+                    errors[spec] = error
+                    continue
+                manifest[self.manifest_key(*spec)] = {
+                    'model': spec[0],
+                    'input_size': list(spec[1]),
+                    'converter_version': CONVERTER_VERSION,
+                    'layers': layers
+                }
+                print(f"[Workload] {spec[0]} {'x'.join(map(str, spec[1]))}: {len(layers)} layers.")
+            self._save_manifest(manifest)
+
+        results = {}
+        for spec in specs:
+            if spec in errors:
+                kind, msg = errors[spec]
+                if kind == 'ValueError': raise ValueError(msg)
+                print(f"[Error] Model conversion failed: {msg}")
+                results[spec] = []
+                continue
+            layers = manifest[self.manifest_key(*spec)]['layers']
+            results[spec] = sorted(self._materialize(self._model_dir(*spec), layers))
+        self._register_shapes({spec: manifest[self.manifest_key(*spec)]['layers'] for spec in specs if spec not in errors})
+        return results
+
+    # ------------------------------------------------------------
+    # 全局层形状注册表
+    # ------------------------------------------------------------
+    def _load_registry(self):
+        if not os.path.exists(self.registry_path): return {}
+        try:
+            with open(self.registry_path, 'r') as f: return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _register_shapes(self, spec_layers):
+        """
+        把各工作负载的层登记到 shapes.json：shape_id -> 形状参数 + 共享的问题描述文件 + 使用者列表
+        不同模型 / 分辨率中形状相同的层指向同一个 shapes/<shape_id>.yaml
+        """
+        registry = self._load_registry()
+        changed = False
+        for (model_name, input_size), layers in spec_layers.items():
+            workload = self.workload_name(model_name, input_size)
+            for layer in layers:
+                sid = shape_id(layer)
+                entry = registry.get(sid)
+                if entry is None:
+                    shape = {k: layer.get(k, 1) for k in SHAPE_FIELDS}
+                    entry = registry[sid] = {'shape': shape, 'file': os.path.join("shapes", f"{sid}.yaml"), 'users': []}
+                    changed = True
+                shape_file = os.path.join(self.config_dir, entry['file'])
+                if not os.path.exists(shape_file):
+                    os.makedirs(os.path.dirname(shape_file), exist_ok=True)
+                    write_problem_yaml(shape_file, LayerParams(name=sid, **entry['shape']))
+                user = f"{workload}/{layer['name']}"
+                if user not in entry['users']:
+                    entry['users'].append(user)
+                    changed = True
+        if changed:
+            tmp_path = f"{self.registry_path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(registry, f, indent=2)
+            os.replace(tmp_path, self.registry_path)
+        return registry
+
+    def shape_of(self, prob_path):
+        """按问题描述文件反查 shape_id (通过 manifest 中的层参数，不解析 YAML)"""
+        name = os.path.splitext(os.path.basename(prob_path))[0]
+        model_dir = os.path.dirname(os.path.abspath(prob_path))
+        for entry in self._load_manifest().values():
+            if os.path.abspath(self._model_dir(entry['model'], entry['input_size'])) != model_dir: continue
+            for layer in entry['layers']:
+                if layer['name'] == name: return shape_id(layer)
+        return None
+
+    def shape_files(self, model_name, input_size=DEFAULT_INPUT_SIZE):
+        """
+        按层顺序返回该工作负载对应的共享形状文件 shapes/<shape_id>.yaml (同形状的层返回同一路径)
+        需先经 generate_batch / generate_full_model 生成
+        """
+        entry = self._load_manifest().get(self.manifest_key(model_name, tuple(input_size)))
+        if entry is None: return []
+        return [os.path.join(self.config_dir, "shapes", f"{shape_id(layer)}.yaml") for layer in entry['layers']]
+
+    def shape_file(self, sid):
+        entry = self._load_registry().get(sid)
+        return os.path.join(self.config_dir, entry['file']) if entry else None
+
+
+def _build_model(model_name):
+    import torch
+    import torchvision.models as models
+    if model_name not in models.list_models(module=models):
+        raise ValueError(f"Unknown model '{model_name}' (not a torchvision classification model)")
+    # 直接在 meta 设备上构建模型，连权重初始化也不做实际计算
+    with torch.device('meta'):
+        return models.get_model(model_name)
+
+def _extract_spec(spec):
+    """子进程入口：返回 (layers, None) 或 (None, (异常类型名, 信息))"""
+    model_name, input_size = spec
+    try:
+        model = _build_model(model_name)
+        layers = WorkloadConverter(model, input_size=input_size, output_dir=None).extract_layers()
+        return [asdict(p) for p in layers], None
+    except Exception as e:
+        return None, (type(e).__name__, str(e))
+
+def parse_spec(text):
+    """
+    "model[:H[xW]][:N]" -> (model, (N, 3, H, W))，例如 resnet18、mobilenet_v2:160、resnet50:224:8
+    """
+    parts = text.split(":")
+    model_name = parts[0]
+    N, H, W = 1, DEFAULT_INPUT_SIZE[2], DEFAULT_INPUT_SIZE[3]
+    if len(parts) > 1 and parts[1]:
+        hw = parts[1].lower().split("x")
+        H, W = int(hw[0]), int(hw[-1])
+    if len(parts) > 2 and parts[2]:
+        N = int(parts[2])
+    return model_name, (N, DEFAULT_INPUT_SIZE[1], H, W)
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate Timeloop problem files for a set of workloads")
+    parser.add_argument("specs", nargs="+", help="model[:H[xW]][:N], e.g. resnet18 mobilenet_v2:160 resnet50:224:8")
+    parser.add_argument("--jobs", type=int, default=None, help="parallel extraction processes (default: CPU count)")
+    parser.add_argument("--config-dir", default="configs/prob/generated")
+    args = parser.parse_args()
+
+    wm = WorkloadManager(args.config_dir)
+    try:
+        results = wm.generate_batch([parse_spec(s) for s in args.specs], jobs=args.jobs)
+    except ValueError as e:
+        print(f"[Error] {e}")
+        return 2
+    registry = wm._load_registry()
+    total = sum(len(files) for files in results.values())
+    print(f"[Workload] {len(results)} workload(s), {total} layers, {len(registry)} unique shapes in registry.")
+    return 0 if all(results.values()) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
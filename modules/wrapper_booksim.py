@@ -1,10 +1,11 @@
 import os
-import subprocess
 import re
+from modules.sim_runner import SimRunner
 
 class BookSimWrapper:
-    def __init__(self, booksim_bin_path="./booksim"):
+    def __init__(self, booksim_bin_path="./booksim", runner=None):
         self.bin_path = booksim_bin_path
+        self.runner = runner or SimRunner({'booksim': {'timeout_s': 30}})
         # 如果找不到二进制文件，会发出警告，但允许代码继续运行(返回模拟值)
         if not os.path.exists(self.bin_path):
             self.mock_mode = True
@@ -52,13 +53,13 @@ class BookSimWrapper:
         # 2. 调用 BookSim
         cmd = [self.bin_path, cfg_file]
         try:
-            res = subprocess.run(cmd, capture_output=True, text=True, timeout=30)
-            if res.returncode != 0:
+            res = self.runner.run(cmd, simulator="booksim")
+            if not res['success']:
                 return 100, 0 # Error fallback
             
             # 3. 解析日志获取 Latency
             # Look for: "Packet latency average = 25.321"
-            lat_match = re.search(r"Packet latency average = ([\d\.]+)", res.stdout)
+            lat_match = re.search(r"Packet latency average = ([\d\.]+)", res['stdout'])
             latency = float(lat_match.group(1)) if lat_match else 20.0
             
             # 简单的能耗估算: Latency * Rate * E_per_hop
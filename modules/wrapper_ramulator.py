@@ -1,28 +1,45 @@
-import subprocess
 import os
 import re
 import sys
 import math
+import time
+from modules.tracing import span
+from modules.sim_runner import SimRunner
+from modules.visualizer import log_line
 
 C_RED = '\033[91m'
 C_YELLOW = '\033[93m'
 C_END = '\033[0m'
 
+# Ramulator 1 defaultmapping 为 RoBaRaCoCh：地址先去掉事务偏移 (prefetch_size x channel_width / 8 字节)，
+# 紧接着的低位就是通道号。按标准列出事务字节数，用于按通道切分 trace
+TX_BYTES = {'DDR3': 64, 'DDR4': 64, 'LPDDR3': 32, 'LPDDR4': 64, 'GDDR5': 64, 'HBM': 64, 'WideIO': 32, 'WideIO2': 64}
+
+# 按通道并行仿真：trace 请求数达到 min_requests 才切分 (进程启动开销)；
+# 每个配置第一次切分前，用 trace 前 validate_lines 行分别做单进程与分片仿真，
+# 周期 / 能耗相对误差超过 tolerance 时该配置回退为单进程
+SHARDING_DEFAULTS = {'enabled': True, 'min_requests': 50000, 'validate_lines': 2000, 'tolerance': 0.02}
+
 class RamulatorWrapper:
-    def __init__(self):
+    def __init__(self, runner=None):
         self.project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
         
-        # [关键配置] 仿真器路径
-        self.ramulator_bin = "/home/yangzifeng/ramulator-pim/ramulator/ramulator"
-        self.booksim_bin   = "/home/yangzifeng/booksim2/src/booksim" 
+        # [关键配置] 仿真器路径 (可用环境变量覆盖，如基准测试中的替身程序)
+        self.ramulator_bin = os.environ.get("PIM_RAMULATOR_BIN", "/home/yangzifeng/ramulator-pim/ramulator/ramulator")
+        self.booksim_bin   = os.environ.get("PIM_BOOKSIM_BIN", "/home/yangzifeng/booksim2/src/booksim")
+        # 子进程启动器 (CoDesignEvaluator 会替换为按 CONFIG['SIM_LIMITS'] 配置的实例)
+        self.runner = runner or SimRunner()
+        self.sharding = dict(SHARDING_DEFAULTS)
+        # 配置文件 -> 分片校验是否通过
+        self.shard_validated = {}
         
         # 生成安全 tech file 供 BookSim 使用
         self.tech_file_path = self._find_or_create_tech_file()
 
         if not os.path.exists(self.ramulator_bin):
-            print(f"{C_RED}[Wrapper Warning] Ramulator-PIM binary not found at: {self.ramulator_bin}{C_END}")
+            log_line(f"{C_RED}[Wrapper Warning] Ramulator-PIM binary not found at: {self.ramulator_bin}{C_END}")
         if not os.path.exists(self.booksim_bin):
-            print(f"{C_RED}[Wrapper Warning] BookSim binary not found at: {self.booksim_bin}{C_END}")
+            log_line(f"{C_RED}[Wrapper Warning] BookSim binary not found at: {self.booksim_bin}{C_END}")
 
     def _find_or_create_tech_file(self):
         dummy_path = os.path.join(self.project_root, "configs", "ramulator", "safe_45nm.tech")
@@ -119,7 +136,125 @@ tech_file = {self.tech_file_path};
         os.makedirs(os.path.dirname(cfg_path), exist_ok=True)
         with open(cfg_path, 'w') as f: f.write(content)
 
-    def run_simulation(self, config_rel_path, trace_rel_path, output_rel_dir, network_config_path=None, num_nodes=1):
+    def _read_config(self, cfg_path):
+        cfg = {}
+        try:
+            with open(cfg_path, 'r') as f:
+                for line in f:
+                    m = re.match(r"\s*([A-Za-z_]\w*)\s*=\s*([^;#\s]+)", line)
+                    if m: cfg[m.group(1)] = m.group(2)
+        except OSError: pass
+        return cfg
+
+    def _channel_layout(self, cfg_path):
+        """(通道数, 事务偏移位数)；映射不是 defaultmapping、通道数不是 2 的幂或标准未知时返回 None"""
+        cfg = self._read_config(cfg_path)
+        try: channels = int(cfg.get('channels', 1))
+        except ValueError: return None
+        if channels < 2 or channels & (channels - 1): return None
+        if cfg.get('mapping', 'defaultmapping') != 'defaultmapping': return None
+        if cfg.get('standard') not in TX_BYTES: return None
+        return channels, TX_BYTES[cfg['standard']].bit_length() - 1
+
+    def planned_shards(self, config_rel_path, requests):
+        """该 trace 将被切成的分片数 (1 表示单进程)，供调度器按此申请核心"""
+        abs_config = os.path.join(self.project_root, config_rel_path)
+        if not self.sharding.get('enabled') or requests < self.sharding.get('min_requests', 0): return 1
+        if self.shard_validated.get(abs_config) is False: return 1
+        layout = self._channel_layout(abs_config)
+        return layout[0] if layout else 1
+
+    def _shard_trace(self, trace_path, out_dir, layout, max_lines=None):
+        """
+        按通道切分 trace：每个请求去掉通道位后写入对应通道的分片 (单通道 Ramulator 看到的地址)
+        返回各分片路径 (空分片为 None)
+        """
+        channels, tx_bits = layout
+        ch_bits = channels.bit_length() - 1
+        tx_mask = (1 << tx_bits) - 1
+        groups = [[] for _ in range(channels)]
+        with open(trace_path, 'r') as f:
+            for n, line in enumerate(f):
+                if max_lines is not None and n >= max_lines: break
+                parts = line.split()
+                if len(parts) < 2: continue
+                addr = int(parts[0], 16)
+                local = ((addr >> (tx_bits + ch_bits)) << tx_bits) | (addr & tx_mask)
+                groups[(addr >> tx_bits) & (channels - 1)].append(f"{hex(local)} {parts[1]}\n")
+        base = os.path.join(out_dir, os.path.basename(trace_path))
+        paths = []
+        for ch, lines in enumerate(groups):
+            if not lines:
+                paths.append(None)
+                continue
+            path = f"{base}.ch{ch}"
+            with open(path, 'w') as f: f.writelines(lines)
+            paths.append(path)
+        return paths
+
+    def _single_channel_config(self, abs_config, out_dir):
+        """分片仿真用的配置：channels = 1，其余与原配置相同"""
+        path = os.path.join(out_dir, "ramulator_1ch.cfg")
+        with open(abs_config, 'r') as f: text = f.read()
+        with open(path, 'w') as f: f.write(re.sub(r"^(\s*channels\s*=\s*)\d+", r"\g<1>1", text, flags=re.MULTILINE))
+        return path
+
+    def _run_ramulator(self, abs_config, trace_path, stats_path):
+        """单个 Ramulator 进程，返回 (cycles, energy_pj, runner 结果)"""
+        cmd_ram = [self.ramulator_bin, abs_config, "--mode=dram", "--stats", stats_path, trace_path]
+        res = self.runner.run(cmd_ram, simulator="ramulator", cwd=os.path.dirname(stats_path))
+        if not res['success']: return 0, 0.0, res
+        if not os.path.exists(stats_path):
+            self.runner.parse_failure(res)
+            return 0, 0.0, res
+        cycles, energy = self._parse_ramulator1_stats(stats_path)
+        return cycles, energy, res
+
+    def _run_ramulator_sharded(self, abs_config, trace_path, out_dir, layout, parallel, max_lines=None, tag="ch"):
+        """
+        各通道分片各用一个单通道 Ramulator 并行仿真 (最多 parallel 个进程同时运行)
+        合并：周期取各通道最大值 (通道并行工作)，能耗求和；返回 (cycles, energy_pj, 失败列表)
+        """
+        shard_dir = os.path.join(out_dir, f"shards_{tag}")
+        os.makedirs(shard_dir, exist_ok=True)
+        cfg_1ch = self._single_channel_config(abs_config, shard_dir)
+        shards = [p for p in self._shard_trace(trace_path, shard_dir, layout, max_lines) if p]
+        jobs = [(p, os.path.join(out_dir, f"{os.path.basename(p)}.stats")) for p in shards]
+
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=max(1, min(parallel, len(jobs) or 1))) as pool:
+            outs = list(pool.map(lambda job: self._run_ramulator(cfg_1ch, job[0], job[1]), jobs))
+        failures = [res for _, _, res in outs if not res['success']]
+        if failures: return 0, 0.0, failures
+        return max((c for c, _, _ in outs), default=0), sum(e for _, e, _ in outs), []
+
+    def validate_sharding(self, abs_config, trace_path, out_dir, parallel=1):
+        """
+        在 trace 前若干行上对比单进程仿真与分片合并结果；返回 (是否一致, 详情)
+        详情: {'single': (cycles, energy), 'sharded': (cycles, energy), 'err_cycles', 'err_energy'}
+        """
+        layout = self._channel_layout(abs_config)
+        if layout is None: return False, {'reason': "config is not shardable"}
+        n = self.sharding.get('validate_lines', 2000)
+        val_dir = os.path.join(out_dir, "shard_validate")
+        os.makedirs(val_dir, exist_ok=True)
+        prefix = os.path.join(val_dir, "prefix.trace")
+        with open(trace_path, 'r') as src, open(prefix, 'w') as dst:
+            for i, line in enumerate(src):
+                if i >= n: break
+                dst.write(line)
+
+        cyc_1, e_1, res = self._run_ramulator(abs_config, prefix, prefix + ".stats")
+        cyc_n, e_n, failures = self._run_ramulator_sharded(abs_config, prefix, val_dir, layout, parallel, tag="validate")
+        if not res['success'] or failures or cyc_1 <= 0:
+            return False, {'reason': "simulation failed"}
+        err_c = abs(cyc_n - cyc_1) / cyc_1
+        err_e = abs(e_n - e_1) / e_1 if e_1 > 0 else 0.0
+        tol = self.sharding.get('tolerance', 0.02)
+        return err_c <= tol and err_e <= tol, {'single': (cyc_1, e_1), 'sharded': (cyc_n, e_n),
+                                               'err_cycles': round(err_c, 4), 'err_energy': round(err_e, 4)}
+
+    def run_simulation(self, config_rel_path, trace_rel_path, output_rel_dir, network_config_path=None, num_nodes=1, parallel=1):
         abs_config = os.path.join(self.project_root, config_rel_path)
         base_trace_path = os.path.join(self.project_root, trace_rel_path)
         stats_filename = os.path.basename(base_trace_path) + ".stats"
@@ -127,52 +262,77 @@ tech_file = {self.tech_file_path};
         booksim_log_path = os.path.join(self.project_root, output_rel_dir, "booksim.log")
         os.makedirs(os.path.dirname(abs_stats_path), exist_ok=True)
 
-        # 1. Ramulator
+        # 仿真器失败的结构化记录 (sim_runner.run 的返回值)，由评估器记录到层结果中
+        failures = []
+
+        # 1. Ramulator (大 trace 按通道分片并行仿真)
         ram_cycles, ram_energy_pj = 0, 0.0
-        if os.path.exists(self.ramulator_bin):
-            cmd_ram = [self.ramulator_bin, abs_config, "--mode=dram", "--stats", abs_stats_path, base_trace_path]
-            try:
-                subprocess.run(cmd_ram, capture_output=True, text=True, timeout=30)
-                if os.path.exists(abs_stats_path): 
-                    ram_cycles, ram_energy_pj = self._parse_ramulator1_stats(abs_stats_path)
-            except: pass
+        t0 = time.perf_counter()
+        with span("ramulator", nodes=num_nodes) as ram_span:
+            if os.path.exists(self.ramulator_bin):
+                requests = 0
+                try:
+                    with open(base_trace_path, 'r') as f: requests = sum(1 for _ in f)
+                except OSError: pass
+                shards = self.planned_shards(config_rel_path, requests)
+                if shards > 1 and abs_config not in self.shard_validated:
+                    ok, detail = self.validate_sharding(abs_config, base_trace_path, os.path.dirname(abs_stats_path), parallel)
+                    self.shard_validated[abs_config] = ok
+                    if not ok:
+                        log_line(f"{C_YELLOW}[Wrapper Warning] channel-sharded Ramulator disagrees with a single run "
+                                 f"for {os.path.basename(abs_config)} {detail}; using single-process runs{C_END}")
+                        shards = 1
+                ram_span.set(shards=shards)
+                if shards > 1:
+                    ram_cycles, ram_energy_pj, fails = self._run_ramulator_sharded(
+                        abs_config, base_trace_path, os.path.dirname(abs_stats_path), self._channel_layout(abs_config), parallel)
+                    failures += fails
+                else:
+                    ram_cycles, ram_energy_pj, res = self._run_ramulator(abs_config, base_trace_path, abs_stats_path)
+                    if not res['success']: failures.append(res)
+        ram_time_s = time.perf_counter() - t0
 
         # 2. BookSim
         noc_energy_pj, noc_cycles = 0.0, 0.0
-        if ram_cycles > 0 and os.path.exists(self.booksim_bin):
-            temp_cfg_name = f"booksim_generated_{os.path.basename(output_rel_dir)}.cfg"
-            abs_net_cfg = os.path.join(self.project_root, output_rel_dir, temp_cfg_name)
+        t0 = time.perf_counter()
+        with span("booksim", nodes=num_nodes):
+            if ram_cycles > 0 and os.path.exists(self.booksim_bin):
+                temp_cfg_name = f"booksim_generated_{os.path.basename(output_rel_dir)}.cfg"
+                abs_net_cfg = os.path.join(self.project_root, output_rel_dir, temp_cfg_name)
             
-            total_reqs = 1000
-            try:
-                with open(base_trace_path, 'r') as f: total_reqs = sum(1 for _ in f)
-            except: pass
+                total_reqs = 1000
+                try:
+                    with open(base_trace_path, 'r') as f: total_reqs = sum(1 for _ in f)
+                except: pass
             
-            real_inj = float(total_reqs) / float(ram_cycles * max(num_nodes, 1))
-            self._generate_booksim_config(abs_net_cfg, real_inj, min(total_reqs, 5000), num_nodes)
+                real_inj = float(total_reqs) / float(ram_cycles * max(num_nodes, 1))
+                self._generate_booksim_config(abs_net_cfg, real_inj, min(total_reqs, 5000), num_nodes)
             
-            cmd_book = [self.booksim_bin, abs_net_cfg]
-            try:
-                with open(booksim_log_path, 'w') as log_f:
-                    subprocess.run(cmd_book, stdout=log_f, stderr=subprocess.STDOUT, check=False, timeout=15)
-                
-                if os.path.exists(booksim_log_path):
-                    with open(booksim_log_path, 'r') as log_f:
-                        output_text = log_f.read()
-                        avg_hops, noc_power_w, accepted_rate = self._parse_booksim_output(output_text)
+                cmd_book = [self.booksim_bin, abs_net_cfg]
+                res = self.runner.run(cmd_book, simulator="booksim", cwd=os.path.dirname(abs_net_cfg),
+                                      stdout_path=booksim_log_path)
+                if not res['success']: failures.append(res)
+                try:
+                    if res['success'] and os.path.exists(booksim_log_path):
+                        with open(booksim_log_path, 'r') as log_f:
+                            output_text = log_f.read()
+                            avg_hops, noc_power_w, accepted_rate = self._parse_booksim_output(output_text)
                         
-                        if noc_power_w > 0:
-                            noc_energy_pj = noc_power_w * ram_cycles * 1000.0
+                            if noc_power_w > 0:
+                                noc_energy_pj = noc_power_w * ram_cycles * 1000.0
                         
-                        if accepted_rate > 0.0001:
-                            noc_cycles = float(total_reqs) / (accepted_rate * max(num_nodes, 1))
-                        else:
-                            noc_cycles = float(total_reqs) * 10 
-            except: pass
+                            if accepted_rate > 0.0001:
+                                noc_cycles = float(total_reqs) / (accepted_rate * max(num_nodes, 1))
+                            else:
+                                noc_cycles = float(total_reqs) * 10 
+                except: pass
 
         return {
             'ram_cycles': ram_cycles, 
             'ram_energy_pj': ram_energy_pj, 
             'noc_energy_pj': noc_energy_pj, 
-            'noc_cycles': noc_cycles
+            'noc_cycles': noc_cycles,
+            'ram_time_s': ram_time_s,
+            'noc_time_s': time.perf_counter() - t0,
+            'failures': failures
         }
@@ -1,11 +1,13 @@
-import subprocess
 import os
 import sys
+from modules.sim_runner import SimRunner, describe
+from modules.visualizer import log_line
 
 class TimeloopWrapper:
-    def __init__(self):
+    def __init__(self, runner=None):
         # 尝试自动寻找 tl
         self.timeloop_mapper_bin = "tl" 
+        self.runner = runner or SimRunner()
 
     def run_mapper(self, arch_path, prob_path, mapper_path, output_dir, component_dir=None):
         """
@@ -23,27 +25,16 @@ class TimeloopWrapper:
 
         cmd = [self.timeloop_mapper_bin, "mapper"] + input_files + ["-o", output_dir]
 
-        try:
-            # 使用 subprocess.run 而不是 check_output，这样可以检查 returncode
-            result = subprocess.run(
-                cmd, 
-                capture_output=True, 
-                text=True, 
-                timeout=120  # 防止死锁
-            )
-            
-            if result.returncode != 0:
-                # 记录简短错误，但不抛出异常中断主程序
-                # print(f"[Wrapper] Timeloop failed with code {result.returncode}")
-                return False
-            
-            # 再次确认文件生成
-            stats_file = os.path.join(output_dir, "timeloop-mapper.stats.txt")
-            return os.path.exists(stats_file)
-
-        except subprocess.TimeoutExpired:
-            print(f"[Wrapper] Timeloop timed out after 120s")
+        # 进程组超时清理 / 资源上限 / 瞬时失败重试由 SimRunner 负责
+        result = self.runner.run(cmd, simulator="timeloop-mapper")
+        if not result['success']:
+            # 记录简短错误，但不抛出异常中断主程序
+            if result['failure'] != 'exit_code': log_line(f"[Wrapper] Timeloop failed: {describe(result)}")
             return False
-        except Exception as e:
-            print(f"[Wrapper] Execution error: {e}")
+
+        # 再次确认文件生成
+        stats_file = os.path.join(output_dir, "timeloop-mapper.stats.txt")
+        if not os.path.exists(stats_file):
+            self.runner.parse_failure(result)
             return False
+        return True